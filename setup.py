@@ -12,7 +12,7 @@ with io.open('README.md', encoding='utf8') as fp:
 
 requirements = ['localimport >=1.5.2,<2.0.0', 'pathlib2 >=2.3.0,<3.0.0', 'six >=1.11.0,<2.0.0']
 extras_require = {}
-extras_require['nppm'] = ['pip', 'distlib >=0.2.4,<0.3.0', 'hammock >=0.2.4,<0.3.0', 'nr.fs >=1.5.0,<2.0.0', 'nr.parsing.core >=0.1.0,<0.2.0', 'requests >=2.13.0,<3.0.0']
+extras_require['nppm'] = ['pip', 'distlib >=0.2.4,<0.3.0', 'nr.fs >=1.5.0,<2.0.0', 'nr.parsing.core >=0.1.0,<0.2.0', 'requests >=2.13.0,<3.0.0']
 
 import os, fnmatch
 def _collect_data_files(data_files, target, path, include, exclude):
@@ -207,6 +207,7 @@ class Module(object):
     self.exports = NotImplemented
     self.loaded = False
     self.exception = None
+    self.load_time = None
     self.require = _context.Require(self.context, self.directory)
 
   def __repr__(self):
@@ -377,11 +378,32 @@ class PathAugmentor(object):
   def augment_path(self, path):
     raise NotImplementedError
 
+  def close(self):
+    """
+    Called when the #Context is torn down to release any resources that the
+    augmentor may hold.
+    """
+
+    pass
+
 
 class ZipPathAugmentor(PathAugmentor):
+  """
+  Converts paths that point into a ZIP file to #utils.path.ZipPath objects.
+  Every augmentor has its own #utils.path.zippath.ZipArchiveRegistry unless
+  one is specified explicitly.
+  """
+
+  def __init__(self, registry=None, max_open=32):
+    if registry is None:
+      registry = utils.path.zippath.ZipArchiveRegistry(max_open)
+    self.registry = registry
 
   def augment_path(self, path):
     try:
-      return utils.path.zippath.make(path)
+      return utils.path.zippath.make(path, registry=self.registry)
     except ValueError:
       return path
+
+  def close(self):
+    self.registry.close_all()
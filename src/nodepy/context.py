@@ -26,8 +26,9 @@ Concrete implementation of the Node.py runtime.
 
 from itertools import chain
 from nodepy import base, extensions, loader, resolver, utils
-from nodepy.utils import tracing
+from nodepy.utils import events, fetch, memory, tracing
 from nodepy.utils.config import Config
+import collections
 import contextlib
 import localimport
 import os
@@ -173,7 +174,13 @@ class Require(object):
     If a tracer is already running, a #RuntimeError is raised. The tracer
     that is being used is determined from the `NODEPY_TRACING` environment
     variable. If `NODEPY_TRACIN=`, it is treated as if it was not set.
-    Otherwise, the variable must contain a request that will be required using
+    The built-in tracers are `http` (the default, a #tracing.HttpServerTracer,
+    its *options* are `host`, `port` and `socket`), `file` and `profile` (a
+    #tracing.SamplingProfilerTracer, its *options* are `frequency`, `path`,
+    `interval`, `report` and `top`) and `contention` (a
+    #tracing.ContentionTracer, its *options* are `interval`, `threshold`,
+    `path`, `report_interval`, `locks` and `top`). Otherwise, the variable
+    must contain a request that will be required using
     #Context.require() and it must provide a #starttracing() function that
     creates a tracer, starts and returns it.
     """
@@ -192,12 +199,24 @@ class Require(object):
 
     if isinstance(tracer, str):
       if tracer in ('http', ''):
-        tracer = tracing.HttpServerTracer(host=options.get('host'), port=options.get('port'))
+        tracer = tracing.HttpServerTracer(host=options.get('host'),
+          port=options.get('port'), context=self.context,
+          unix_socket=options.get('socket'))
       elif tracer == 'file':
         tracer = tracing.HtmlFileTracer(fname=options.get('path'), interval=options.get('interval'))
+      elif tracer == 'profile':
+        tracer = tracing.SamplingProfilerTracer(context=self.context,
+          frequency=options.get('frequency'), fname=options.get('path'),
+          interval=options.get('interval'), report=options.get('report'),
+          top=options.get('top'))
+      elif tracer == 'contention':
+        tracer = tracing.ContentionTracer(interval=options.get('interval'),
+          threshold=options.get('threshold'), fname=options.get('path'),
+          report_interval=options.get('report_interval'),
+          track_locks=options.get('locks', False), top=options.get('top'))
       else:
         tracer = self.context.require(tracer).starttracing(daemon, options)
-        if not isinstance(tracer, BaseThread):
+        if not isinstance(tracer, tracing.BaseThread):
           raise RuntimeError('"{}:starttracing()" did not return a '
             'tracing.BaseThread instance, got {} instead'
             .format(tracer, type(tracer).__name__))
@@ -225,6 +244,25 @@ class Require(object):
       self.context.tracer.stop(wait)
       self.context.tracer = None
 
+  def memory_snapshot(self):
+    """
+    Returns a #tracemalloc.Snapshot that can be passed to #memory_report().
+    Memory allocations must be traced, see `nodepy --trace-memory` and
+    #memory.start().
+    """
+
+    return memory.take_snapshot()
+
+  def memory_report(self, since=None, snapshot=None):
+    """
+    Returns a #memory.MemoryReport that attributes the allocations in the
+    *snapshot* (or a new snapshot) to the modules and packages of the
+    context. If *since* is an older snapshot, the report contains the
+    differences instead, which is useful to track down leaks.
+    """
+
+    return memory.memory_report(self.context, snapshot, since)
+
   def new(self, directory):
     """
     Creates a new #Require instance for the specified *directory*.
@@ -252,7 +290,17 @@ class Context(object):
     packages (Dict[pathlib.Path, base.Package]):
     module_stack (List[base.Module]):
     localimport (localimport.localimport):
-    tracer (Union[None, tracing.HtmlFileTracer, tracing.HttpServerTracer]):
+    tracer (Union[None, tracing.BaseThread]):
+    fetcher (fetch.UrlFetcher): Loads the content of #utils.path.UrlPath
+      objects created for this context. Created from the configuration on
+      first access, or inherited from the parent context.
+    metrics (collections.Counter): Runtime counters, `resolve` (number of
+      requests resolved by this context), `resolve_cache_hits` (requests
+      that resolved to a module that was already known), `load`,
+      `load_errors` and `load_time` (seconds spent in #load_module()).
+    events (events.EventBus): Emits events about resolving and loading
+      modules. Events of a sub-context are dispatched to the subscribers of
+      the parent context as well.
   """
 
   modules_directory = '.nodepy/modules'
@@ -260,6 +308,7 @@ class Context(object):
   package_manifest = 'nodepy.json'
   package_main = 'index'
   link_suffix = '.nodepy-link'
+  zipped_package_suffix = '.zip'
 
   def __init__(self, maindir=None, config=None, parent=None, isolate=True, inherit=True):
     if not config and not parent:
@@ -283,6 +332,9 @@ class Context(object):
     self.main_module = None
     self.localimport = localimport.localimport([])
     self.tracer = None
+    self.metrics = collections.Counter()
+    self.events = events.EventBus(self, parent.events if parent else None)
+    self._fetcher = None
 
   @property
   def config(self):
@@ -296,6 +348,18 @@ class Context(object):
       return self._maindir
     return self.parent.maindir
 
+  @property
+  def fetcher(self):
+    if self._fetcher is None:
+      if self.parent:
+        return self.parent.fetcher
+      self._fetcher = fetch.UrlFetcher.from_config(self.config)
+    return self._fetcher
+
+  @fetcher.setter
+  def fetcher(self, fetcher):
+    self._fetcher = fetcher
+
   @contextlib.contextmanager
   def enter(self, isolated=False):
     """
@@ -342,7 +406,23 @@ class Context(object):
       sys.path.extend(add_path)
       stack.add(reload_pkg_resources())
       sys.path_importer_cache.clear()
-      yield
+      try:
+        yield
+      finally:
+        self.close()
+
+  def close(self):
+    """
+    Releases resources held by the context, such as the ZIP archives that
+    have been opened by the #pathaugmentors and the HTTP connections of the
+    #fetcher. The context remains usable afterwards, resources are
+    re-acquired on demand.
+    """
+
+    for augmentor in self.pathaugmentors:
+      augmentor.close()
+    if self._fetcher is not None:
+      self._fetcher.close()
 
   def augment_path(self, path):
     for augmentor in self.pathaugmentors:
@@ -373,7 +453,12 @@ class Context(object):
         directory = self.maindir
       request = base.Request(self, directory, request, additional_search_path)
 
+    bus = self.events
+    if bus:
+      bus.emit('resolve_start', request=request, directory=request.directory)
+
     # Check all resolvers in the context.
+    self.metrics['resolve'] += 1
     module = None
     exception = base.ResolveError(request)
     for resolver in chain([self.resolver], self.resolvers):
@@ -409,8 +494,14 @@ class Context(object):
               'in the cache'.format(type(resolver).__name__)
         raise RuntimeError(msg)
       request.context.modules[module.filename] = module
+      if bus:
+        bus.emit('resolve_end', request=request, directory=request.directory,
+          module=module, cache_hit=have_module is not None, error=None)
       return module
 
+    if bus:
+      bus.emit('resolve_end', request=request, directory=request.directory,
+        module=None, cache_hit=False, error=exception)
     raise exception
 
   def register_module(self, module, force=False):
@@ -459,15 +550,24 @@ class Context(object):
     if do_init:
       module.init()
     self.module_stack.append(module)
+    tstart = events.timer()
     try:
       module.load()
     except:
       module.exception = sys.exc_info()
       del self.modules[module.filename]
+      self.metrics['load_errors'] += 1
+      if self.events:
+        self.events.emit('load_error', module=module, exc_info=module.exception)
       raise
     else:
       module.loaded = True
     finally:
+      module.load_time = events.timer() - tstart
+      self.metrics['load'] += 1
+      if len(self.module_stack) == 1:
+        # Only count the outermost load, nested loads are included.
+        self.metrics['load_time'] += module.load_time
       if self.module_stack.pop() is not module:
         raise RuntimeError('Context.module_stack corrupted')
 
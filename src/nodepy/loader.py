@@ -25,6 +25,7 @@ Implements the #resolver.StdResolverLoader interface for Python modules.
 """
 
 from nodepy import base, resolver, utils
+from nodepy.utils.events import timer
 import codecs
 import sys
 
@@ -33,8 +34,11 @@ class PythonModule(base.Module):
 
   def _load_code(self):
     # TODO: Properly peek into the file for a coding: <name> instruction.
-    with self.filename.open('rb') as fp:
-      return codecs.getreader('utf8')(fp).read()
+    data = utils.path.read_buffer(self.filename)
+    bus = self.context.events
+    if bus:
+      bus.emit('source_read', module=self, size=len(data))
+    return codecs.utf_8_decode(data, 'strict', True)[0]
 
   def _init_extensions(self):
     for ext_module in self.iter_extensions():
@@ -43,15 +47,27 @@ class PythonModule(base.Module):
 
   def _preprocess_code(self, code):
     if code:
+      bus = self.context.events
       for ext_module in self.iter_extensions():
         if hasattr(ext_module, 'preprocess_python_source'):
+          tstart = timer() if bus else None
           code = ext_module.preprocess_python_source(self, code)
+          if bus:
+            bus.emit('preprocess', module=self, extension=ext_module,
+              duration=timer() - tstart)
     return code
 
   def _exec_code(self, code):
     if code:
+      bus = self.context.events
+      tstart = timer() if bus else None
       code = compile(code, str(self.filename), 'exec', dont_inherit=True)
+      if bus:
+        bus.emit('compile', module=self, duration=timer() - tstart)
+        bus.emit('exec_start', module=self)
       exec(code, vars(self.namespace))
+      if bus:
+        bus.emit('exec_end', module=self)
 
   def load(self):
     self.loaded = True
@@ -24,7 +24,7 @@
 The Node.py command-line interface.
 """
 
-from nodepy.utils import path
+from nodepy.utils import memory, path
 from nodepy.loader import PythonModule
 import argparse
 import code
@@ -118,6 +118,8 @@ def get_argument_parser(prog):
   parser.add_argument('-c', '--eval', nargs='...', default=[], help='A snippet of code and arguments to run.')
   parser.add_argument('script', nargs='...', default=[], help='A script or module and arguments to run.')
   parser.add_argument('--no-override-argv0', action='store_true', help='Keep sys.argv[0] instead of overriding it with the module filename.')
+  parser.add_argument('--offline', action='store_true', help='Load URL modules from the HTTP cache only.')
+  parser.add_argument('--trace-memory', action='store_true', help='Trace memory allocations with tracemalloc and print the memory usage per package and module on exit.')
   return parser
 
 
@@ -128,12 +130,16 @@ def main(argv=None, prog=None):
   args.nodepy_path.insert(0, '.')
   args.nodepy_path.insert(0, get_stdlib_path())
   args.post_mortem_debugger = args.post_mortem_debugger or check_pmd_envvar()
+  if args.trace_memory:
+    memory.start()
 
   # Initialize the Node.py context.
   ctx = nodepy.context.Context(pathlib.Path(args.context_dir or '.'))
   args.nodepy_path.insert(0, ctx.modules_directory)  # TODO:  Use the nearest available .nodepy/modules directory?
   ctx.resolver.paths.extend(x for x in map(pathlib.Path, args.nodepy_path))
   ctx.localimport.path.extend(args.python_path)
+  if args.offline:
+    ctx.fetcher.offline = True
 
   sys.argv = [sys.argv[0]] + (args.script or args.eval)[1:]
 
@@ -152,7 +158,7 @@ def main(argv=None, prog=None):
       def exec_handler():
         request = args.script[0]
         try:
-          filename = path.urlpath.make(request)
+          filename = path.urlpath.make(request, fetcher=ctx.fetcher)
         except ValueError:
           filename = request
         ctx.main_module = ctx.resolve(filename)
@@ -166,7 +172,11 @@ def main(argv=None, prog=None):
       ctx.main_module = entry_module
       def exec_handler():
         code.interact('', local=vars(entry_module.namespace))
-    entry_module.run_with_exec_handler(exec_handler)
+    try:
+      entry_module.run_with_exec_handler(exec_handler)
+    finally:
+      if args.trace_memory:
+        ctx.require.memory_report().format(sys.stderr)
 
 
 if __name__ == '__main__':
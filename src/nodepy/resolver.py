@@ -61,7 +61,7 @@ def resolve_link(context, path, with_link_target=False):
   """
 
   if not utils.path.is_directory_listing_supported(path):
-    return path
+    return (None, path) if with_link_target else path
 
   link_target = None
   link_suffix = context.link_suffix
@@ -88,6 +88,26 @@ def resolve_link(context, path, with_link_target=False):
     return path
 
 
+def resolve_zipped_package(context, path, string):
+  """
+  Checks if the package that the module request *string* aims for is
+  installed as a ZIP archive in the modules directory *path* (that is
+  `<path>/<name>.zip`, see #Context.zipped_package_suffix) and returns the
+  path of the requested module inside that archive. Returns #None if there
+  is no such archive.
+  """
+
+  parts = str(string).split('/')
+  count = 2 if parts[0].startswith('@') else 1
+  if len(parts) < count or not all(parts[:count]):
+    return None
+  archive = path.joinpath(*parts[:count])
+  archive = archive.with_name(archive.name + context.zipped_package_suffix)
+  if not archive.is_file():
+    return None
+  return archive.joinpath(*parts[count:])
+
+
 class StdResolver(base.Resolver):
   """
   The standard resolver implementation.
@@ -117,66 +137,84 @@ class StdResolver(base.Resolver):
       return None
 
     if request.string.is_absolute():
-      path = resolve_link(request.context, request.string.path())
+      path = request.context.augment_path(request.string.path())
+      path = resolve_link(request.context, path)
       package = self.find_package(request.context, path)
       return confront_loaders(path, package) or (None, None, None)
 
     for path in paths:
-      filename = request.string.joinwith(path)
-      filename = request.context.augment_path(filename)
-      max_dir, filename = resolve_link(request.context, filename, True)
-      if max_dir:
-        linked_paths.append(max_dir)
-
-      package = None
-      is_package_root = False
-
-      # Check if the request aims for a top-level package.
-      is_dir = filename.is_dir()
-      if is_dir:
-        package = self.package_for_directory(request.context, filename)
-      if is_dir and package is not None:
-        is_package_root = True
-      else:
-        # We pass the max_dir from resolve_link() here to ensure that we
-        # don't load a package manifest from another package that is located
-        # above the linked package (which could potentially not contain a
-        # package manifest).
-        package = self.find_package(request.context, filename, stop_at=max_dir)
-
-      filename = filename.absolute()
-
-      # Concatenate with the package main.
-      if is_package_root:
-        filename = filename.joinpath(package.main)
-
-      # Apply Package.resolve_root unless the package root is requested
-      # and the package entry point is explicitly defined.
-      if (package and
-          package.resolve_root and
-          not request.string.is_relative() and (
-            not is_package_root or
-            (is_package_root and not package.is_main_defined)
-          )):
-        rel = filename.relative_to(package.directory)
-        filename = package.directory.joinpath(package.resolve_root, rel)
-
-      result = confront_loaders(filename, package)
-
-      # If no loader matched the current filename, and this request aims
-      # for the package entry point, try asking the loaders if they manage
-      # to load the package's directory.
-      if not result and is_package_root and not package.is_main_defined:
-        directory = package.directory
-        if package.resolve_root:
-          directory = directory.joinpath(package.resolve_root)
-        result = confront_loaders(directory, package)
-
+      result = self.__try_path(request.string.joinwith(path), request,
+        linked_paths, confront_loaders)
+      # Packages that are installed as ZIP archives are only looked for if
+      # the request can not be resolved otherwise, saving a stat() for every
+      # search path of the common requests.
+      if result is None and request.string.is_module():
+        filename = resolve_zipped_package(request.context, path, request.string)
+        if filename is not None:
+          result = self.__try_path(filename, request, linked_paths, confront_loaders)
       if result is not None:
         return result
 
     return None, None, None
 
+  def __try_path(self, filename, request, linked_paths, confront_loaders):
+    """
+    Attempts to load the *request* from *filename*, the request joined with
+    one of the search paths. Returns a tuple of (package, loader, path) or
+    #None.
+    """
+
+    filename = request.context.augment_path(filename)
+    max_dir, filename = resolve_link(request.context, filename, True)
+    if max_dir:
+      linked_paths.append(max_dir)
+
+    package = None
+    is_package_root = False
+
+    # Check if the request aims for a top-level package.
+    is_dir = filename.is_dir()
+    if is_dir:
+      package = self.package_for_directory(request.context, filename)
+    if is_dir and package is not None:
+      is_package_root = True
+    else:
+      # We pass the max_dir from resolve_link() here to ensure that we
+      # don't load a package manifest from another package that is located
+      # above the linked package (which could potentially not contain a
+      # package manifest).
+      package = self.find_package(request.context, filename, stop_at=max_dir)
+
+    filename = filename.absolute()
+
+    # Concatenate with the package main.
+    if is_package_root:
+      filename = filename.joinpath(package.main)
+
+    # Apply Package.resolve_root unless the package root is requested
+    # and the package entry point is explicitly defined.
+    if (package and
+        package.resolve_root and
+        not request.string.is_relative() and (
+          not is_package_root or
+          (is_package_root and not package.is_main_defined)
+        )):
+      rel = filename.relative_to(package.directory)
+      filename = package.directory.joinpath(package.resolve_root, rel)
+
+    result = confront_loaders(filename, package)
+
+    # If no loader matched the current filename, and this request aims
+    # for the package entry point, try asking the loaders if they manage
+    # to load the package's directory.
+    if not result and is_package_root and not package.is_main_defined:
+      directory = package.directory
+      if package.resolve_root:
+        directory = directory.joinpath(package.resolve_root)
+      result = confront_loaders(directory, package)
+
+    return result
+
   def package_for_directory(self, context, path):
     path = path.absolute().resolve(strict=False)
     package = context.packages.get(path)
@@ -212,7 +250,9 @@ class StdResolver(base.Resolver):
 
     filename = filename.resolve()
     module = request.context.modules.get(filename)
-    if not module:
+    if module:
+      request.context.metrics['resolve_cache_hits'] += 1
+    else:
       module = loader.load_module(request.context, package, filename)
     return module
 
@@ -0,0 +1,148 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+A lightweight event bus that allows observing what the Node.py runtime does
+without patching it. Every #Context has an #EventBus in #Context.events.
+The runtime emits the following events:
+
+* `resolve_start` &ndash; `request`, `directory`
+* `resolve_end` &ndash; `request`, `directory`, `module` (#None if the
+  request could not be resolved), `cache_hit` (#True if the module was
+  already known to the context) and `error` (the #base.ResolveError)
+* `source_read` &ndash; `module`, `size` (the size of the source in bytes)
+* `preprocess` &ndash; `module`, `extension`, `duration` (emitted after every
+  extension that preprocessed the source)
+* `compile` &ndash; `module`, `duration`
+* `exec_start`, `exec_end` &ndash; `module` (`exec_end` is only emitted if
+  the module executed successfully)
+* `load_error` &ndash; `module`, `exc_info`
+
+Events are only created if there is a subscriber, the runtime checks the
+truth value of the bus before it collects the event data.
+
+```python
+def on_event(event):
+  print(event.name, event.timestamp, event.module)
+require.context.events.subscribe(on_event, 'exec_start', 'exec_end')
+```
+"""
+
+import threading
+import time
+
+# A monotonic clock with the highest available resolution.
+timer = getattr(time, 'perf_counter', time.time)
+
+ALL = '*'
+
+
+class Event(object):
+  """
+  An event emitted on an #EventBus. The *timestamp* is taken from #timer().
+  The event data is available as attributes or from the #data dictionary.
+  """
+
+  __slots__ = ('name', 'timestamp', 'context', 'data')
+
+  def __init__(self, name, timestamp, context, data):
+    self.name = name
+    self.timestamp = timestamp
+    self.context = context
+    self.data = data
+
+  def __repr__(self):
+    return '<Event {!r} at {:.6f}>'.format(self.name, self.timestamp)
+
+  def __getattr__(self, key):
+    try:
+      return self.data[key]
+    except KeyError:
+      raise AttributeError(key)
+
+
+class EventBus(object):
+  """
+  Dispatches events to subscribers. Events are also dispatched to the
+  subscribers of the *parent* bus. The bus evaluates to #False if there are
+  no subscribers, emitters should check it before they collect the data for
+  an event.
+
+  Subscribing and unsubscribing replaces the lists of callbacks under a lock
+  instead of modifying them, thus it is safe to do from other threads and
+  from within a callback.
+  """
+
+  def __init__(self, context=None, parent=None):
+    self.context = context
+    self.parent = parent
+    self._subscribers = {}
+    self._lock = threading.Lock()
+
+  def __bool__(self):
+    return bool(self._subscribers) or bool(self.parent)
+
+  __nonzero__ = __bool__
+
+  def subscribe(self, callback, *names):
+    """
+    Subscribes *callback* to the events with the specified *names*, or to
+    all events if no names are specified. Returns *callback*.
+    """
+
+    with self._lock:
+      for name in (names or [ALL]):
+        self._subscribers[name] = self._subscribers.get(name, []) + [callback]
+    return callback
+
+  def unsubscribe(self, callback, *names):
+    """
+    Removes a *callback* that has been registered with #subscribe() for
+    the specified event *names* (or for all events).
+    """
+
+    with self._lock:
+      for name in (names or [ALL]):
+        callbacks = [x for x in self._subscribers.get(name, []) if x != callback]
+        if callbacks:
+          self._subscribers[name] = callbacks
+        else:
+          self._subscribers.pop(name, None)
+
+  def emit(self, name, **data):
+    """
+    Creates an #Event and dispatches it to the subscribers. Exceptions in
+    the callbacks propagate to the code that emits the event.
+    """
+
+    if self:
+      self.dispatch(Event(name, timer(), self.context, data))
+
+  def dispatch(self, event):
+    subscribers = self._subscribers
+    for callback in subscribers.get(event.name, ()):
+      callback(event)
+    for callback in subscribers.get(ALL, ()):
+      callback(event)
+    if self.parent:
+      self.parent.dispatch(event)
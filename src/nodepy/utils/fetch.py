@@ -0,0 +1,542 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Fetching of remote resources for #nodepy.utils.path.UrlPath. Responses can
+be kept in an on-disk #HttpCache that is revalidated with conditional
+requests and that can be used to load modules while offline.
+
+An URL may pin the SHA256 hash of its content with a `#sha256=<hexdigest>`
+fragment, in which case the content is verified every time it is loaded.
+"""
+
+from __future__ import absolute_import
+from nodepy.utils import json
+from multiprocessing.pool import ThreadPool
+from six.moves import http_client
+import errno
+import hashlib
+import os
+import posixpath
+import re
+import socket
+import threading
+import time
+
+try:
+  from urllib.request import Request, urlopen, getproxies, proxy_bypass
+  from urllib.error import HTTPError
+  from urllib.parse import urldefrag, urljoin, urlsplit, urlunsplit
+except ImportError:
+  from urllib import getproxies, proxy_bypass
+  from urllib2 import Request, urlopen, HTTPError
+  from urlparse import urldefrag, urljoin, urlsplit, urlunsplit
+
+
+class IntegrityError(IOError):
+  """
+  Raised when the content of an URL does not match its pinned hash.
+  """
+
+
+class OfflineError(IOError):
+  """
+  Raised when an URL that is not cached is requested in offline mode.
+  """
+
+
+def split_integrity(url):
+  """
+  Splits a `#sha256=<hexdigest>` fragment from *url* and returns a tuple of
+  the URL without the fragment and the hexdigest (or #None).
+  """
+
+  url, fragment = urldefrag(url)
+  if fragment.startswith('sha256='):
+    return url, fragment[7:].lower()
+  return url, None
+
+
+class HttpCache(object):
+  """
+  Stores the content of URLs in a *directory* together with the validators
+  (`ETag`, `Last-Modified`) that the server sent along. Every entry consists
+  of a `<key>.json` metadata file and a `<key>.data` file, where the key is
+  the SHA1 of the URL.
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+
+  def __repr__(self):
+    return '<HttpCache "{}">'.format(self.directory)
+
+  def _filename(self, url, suffix):
+    key = hashlib.sha1(url.encode('utf8')).hexdigest()
+    return os.path.join(self.directory, key + suffix)
+
+  def _write(self, filename, data):
+    tmpname = '{}.{}.{}.tmp'.format(filename, os.getpid(), threading.current_thread().ident)
+    with open(tmpname, 'wb') as fp:
+      fp.write(data)
+    if os.name == 'nt' and os.path.isfile(filename):
+      os.remove(filename)
+    os.rename(tmpname, filename)
+
+  def get(self, url):
+    """
+    Returns a tuple of the metadata dictionary and the content for *url*,
+    or #None if the URL is not cached.
+    """
+
+    try:
+      with open(self._filename(url, '.json'), 'r') as fp:
+        meta = json.load(fp)
+      with open(self._filename(url, '.data'), 'rb') as fp:
+        data = fp.read()
+    except (IOError, OSError) as exc:
+      if exc.errno != errno.ENOENT:
+        raise
+      return None
+    except json.JSONDecodeError:
+      return None
+    if meta.get('url') != url or hashlib.sha256(data).hexdigest() != meta.get('sha256'):
+      return None
+    return meta, data
+
+  def put(self, url, data, headers):
+    """
+    Stores *data* for *url* along with the validators from the response
+    *headers*. Returns the metadata dictionary.
+    """
+
+    meta = {
+      'url': url,
+      'etag': headers.get('ETag'),
+      'last_modified': headers.get('Last-Modified'),
+      'sha256': hashlib.sha256(data).hexdigest(),
+      'fetched': time.time(),
+    }
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+    self._write(self._filename(url, '.data'), data)
+    self._write(self._filename(url, '.json'), json.dumps(meta).encode('utf8'))
+    return meta
+
+  def revalidated(self, url, meta):
+    """
+    Marks the entry for *url* as revalidated by the server.
+    """
+
+    meta['fetched'] = time.time()
+    self._write(self._filename(url, '.json'), json.dumps(meta).encode('utf8'))
+
+  def remove(self, url):
+    for suffix in ('.json', '.data'):
+      try:
+        os.remove(self._filename(url, suffix))
+      except OSError as exc:
+        if exc.errno != errno.ENOENT:
+          raise
+
+
+class ConnectionPool(object):
+  """
+  Keeps idle HTTP/1.1 keep-alive connections per scheme and host so that
+  subsequent requests to the same server do not need a new TCP (and TLS)
+  handshake. Connections are used by one thread at a time, threads that
+  find no idle connection for a host open a new one.
+
+  # Parameters
+  timeout (float): The socket timeout for new connections.
+  max_idle (int): The maximum number of idle connections kept per host.
+  """
+
+  def __init__(self, timeout=None, max_idle=8):
+    self.timeout = timeout
+    self.max_idle = max_idle
+    self._idle = {}
+    self._lock = threading.Lock()
+
+  def _connect(self, scheme, netloc):
+    if scheme == 'https':
+      factory = http_client.HTTPSConnection
+    elif scheme == 'http':
+      factory = http_client.HTTPConnection
+    else:
+      raise ValueError('unsupported URL scheme: {!r}'.format(scheme))
+    if self.timeout is None:
+      return factory(netloc)
+    return factory(netloc, timeout=self.timeout)
+
+  def _acquire(self, key):
+    with self._lock:
+      idle = self._idle.get(key)
+      if idle:
+        return idle.pop(), True
+    return self._connect(*key), False
+
+  def _release(self, key, conn):
+    with self._lock:
+      idle = self._idle.setdefault(key, [])
+      if len(idle) < self.max_idle:
+        idle.append(conn)
+        return
+    conn.close()
+
+  def request(self, method, url, headers=None):
+    """
+    Sends a request and reads the complete response. Returns a tuple of the
+    response status, the response headers and the body. A request that
+    fails on a reused connection (which the server may have closed in the
+    meantime) is retried once on a new connection.
+    """
+
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    target = urlunsplit(('', '', parts.path or '/', parts.query, ''))
+    while True:
+      conn, reused = self._acquire(key)
+      try:
+        conn.request(method, target, headers=headers or {})
+        response = conn.getresponse()
+        body = response.read()
+      except (http_client.HTTPException, socket.error):
+        conn.close()
+        if reused:
+          continue
+        raise
+      if response.will_close:
+        conn.close()
+      else:
+        self._release(key, conn)
+      return response.status, response.msg, body
+
+  def close(self):
+    """
+    Closes all idle connections.
+    """
+
+    with self._lock:
+      idle, self._idle = self._idle, {}
+    for conns in idle.values():
+      for conn in conns:
+        conn.close()
+
+
+class UrlFetcher(object):
+  """
+  Loads the content of URLs. If a *cache* is specified, responses are stored
+  in it and revalidated with conditional requests on subsequent loads. In
+  *offline* mode, only the cache is used and cached entries are returned no
+  matter how old they are.
+
+  Requests are sent over the keep-alive connections of a #ConnectionPool
+  (unless a proxy is configured for the URL's scheme, in which case
+  #urlopen() is used). Python modules that are fetched with `prefetch=True`
+  are scanned for relative `require()` and `import ... from` requests and
+  these are downloaded concurrently, see #prefetch().
+
+  # Parameters
+  cache (HttpCache)
+  offline (bool)
+  timeout (float)
+  prefetch_workers (int): The number of threads that prefetch modules, zero
+    disables prefetching.
+  """
+
+  max_redirects = 5
+  _require_regex = re.compile(
+    r'''\b(?:require|import)\b[^'"\n]*?['"](\.{1,2}/[^'"\s]+)['"]''')
+
+  def __init__(self, cache=None, offline=False, timeout=None, prefetch_workers=8):
+    self.cache = cache
+    self.offline = offline
+    self.timeout = timeout
+    self.prefetch_workers = prefetch_workers
+    self.pool = ConnectionPool(timeout)
+    self._lock = threading.Lock()
+    self._exists = {}
+    self._pending = {}
+    self._prefetched = {}
+    self._probes = {}
+    self._threadpool = None
+
+  @classmethod
+  def from_config(cls, config):
+    """
+    Creates a #UrlFetcher from the `http` section of a Node.py #Config. The
+    options are `http.cache` (defaults to `~/.nodepy/cache/http`, set to an
+    empty string to disable caching), `http.offline`, `http.timeout` and
+    `http.prefetch` (the number of prefetch threads). The `NODEPY_OFFLINE`
+    environment variable enables offline mode as well.
+    """
+
+    directory = config.get('http.cache', '~/.nodepy/cache/http') if config else None
+    offline = config.get('http.offline', '') if config else ''
+    offline = offline or os.getenv('NODEPY_OFFLINE', '')
+    timeout = config.get('http.timeout') if config else None
+    prefetch = config.get('http.prefetch', '8') if config else '8'
+    return cls(
+      cache=HttpCache(os.path.expanduser(directory)) if directory else None,
+      offline=offline.strip().lower() in ('1', 'yes', 'on', 'true'),
+      timeout=float(timeout) if timeout else None,
+      prefetch_workers=int(prefetch))
+
+  def _urlopen(self, method, url, headers):
+    request = Request(url, headers=headers)
+    request.get_method = lambda: method
+    try:
+      if self.timeout is None:
+        response = urlopen(request)
+      else:
+        response = urlopen(request, timeout=self.timeout)
+    except HTTPError as exc:
+      if exc.code == 304:
+        return 304, exc.headers, None
+      raise
+    try:
+      return response.getcode(), response.info(), response.read()
+    finally:
+      response.close()
+
+  def _request(self, url, headers, method='GET'):
+    """
+    Performs a request and returns a tuple of the response status, the
+    response headers and the body. Redirects are followed. A `304 Not
+    Modified` response is returned with a body of #None, other error
+    responses raise an #HTTPError.
+    """
+
+    for _ in range(self.max_redirects + 1):
+      parts = urlsplit(url)
+      proxy = getproxies().get(parts.scheme)
+      if proxy and not proxy_bypass(parts.hostname or ''):
+        return self._urlopen(method, url, headers)
+      status, response_headers, body = self.pool.request(method, url, headers)
+      location = response_headers.get('Location')
+      if status in (301, 302, 303, 307, 308) and location:
+        url = urljoin(url, location)
+        continue
+      if status == 304:
+        return status, response_headers, None
+      if status >= 400:
+        raise HTTPError(url, status, http_client.responses.get(status, ''),
+          response_headers, None)
+      return status, response_headers, body
+    raise HTTPError(url, status, 'too many redirects', response_headers, None)
+
+  def _fetch(self, url):
+    entry = self.cache.get(url) if self.cache else None
+    if self.offline:
+      if entry is None:
+        raise OfflineError(errno.ENOENT, 'not cached (offline mode)', url)
+      return entry[1]
+    headers = {}
+    if entry and entry[0].get('etag'):
+      headers['If-None-Match'] = entry[0]['etag']
+    if entry and entry[0].get('last_modified'):
+      headers['If-Modified-Since'] = entry[0]['last_modified']
+    status, response_headers, data = self._request(url, headers)
+    if status == 304 and entry:
+      data = entry[1]
+      self.cache.revalidated(url, entry[0])
+    elif self.cache:
+      self.cache.put(url, data, response_headers)
+    return data
+
+  def _take_prefetched(self, url):
+    with self._lock:
+      pending = self._pending.pop(url, None)
+    if pending is not None:
+      pending.wait()
+    with self._lock:
+      return self._prefetched.pop(url, None)
+
+  def fetch(self, url, prefetch=False):
+    """
+    Returns the content of *url* as a byte string. Raises an #OfflineError
+    if the URL is not cached in offline mode and an #IntegrityError if the
+    URL pins a hash that does not match the content. If *prefetch* is
+    #True, the modules that the content requires are prefetched.
+    """
+
+    url, integrity = split_integrity(url)
+    data = self._take_prefetched(url)
+    if data is None:
+      data = self._fetch(url)
+    with self._lock:
+      self._exists[url] = True
+
+    if integrity and hashlib.sha256(data).hexdigest() != integrity:
+      if self.cache:
+        self.cache.remove(url)
+      raise IntegrityError(errno.EIO, 'sha256 mismatch', url)
+    if prefetch:
+      self.prefetch(url, data)
+    return data
+
+  def exists(self, url):
+    """
+    Returns #True if *url* exists. The result is determined with a `HEAD`
+    request (or from the cache in offline mode) and remembered for the
+    lifetime of the fetcher. If the URL is being prefetched, the result of
+    the prefetch is awaited instead.
+    """
+
+    url = split_integrity(url)[0]
+    with self._lock:
+      if url in self._exists:
+        return self._exists[url]
+      if url in self._prefetched:
+        return True
+      pending = self._pending.get(url)
+      probe = self._probes.pop(url, None)
+    if pending is not None:
+      # The prefetch may still fail, only its result tells if the URL exists.
+      pending.wait()
+      with self._lock:
+        return self._exists.setdefault(url, False)
+    if probe is not None:
+      probe.wait()
+      with self._lock:
+        if url in self._exists:
+          return self._exists[url]
+    if self.offline:
+      result = self.cache is not None and self.cache.get(url) is not None
+    else:
+      result = self._head(url)
+    with self._lock:
+      self._exists[url] = result
+    return result
+
+  def _head(self, url):
+    try:
+      self._request(url, {}, 'HEAD')
+      return True
+    except HTTPError as exc:
+      if exc.code in (404, 410):
+        return False
+      elif exc.code in (405, 501):  # HEAD not supported by the server
+        self.fetch(url)
+        return True
+      raise
+
+  def prefetch(self, url, data):
+    """
+    Scans the Python source *data* that was loaded from *url* for relative
+    requests and starts downloading the files that they are likely to
+    resolve to (a `.py` suffix is added to requests without a suffix) in
+    background threads. #fetch() picks up the prefetched content. The
+    resolver checks requests without a suffix as they are first, so these
+    URLs are probed concurrently for #exists().
+    """
+
+    self._prefetch(url, data, None)
+
+  def _prefetch(self, url, data, threadpool):
+    if self.offline or self.prefetch_workers <= 0:
+      return
+    if isinstance(data, memoryview):
+      data = data.tobytes()
+    candidates = []
+    probes = []
+    for request in self._require_regex.findall(data.decode('latin1')):
+      if not posixpath.splitext(request)[1]:
+        probes.append(urljoin(url, request))
+        request += '.py'
+      candidates.append(urljoin(url, request))
+    with self._lock:
+      if threadpool is None:
+        if self._threadpool is None and candidates:
+          self._threadpool = ThreadPool(self.prefetch_workers)
+        threadpool = self._threadpool
+      elif threadpool is not self._threadpool:
+        return  # The fetcher has been closed in the meantime.
+      for candidate in candidates:
+        if candidate in self._pending or candidate in self._prefetched or \
+            candidate in self._exists:
+          continue
+        self._pending[candidate] = threadpool.apply_async(
+          self._prefetch_worker, (candidate, threadpool))
+      for probe in probes:
+        if probe in self._probes or probe in self._exists:
+          continue
+        self._probes[probe] = threadpool.apply_async(
+          self._probe_worker, (probe, threadpool))
+
+  def _prefetch_worker(self, url, threadpool):
+    try:
+      data = self._fetch(url)
+    except Exception as exc:
+      # Errors are ignored, they will be raised again if the module is
+      # actually loaded.
+      if isinstance(exc, HTTPError) and exc.code in (404, 410):
+        with self._lock:
+          self._exists[url] = False
+      return
+    with self._lock:
+      if threadpool is not self._threadpool:
+        return
+      self._prefetched[url] = data
+      self._exists[url] = True
+    self._prefetch(url, data, threadpool)
+
+  def _probe_worker(self, url, threadpool):
+    try:
+      result = self._head(url)
+    except Exception:
+      return  # exists() sends the request again.
+    with self._lock:
+      if threadpool is self._threadpool:
+        self._exists.setdefault(url, result)
+
+  def close(self):
+    """
+    Waits for pending prefetches and closes all pooled connections. The
+    fetcher remains usable afterwards.
+    """
+
+    with self._lock:
+      threadpool, self._threadpool = self._threadpool, None
+      self._pending.clear()
+      self._prefetched.clear()
+      self._probes.clear()
+    if threadpool is not None:
+      threadpool.close()
+      threadpool.join()
+    self.pool.close()
+
+
+_default_fetcher = None
+
+
+def get_default_fetcher():
+  """
+  Returns the #UrlFetcher that is used by #UrlPath objects that have not
+  been created with a fetcher explicitly. It does not use a cache.
+  """
+
+  global _default_fetcher
+  if _default_fetcher is None:
+    _default_fetcher = UrlFetcher()
+  return _default_fetcher
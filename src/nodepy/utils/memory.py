@@ -0,0 +1,223 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Attributes the memory that is allocated by a Python process to the Node.py
+modules and packages that allocated it, using #tracemalloc (Python 3.4+).
+
+Every allocation is attributed to the innermost frame on its traceback that
+belongs to a module in #Context.modules. Allocations that happened while the
+module was being loaded (ie. the module's frames were called by the loader)
+are counted separately from allocations that happened in functions of the
+module that were called later on (the steady state). Note that the main
+module is being loaded for as long as the program runs.
+
+Note that tracebacks are limited to the number of frames that #tracemalloc
+was started with. Allocations with a traceback that does not reach up to a
+Node.py module are counted as unattributed.
+"""
+
+from __future__ import absolute_import
+import collections
+import sys
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+UNATTRIBUTED = '<unattributed>'
+
+# The number of frames that are stored per allocation by #start().
+default_nframes = 32
+
+
+def _require_tracemalloc():
+  if tracemalloc is None:
+    raise RuntimeError('tracemalloc is not available in this Python version')
+
+
+def start(nframes=None):
+  """
+  Starts tracing memory allocations with *nframes* frames per traceback.
+  Does nothing if tracing has already been started.
+  """
+
+  _require_tracemalloc()
+  if not tracemalloc.is_tracing():
+    tracemalloc.start(nframes or default_nframes)
+
+
+def is_tracing():
+  return tracemalloc is not None and tracemalloc.is_tracing()
+
+
+def take_snapshot():
+  """
+  Takes a #tracemalloc.Snapshot without the allocations of #tracemalloc
+  itself. Raises a #RuntimeError if memory allocations are not traced.
+  """
+
+  _require_tracemalloc()
+  if not tracemalloc.is_tracing():
+    raise RuntimeError('memory allocations are not traced, use '
+      'nodepy --trace-memory or nodepy.utils.memory.start()')
+  snapshot = tracemalloc.take_snapshot()
+  return snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+class MemoryUsage(object):
+  """
+  The size and number of allocations that are attributed to one module or
+  package, split into allocations made while loading and afterwards. For
+  snapshot differences, the values can be negative.
+  """
+
+  __slots__ = ('name', 'package', 'load_size', 'load_count', 'size', 'count')
+
+  def __init__(self, name, package=None):
+    self.name = name
+    self.package = package
+    self.load_size = 0
+    self.load_count = 0
+    self.size = 0
+    self.count = 0
+
+  def __repr__(self):
+    return '<MemoryUsage {!r} total={} load={}>'.format(
+      self.name, self.total_size, self.load_size)
+
+  @property
+  def total_size(self):
+    return self.load_size + self.size
+
+  def add(self, size, count, load):
+    if load:
+      self.load_size += size
+      self.load_count += count
+    else:
+      self.size += size
+      self.count += count
+
+  def to_json(self):
+    return {'name': self.name, 'package': self.package,
+      'total_size': self.total_size, 'load_size': self.load_size,
+      'load_count': self.load_count, 'steady_size': self.size,
+      'steady_count': self.count}
+
+
+class MemoryReport(object):
+  """
+  The result of #memory_report(). #modules and #packages map names to
+  #MemoryUsage objects. Modules without a package are also listed as a
+  package of their own name.
+  """
+
+  def __init__(self, diff=False):
+    self.diff = diff
+    self.modules = {}
+    self.packages = {}
+
+  def _add(self, module, size, count, load):
+    if module is None:
+      name, package = UNATTRIBUTED, UNATTRIBUTED
+    else:
+      name = module.name
+      package = module.package.name if module.package else name
+    usage = self.modules.get(name)
+    if usage is None:
+      usage = self.modules[name] = MemoryUsage(name, package)
+    usage.add(size, count, load)
+    usage = self.packages.get(package)
+    if usage is None:
+      usage = self.packages[package] = MemoryUsage(package)
+    usage.add(size, count, load)
+
+  @staticmethod
+  def _sorted(usages):
+    return sorted(usages, key=lambda x: (-abs(x.total_size), x.name))
+
+  def top_modules(self, n=None):
+    return self._sorted(self.modules.values())[:n]
+
+  def top_packages(self, n=None):
+    return self._sorted(self.packages.values())[:n]
+
+  def to_json(self, top=None):
+    return {
+      'diff': self.diff,
+      'modules': [x.to_json() for x in self.top_modules(top)],
+      'packages': [x.to_json() for x in self.top_packages(top)],
+    }
+
+  def format(self, fp, top=20):
+    sign = '+' if self.diff else ''
+    for title, usages in (('Packages', self.top_packages(top)),
+                          ('Modules', self.top_modules(top))):
+      fp.write('{}:\n'.format(title))
+      fp.write('  {:>12} {:>12} {:>12}  {}\n'.format('total', 'load', 'steady', 'name'))
+      for usage in usages:
+        fp.write('  {:>{s}12} {:>{s}12} {:>{s}12}  {}\n'.format(
+          usage.total_size, usage.load_size, usage.size, usage.name, s=sign))
+      fp.write('\n')
+
+
+def memory_report(context, snapshot=None, since=None):
+  """
+  Attributes the allocations in *snapshot* (a new snapshot if omitted) to
+  the modules of the *context* and returns a #MemoryReport. If *since* is
+  an older snapshot, the report contains the differences between the two
+  snapshots.
+  """
+
+  if snapshot is None:
+    snapshot = take_snapshot()
+
+  from nodepy import loader
+  loader_filename = loader.PythonModule._exec_code.__code__.co_filename
+  modules = {str(k): v for k, v in list(context.modules.items())}
+  oldest_first = sys.version_info >= (3, 7)
+
+  if since is None:
+    stats = ((s.traceback, s.size, s.count) for s in snapshot.statistics('traceback'))
+  else:
+    stats = ((s.traceback, s.size_diff, s.count_diff)
+             for s in snapshot.compare_to(since, 'traceback'))
+
+  report = MemoryReport(diff=since is not None)
+  for traceback, size, count in stats:
+    if not size and not count:
+      continue
+    frames = reversed(traceback) if oldest_first else iter(traceback)
+    module = None
+    load = False
+    for frame in frames:
+      if module is None:
+        module = modules.get(frame.filename)
+        filename = frame.filename
+      elif frame.filename != filename:
+        # The module's code was called by the loader, not by another module.
+        load = frame.filename == loader_filename
+        break
+    report._add(module, size, count, load)
+  return report
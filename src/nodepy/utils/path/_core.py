@@ -75,3 +75,16 @@ def is_directory_listing_supported(path):
     return True
   except NotImplementedError:
     return False
+
+
+def read_buffer(path):
+  """
+  Reads the contents of the file at *path* and returns a bytes-like object.
+  Path implementations that can provide the data without copying it (such as
+  #ZipPath) may return a #memoryview.
+  """
+
+  if hasattr(path, 'read_buffer'):
+    return path.read_buffer()
+  with path.open('rb') as fp:
+    return fp.read()
@@ -24,6 +24,10 @@
 A #pathlib.Path implementation for URLs.
 """
 
+from __future__ import absolute_import
+
+from .zippath import CopyFromSourceMixin
+from .. import fetch
 import io
 import os
 import pathlib2 as pathlib
@@ -31,10 +35,8 @@ import posixpath
 import six
 
 try:
-  from urllib.request import urlopen
   from urllib.parse import urlparse, urlunparse
 except ImportError:
-  from urllib2 import urlopen
   from urlparse import urlparse, urlunparse
 
 
@@ -54,10 +56,26 @@ class _UrlFlavour(pathlib._PosixFlavour):
     )
 
 
-class PureUrlPath(pathlib.PurePath):
+class PureUrlPath(CopyFromSourceMixin, pathlib.PurePath):
+  """
+  A path that represents an URL. The *fetcher* is an optional
+  #nodepy.utils.fetch.UrlFetcher that is inherited by paths derived from
+  this path (eg. with #joinpath() or #parent) and that is used to load
+  the content of the URL.
+  """
+
   _flavour = _UrlFlavour()
   __slots__ = ()
 
+  def __new__(cls, *args, **kwargs):
+    fetcher = kwargs.pop('fetcher', None)
+    self = super(PureUrlPath, cls).__new__(cls, *args, **kwargs)
+    self._fetcher = fetcher
+    return self
+
+  def _copy_from_source(self, source):
+    self._fetcher = source._fetcher
+
   def absolute(self):
     return self
 
@@ -68,23 +86,17 @@ class PureUrlPath(pathlib.PurePath):
 class UrlPath(pathlib.Path, PureUrlPath):
   __slots__ = ()
 
-  # Wrapper for the socket._fileobject returned from #urlopen().
-  # Necessary in Python 2 because socket._fileobject does not support
-  # readable(), writable() and seekable(), and without this protocol it
-  # can not be wrapped in #io.BufferedReader or #io.TextIOWrapper.
-  class _readable(object):
-    def __init__(self, fp, seekable=False):
-      self._fp = fp
-      self._seekable = seekable
-      self._closed = False
-    def __getattr__(self, name):
-      return getattr(self._fp, name)
-    def readable(self):
-      return True
-    def writable(self):
-      return False
-    def seekable(self):
-      return self._seekable
+  def __new__(cls, *args, **kwargs):
+    fetcher = kwargs.pop('fetcher', None)
+    self = super(UrlPath, cls).__new__(cls, *args, **kwargs)
+    self._fetcher = fetcher
+    return self
+
+  @property
+  def fetcher(self):
+    if self._fetcher is None:
+      return fetch.get_default_fetcher()
+    return self._fetcher
 
   def owner(self):
     raise NotImplementedError("Path.owner() is unsupported for URLs")
@@ -95,24 +107,22 @@ class UrlPath(pathlib.Path, PureUrlPath):
   def open(self, flags='r', mode=0o666):
     if set(flags).difference('rbt'):
       raise IOError('URLs can be opened in read-mode only.')
-    if six.PY2:
-      fp = self._readable(urlopen(str(self)).fp)
-    else:
-      fp = urlopen(str(self))
-    if not isinstance(fp, io.BufferedReader):
-      fp = io.BufferedReader(fp)
+    fp = io.BytesIO(self.read_buffer())
     if 'b' not in flags:
       fp = io.TextIOWrapper(fp)
     return fp
 
+  def read_buffer(self):
+    return self.fetcher.fetch(str(self), prefetch=(self.suffix == '.py'))
+
   def is_dir(self):
     return False
 
   def is_file(self):
-    return True
+    return self.exists()
 
   def exists(self):
-    return True
+    return self.fetcher.exists(str(self))
 
   def is_symlink(self):
     return False
@@ -136,14 +146,15 @@ class UrlPath(pathlib.Path, PureUrlPath):
     raise NotImplementedError
 
 
-def make(s, pure=False):
+def make(s, pure=False, fetcher=None):
   """
   If *s* is a valid URL with a scheme and netloc, returns an #UrlPath or
   #PureUrlPath (depending on *pure*). Otherwise, a #ValueError is raised.
+  The *fetcher* is passed to the path object.
   """
 
   if isinstance(s, six.string_types):
     res = urlparse(s)
     if res.scheme and res.netloc:
-      return PureUrlPath(s) if pure else UrlPath(s)
+      return PureUrlPath(s, fetcher=fetcher) if pure else UrlPath(s, fetcher=fetcher)
   raise ValueError('not a URL: {!r}'.format(s))
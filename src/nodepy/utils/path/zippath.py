@@ -26,16 +26,20 @@ A #pathlib.Path implementation for ZIP files.
 
 from . import _core as path
 import codecs
+import collections
 import errno
 import functools
+import mmap
+import os
 import pathlib2 as pathlib
 import posixpath
 import six
+import stat
 import sys
+import struct
+import threading
 import zipfile
-
-# XXX Find a way to close all these zip files when appropriate.
-open_zipfiles = {}
+import zlib
 
 
 if six.PY2:
@@ -98,6 +102,24 @@ class PureZipPath(CopyFromSourceMixin, pathlib.PurePath):
     self._init_zipf(zipf)
     return self
 
+  def __eq__(self, other):
+    if not isinstance(other, PureZipPath):
+      return NotImplemented
+    return self._archive_key() == other._archive_key() and \
+      super(PureZipPath, self).__eq__(other)
+
+  def __ne__(self, other):
+    result = self.__eq__(other)
+    return result if result is NotImplemented else not result
+
+  def __hash__(self):
+    return hash((self._archive_key(), super(PureZipPath, self).__hash__()))
+
+  def _archive_key(self):
+    # Paths in different archives must not compare equal, otherwise they
+    # would collide in eg. Context.modules and Context.packages.
+    return getattr(self._zipf, 'filename', None) or id(self._zipf)
+
   def _copy_from_source(self, source):
     self._init_zipf(source._zipf)
 
@@ -130,16 +152,25 @@ class ZipPath(pathlib.Path, PureZipPath):
         self._info = None
     return self._info
 
+  def _is_implicit_dir(self):
+    # Archives do not necessarily contain entries for directories, they
+    # exist implicitly as the parents of their members.
+    prefix = posixpath.normpath(str(self)).strip('/') + '/'
+    dirnames = getattr(self._zipf, 'dirnames', None)
+    if dirnames is not None:
+      return prefix in dirnames
+    return any(x.startswith(prefix) for x in self._namelist)
+
   def exists(self):
     if str(self) == '/': return True
-    return self._get_zipinfo() is not None
+    return self._get_zipinfo() is not None or self._is_implicit_dir()
 
   def is_dir(self):
     if str(self) == '/': return True
     info = self._get_zipinfo()
     if info:
       return info.filename.endswith('/')
-    return False
+    return self._is_implicit_dir()
 
   def is_file(self):
     info = self._get_zipinfo()
@@ -167,18 +198,20 @@ class ZipPath(pathlib.Path, PureZipPath):
 
   def iterdir(self):
     if str(self) == '/':
-      for name in self._namelist:
-        if name.rstrip('/').count('/') == 0:
-          yield type(self)(self._zipf, name)
+      prefix = ''
     else:
       if not self.exists():
         raise FileNotFoundError('ZipFile does not contain: ' + str(self))
       if not self.is_dir():
         raise NotADirectoryError('ZipFile, item not a directory: ' + str(self))
-      filename = self._info.filename
-      for name in self._namelist:
-        if name.startswith(filename) and name.find('/', len(filename)) < 0:
-          yield type(self)(self._zipf, name)
+      prefix = posixpath.normpath(str(self)).strip('/') + '/'
+    seen = set()
+    for name in self._zipf.namelist():
+      if name.startswith(prefix) and len(name) > len(prefix):
+        child = name[len(prefix):].split('/')[0]
+        if child not in seen:
+          seen.add(child)
+          yield type(self)(self._zipf, prefix + child)
 
   def open(self, flags='r', mode=0o666):
     if 'b' in flags:
@@ -195,33 +228,320 @@ class ZipPath(pathlib.Path, PureZipPath):
       fp = codecs.getreader(sys.getdefaultencoding())(fp)
     return fp
 
+  def read_buffer(self):
+    """
+    Returns the contents of the file as a bytes-like object. If the path
+    belongs to a #ZipArchive, the data may be a #memoryview into a memory
+    mapping of the archive (see #ZipArchive.read_buffer()).
+    """
+
+    if not self.is_file():
+      raise FileNotFoundError('ZipFile item does not exist: ' + str(self))
+    if hasattr(self._zipf, 'read_buffer'):
+      return self._zipf.read_buffer(self._info)
+    return self._zipf.read(self._info)
+
   def absolute(self):
     new = super(ZipPath, self).absolute()
     return type(self)(self._zipf, posixpath.normpath(str(new)))
 
 
-def make(s, pure=False):
+def _stat_signature(st):
+  return (st.st_ino, st.st_size, st.st_mtime)
+
+
+def _is_local_path(s):
+  return isinstance(s, (pathlib.PosixPath, pathlib.WindowsPath))
+
+
+class ZipArchive(object):
+  """
+  Represents a ZIP file on the filesystem that is managed by a
+  #ZipArchiveRegistry. The file handle is opened on demand and may be closed
+  by the registry at any time, in which case it will be re-opened the next
+  time a member is read. Implements the subset of the #zipfile.ZipFile
+  interface that is used by #ZipPath.
+
+  # Parameters
+  registry (ZipArchiveRegistry)
+  filename (str)
+  signature (tuple): The inode, size and modification time of the file.
+
+  # Attributes
+  dirnames (set): The directories in the archive with a trailing slash,
+    including those that have no entry of their own.
+
+  Members can be read with #read_buffer() from a read-only memory mapping of
+  the archive, thus multiple processes that load from the same archive share
+  the page cache instead of each holding a private copy of the data. Note
+  that archives should be replaced atomically (ie. by renaming a new file
+  over the old one) rather than overwritten in place while they are mapped.
+  """
+
+  def __init__(self, registry, filename, signature):
+    self.registry = registry
+    self.filename = filename
+    self.signature = signature
+    self._zipf = None
+    self._mapping = None
+    self._read_index(zipfile.ZipFile(filename, 'r'))
+
+  def __repr__(self):
+    return '<ZipArchive "{}">'.format(self.filename)
+
+  def _read_index(self, zipf):
+    self._zipf = zipf
+    self._namelist = zipf.namelist()
+    self._infos = dict((x.filename, x) for x in zipf.infolist())
+    self.dirnames = set()
+    for name in self._namelist:
+      parts = name.split('/')
+      for i in range(1, len(parts)):
+        self.dirnames.add('/'.join(parts[:i]) + '/')
+
+  def _reopen(self):
+    with open(self.filename, 'rb') as fp:
+      signature = _stat_signature(os.fstat(fp.fileno()))
+    zipf = zipfile.ZipFile(self.filename, 'r')
+    if signature != self.signature:
+      # The archive was replaced since the index was read.
+      self.signature = signature
+      self._read_index(zipf)
+    else:
+      self._zipf = zipf
+    return zipf
+
+  def _close_handle(self):
+    if self._mapping is not None:
+      try:
+        self._mapping.close()
+      except BufferError:
+        # There are still memoryviews that reference the mapping, it will
+        # be unmapped once they are garbage collected.
+        pass
+      self._mapping = None
+    if self._zipf is not None:
+      self._zipf.close()
+      self._zipf = None
+
+  def namelist(self):
+    return self._namelist
+
+  def getinfo(self, name):
+    return self._infos[name]
+
+  def _current_info(self, info):
+    # The index is read again when the archive has been replaced while its
+    # handle was closed (see #_reopen()), the offsets of an older *info*
+    # are only valid for the file it was read from.
+    return self._infos[info.filename]
+
+  def open(self, info, mode='r'):
+    with self.registry._lock:
+      zipf = self.registry.acquire(self)
+      info = self._current_info(info)
+    return zipf.open(info, mode)
+
+  def read(self, info):
+    with self.registry._lock:
+      zipf = self.registry.acquire(self)
+      info = self._current_info(info)
+    return zipf.read(info)
+
+  def read_buffer(self, info):
+    """
+    Returns the contents of the member *info*. Stored members are returned as
+    a #memoryview of the archive's memory mapping without copying the data,
+    deflated members are decompressed straight from the mapping. Encrypted
+    members and other compression methods are read with #zipfile.ZipFile.
+    The CRC of the data is checked in any case. The member is looked up
+    again by its name in case the archive has been re-read.
+    """
+
+    if six.PY2 or info.flag_bits & 0x1 or info.compress_type not in \
+        (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+      return self.read(info)
+
+    # The registry may close the mapping when it evicts the archive. Once
+    # the memoryview exists, closing the mapping fails with a BufferError
+    # and it stays valid (see #_close_handle()).
+    with self.registry._lock:
+      zipf = self.registry.acquire(self)
+      info = self._current_info(info)
+      if self._mapping is None:
+        self._mapping = mmap.mmap(zipf.fp.fileno(), 0, access=mmap.ACCESS_READ)
+      mapping = self._mapping
+      header = struct.unpack(zipfile.structFileHeader,
+        mapping[info.header_offset:info.header_offset + zipfile.sizeFileHeader])
+      if header[0] != zipfile.stringFileHeader:
+        raise zipfile.BadZipfile('Bad magic number for file header')
+      offset = info.header_offset + zipfile.sizeFileHeader \
+        + header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH]
+      data = memoryview(mapping)[offset:offset + info.compress_size]
+
+    if info.compress_type == zipfile.ZIP_DEFLATED:
+      data = zlib.decompressobj(-15).decompress(data)
+    if zlib.crc32(data) & 0xffffffff != info.CRC:
+      raise zipfile.BadZipfile('Bad CRC-32 for file {!r}'.format(info.filename))
+    return data
+
+
+class ZipArchiveRegistry(object):
+  """
+  Keeps track of the ZIP files opened by #make(). At most *max_open* file
+  handles are kept open at a time, the least recently used archive is closed
+  when that limit is exceeded. Up to *max_not_zip* files that have been
+  found not to be ZIP files are remembered (directories unconditionally,
+  other files until they change on disk) so that repeated calls to #make()
+  for paths that have no archive in their parents do not need to open and
+  inspect them again.
+
+  An archive that is replaced on disk is detected by its inode, size and
+  modification time and will be re-read.
+  """
+
+  _directory = object()
+
+  def __init__(self, max_open=32, max_not_zip=4096):
+    self.max_open = max_open
+    self.max_not_zip = max_not_zip
+    self._archives = {}
+    self._handles = collections.OrderedDict()
+    self._not_zip = collections.OrderedDict()
+    self._lock = threading.RLock()
+
+  def __len__(self):
+    return len(self._archives)
+
+  def get(self, filename):
+    """
+    Returns the #ZipArchive for the specified *filename* or #None if the file
+    does not exist or is not a ZIP file.
+    """
+
+    with self._lock:
+      if self._is_not_zip(filename, self._directory):
+        return None
+      try:
+        st = os.stat(filename)
+      except OSError:
+        return None
+      if stat.S_ISDIR(st.st_mode):
+        self._remember_not_zip(filename, self._directory)
+        return None
+      if not stat.S_ISREG(st.st_mode):
+        return None
+
+      signature = _stat_signature(st)
+      archive = self._archives.get(filename)
+      if archive is not None:
+        if archive.signature == signature:
+          return archive
+        self._discard(filename)
+      if self._is_not_zip(filename, signature):
+        return None
+      if not zipfile.is_zipfile(filename):
+        self._remember_not_zip(filename, signature)
+        return None
+
+      archive = ZipArchive(self, filename, signature)
+      self._archives[filename] = archive
+      self._touch(archive)
+      return archive
+
+  def acquire(self, archive):
+    """
+    Returns the open #zipfile.ZipFile for *archive*, opening it if necessary
+    and closing the least recently used archives if there are more than
+    #max_open handles.
+    """
+
+    with self._lock:
+      zipf = archive._zipf
+      if zipf is None:
+        zipf = archive._reopen()
+      self._touch(archive)
+      return zipf
+
+  def invalidate(self, filename=None):
+    """
+    Forget everything that is known about *filename*, or about all files if
+    no *filename* is specified. Open handles of the affected archives are
+    closed.
+    """
+
+    with self._lock:
+      if filename is None:
+        for filename in list(self._archives):
+          self._discard(filename)
+        self._not_zip.clear()
+      else:
+        self._discard(filename)
+        self._not_zip.pop(filename, None)
+
+  def close_all(self):
+    """
+    Closes all open archive handles and clears the registry.
+    """
+
+    with self._lock:
+      while self._handles:
+        self._handles.popitem()[0]._close_handle()
+      self._archives.clear()
+      self._not_zip.clear()
+
+  def _is_not_zip(self, filename, signature):
+    value = self._not_zip.pop(filename, None)
+    if value is None:
+      return False
+    self._not_zip[filename] = value  # Most recently used
+    return value is signature or value == signature
+
+  def _remember_not_zip(self, filename, signature):
+    self._not_zip.pop(filename, None)
+    self._not_zip[filename] = signature
+    while len(self._not_zip) > self.max_not_zip:
+      self._not_zip.popitem(last=False)
+
+  def _touch(self, archive):
+    # Handles are keyed by the archive object rather than its filename, an
+    # archive that has been discarded may still be read through the ZipPaths
+    # that reference it while a new archive for the same file is open.
+    self._handles.pop(archive, None)
+    self._handles[archive] = True
+    while len(self._handles) > self.max_open:
+      self._handles.popitem(last=False)[0]._close_handle()
+
+  def _discard(self, filename):
+    archive = self._archives.pop(filename, None)
+    if archive is not None:
+      self._handles.pop(archive, None)
+      archive._close_handle()
+
+
+#: The registry that is used by #make() if no other registry is specified.
+default_registry = ZipArchiveRegistry()
+
+
+def make(s, pure=False, registry=None):
   """
   Accepts a string or a #pathlib.Path instance and converts it to a #ZipPath
   or #PureZipPath if *s* is a path pointing to a ZIP file or any of its parent
-  path elements.
+  path elements. Only paths on the local filesystem are considered. The
+  archives are managed by the specified #ZipArchiveRegistry, or by the
+  #default_registry.
   """
 
+  if registry is None:
+    registry = default_registry
   if isinstance(s, six.string_types):
     s = pathlib.Path(s)
-  if isinstance(s, pathlib.Path) and path.is_directory_listing_supported(s):
+  if _is_local_path(s):
     for current in path.upiter(s):
-      if current in open_zipfiles:
-        zipf = open_zipfiles[current]
-      elif not current.is_file(): continue
-      else:
-        fp = current.open('rb')
-        if not zipfile.is_zipfile(fp):
-          fp.close()
-          continue
-        zipf = zipfile.ZipFile(fp, 'r')
-        open_zipfiles[current] = zipf
+      zipf = registry.get(str(current))
+      if zipf is None:
+        continue
       relname = s.relative_to(current)
       relname = '/'.join(reversed([x.name for x in path.upiter(relname)]))
-      return ZipPath(zipf, relname)
+      return PureZipPath(zipf, relname) if pure else ZipPath(zipf, relname)
   raise ValueError('can not create ZipPath: {!r}'.format(s))
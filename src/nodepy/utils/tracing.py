@@ -27,15 +27,29 @@ Python application, which is especially useful when debugging deadlocks.
 Inspired by the ActiveState receipe:
 
   http://code.activestate.com/recipes/577334-how-to-debug-deadlocked-multi-threaded-programs/
+
+The #SamplingProfilerTracer uses the same mechanism to build a statistical
+profile of the application, the #ContentionTracer to find threads that are
+blocked and, with #install_lock_tracking(), locks that are contended or
+deadlocked.
 """
 
+from nodepy.utils import json, memory
+from nodepy.utils.events import timer
 import codecs
+import collections
+import dis
+import errno
+import gc
 import io
 import os
+import socket
+import stat
 import sys
 import time
 import threading
 import traceback
+import weakref
 
 try:
   import pygments, pygments.lexers, pygments.formatters
@@ -45,8 +59,17 @@ except ImportError:
 try:
   from BaseHTTPServer import HTTPServer
   from SimpleHTTPServer import SimpleHTTPRequestHandler
+  from SocketServer import TCPServer
+  from urlparse import parse_qs
 except ImportError:
   from http.server import HTTPServer, SimpleHTTPRequestHandler
+  from socketserver import TCPServer
+  from urllib.parse import parse_qs
+
+try:
+  from _thread import allocate_lock as _allocate_lock, get_ident as _get_ident
+except ImportError:
+  from thread import allocate_lock as _allocate_lock, get_ident as _get_ident
 
 stackframes = sys._current_frames
 main_thread = next(x for x in threading.enumerate() if isinstance(x, threading._MainThread))
@@ -61,27 +84,115 @@ def format_stack(stack):
   return '\n'.join(lines)
 
 
+_highlight_cache = {}
+
+
+def highlight(tbstr):
+  """
+  Returns the HTML for the stack *tbstr* that is highlighted with pygments.
+  Results are cached as the stacks of idle threads rarely change between
+  two snapshots.
+  """
+
+  html = _highlight_cache.get(tbstr)
+  if html is None:
+    formatter = pygments.formatters.HtmlFormatter(full=False, noclasses=True)
+    lexer = pygments.lexers.PythonLexer()
+    html = pygments.highlight(tbstr, lexer, formatter)
+    if len(_highlight_cache) >= 256:
+      _highlight_cache.clear()
+    _highlight_cache[tbstr] = html
+  return html
+
+
+def thread_label(thread_id):
+  name = 'Thread {}'.format(thread_id)
+  if thread_id == threading.get_ident():
+    name += ' (tracing thread)'
+  elif thread_id == main_thread.ident:
+    name += ' (main)'
+  return name
+
+
 def format_html(fp, exclude=()):
   frames = stackframes()
   fp.write('<!DOCTYPE html>\n')
   fp.write('<html><head><title>{} Traces</title></head><body>\n'.format(len(frames)))
   for thread_id, stack in sorted(frames.items(), key=lambda x: x[0]):
-    name = 'Thread {}'.format(thread_id)
-    if thread_id == threading.get_ident():
-      name += ' (tracing thread)'
-    elif thread_id == main_thread.ident:
-      name += ' (main)'
-    fp.write('<h3>{}</h3>\n'.format(name))
+    fp.write('<h3>{}</h3>\n'.format(thread_label(thread_id)))
     tbstr = format_stack(stack)
     if pygments:
-      formatter = pygments.formatters.HtmlFormatter(full=False, noclasses=True)
-      lexer = pygments.lexers.PythonLexer()
-      tbstr = pygments.highlight(tbstr, lexer, formatter)
+      tbstr = highlight(tbstr)
     fp.write(tbstr)
     fp.write('\n')
   fp.write('</body>\n')
 
 
+def stack_snapshot():
+  """
+  Returns a JSON serializable list that describes the stack of every thread.
+  """
+
+  threads = {t.ident: t for t in threading.enumerate()}
+  result = []
+  for thread_id, stack in sorted(stackframes().items(), key=lambda x: x[0]):
+    thread = threads.get(thread_id)
+    result.append({
+      'id': thread_id,
+      'name': thread.name if thread else None,
+      'daemon': thread.daemon if thread else None,
+      'main': thread_id == main_thread.ident,
+      'stack': [{'filename': filename, 'lineno': lineno, 'name': name, 'line': line}
+                for filename, lineno, name, line in traceback.extract_stack(stack)]
+    })
+  return result
+
+
+def runtime_metrics(context=None):
+  """
+  Returns a JSON serializable dictionary with counters of the Python
+  runtime and, if specified, of the Node.py *context* (see
+  #Context.metrics).
+  """
+
+  result = {
+    'pid': os.getpid(),
+    'threads': threading.active_count(),
+    'gc': {
+      'counts': list(gc.get_count()),
+      'thresholds': list(gc.get_threshold()),
+      'generations': gc.get_stats() if hasattr(gc, 'get_stats') else None,
+    },
+  }
+  if context is not None:
+    modules = list(context.modules.values())
+    result['modules'] = len(modules)
+    result['modules_loaded'] = sum(1 for m in modules if m.loaded)
+    result['packages'] = len(context.packages)
+    result['context'] = dict(context.metrics)
+  return result
+
+
+def module_timings(context):
+  """
+  Returns a JSON serializable list of the modules in the *context* sorted by
+  their load time (which includes the time spent loading the modules they
+  require while being loaded).
+  """
+
+  result = []
+  for module in list(context.modules.values()):
+    result.append({
+      'name': module.name,
+      'filename': str(module.filename),
+      'package': module.package.name if module.package else None,
+      'loaded': module.loaded,
+      'load_time': module.load_time,
+    })
+  result.sort(key=lambda x: -(x['load_time'] or 0.0))
+  return result
+
+
 class BaseThread(threading.Thread):
 
   def __init__(self, *args, **kwargs):
@@ -105,30 +216,125 @@ class BaseThread(threading.Thread):
     return super(BaseThread, self).start(*args, **kwargs)
 
 
+class UnixHTTPServer(HTTPServer):
+  """
+  A #HTTPServer that listens on a Unix domain socket.
+  """
+
+  address_family = getattr(socket, 'AF_UNIX', None)
+
+  def server_bind(self):
+    # Remove a stale socket, but never a file that is not a socket.
+    if self._is_socket() is False:
+      raise OSError(errno.EEXIST, 'File exists and is not a socket', self.server_address)
+    self._remove_socket()
+    TCPServer.server_bind(self)
+    self.server_name = 'localhost'
+    self.server_port = 0
+
+  def server_close(self):
+    HTTPServer.server_close(self)
+    self._remove_socket()
+
+  def _is_socket(self):
+    """
+    Returns #True if the #server_address is a socket, #False if it is
+    another kind of file and #None if it does not exist.
+    """
+
+    try:
+      st = os.lstat(self.server_address)
+    except OSError as exc:
+      if exc.errno == errno.ENOENT:
+        return None
+      raise
+    return stat.S_ISSOCK(st.st_mode)
+
+  def _remove_socket(self):
+    if self._is_socket():
+      os.remove(self.server_address)
+
+
 class HttpServerTracer(BaseThread):
+  """
+  Serves the stacks of all threads over HTTP. The following paths are
+  available:
+
+  * `/` &ndash; an HTML page with the stack of every thread
+  * `/stacks.json` &ndash; see #stack_snapshot()
+  * `/metrics.json` &ndash; see #runtime_metrics()
+  * `/modules.json` &ndash; see #module_timings() (requires a *context*)
+  * `/memory.json` &ndash; see #memory.memory_report() (requires a *context*
+    and that memory allocations are traced), pass `?diff` to get the
+    differences to the previous request and `?top=N` to limit the output
+
+  If *unix_socket* is specified, the server listens on that Unix domain
+  socket instead of *host* and *port*.
+  """
 
   class RequestHandler(SimpleHTTPRequestHandler):
-    def do_GET(self):
+
+    def send_json(self, data):
+      payload = json.dumps(data).encode('utf8')
       self.send_response(200)
-      self.send_header('Content-type', 'text/html')
+      self.send_header('Content-type', 'application/json')
+      self.send_header('Content-length', str(len(payload)))
       self.end_headers()
-      fp = codecs.getwriter('utf8')(self.wfile)
-      format_html(fp, exclude=(threading.get_ident(),))
+      self.wfile.write(payload)
+
+    def do_GET(self):
+      tracer = self.server.tracer
+      context = tracer.context
+      path, _, query = self.path.partition('?')
+      query = parse_qs(query, keep_blank_values=True)
+      if path == '/':
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html')
+        self.end_headers()
+        fp = codecs.getwriter('utf8')(self.wfile)
+        format_html(fp, exclude=(threading.get_ident(),))
+      elif path == '/stacks.json':
+        self.send_json(stack_snapshot())
+      elif path == '/metrics.json':
+        self.send_json(runtime_metrics(context))
+      elif path == '/modules.json' and context is not None:
+        self.send_json(module_timings(context))
+      elif path == '/memory.json' and context is not None and memory.is_tracing():
+        snapshot = memory.take_snapshot()
+        since = tracer.memory_snapshot if 'diff' in query else None
+        tracer.memory_snapshot = snapshot
+        top = int(query['top'][0]) if 'top' in query else None
+        self.send_json(memory.memory_report(context, snapshot, since).to_json(top))
+      else:
+        self.send_error(404)
+
     def log_message(self, format, *args):
       pass
 
-  def __init__(self, host=None, port=None):
+  def __init__(self, host=None, port=None, context=None, unix_socket=None):
     super(HttpServerTracer, self).__init__()
     self.host = host or 'localhost'
-    self.port = port or 8081
-    self.httpd = HTTPServer((self.host, self.port), self.RequestHandler)
+    self.port = 8081 if port is None else port
+    self.context = context
+    self.unix_socket = unix_socket
+    self.memory_snapshot = None
+    if unix_socket:
+      self.httpd = UnixHTTPServer(unix_socket, self.RequestHandler)
+    else:
+      self.httpd = HTTPServer((self.host, self.port), self.RequestHandler)
+      self.port = self.httpd.server_address[1]
+    self.httpd.tracer = self
 
   def stop(self, wait=True):
     self.httpd.shutdown()
     super(HttpServerTracer, self).stop(wait)
+    self.httpd.server_close()
 
   def run(self):
-    print('Started HttpServerTracer on http://{}:{}'.format(self.host, self.port))
+    if self.unix_socket:
+      print('Started HttpServerTracer on unix:{}'.format(self.unix_socket))
+    else:
+      print('Started HttpServerTracer on http://{}:{}'.format(self.host, self.port))
     self.httpd.serve_forever()
 
 
@@ -146,3 +352,527 @@ class HtmlFileTracer(BaseThread):
       with open(self._fname, 'w') as fp:
         format_html(fp)
       time.sleep(self._interval)
+
+
+class SamplingProfilerTracer(BaseThread):
+  """
+  A statistical profiler that samples the stacks of all threads *frequency*
+  times per second and counts how often every stack was seen. The counts
+  are written to *fname* every *interval* seconds and when the tracer is
+  stopped, one collapsed stack per line (the format that is understood by
+  `flamegraph.pl` and speedscope). If *report* is specified, a list of the
+  *top* functions that were seen most often is written to that file, too.
+
+  Frames are labeled as `<module>:<function>`. If a *context* is specified,
+  frames from Node.py modules use the #Module.name of the module that is
+  found in #Context.modules for the frame's filename, otherwise the
+  `__name__` of the frame's globals is used.
+  """
+
+  def __init__(self, context=None, frequency=None, fname=None, interval=None,
+               report=None, top=None):
+    super(SamplingProfilerTracer, self).__init__()
+    self.context = context
+    self.frequency = float(frequency or 100.0)
+    self.fname = fname or 'profile.folded'
+    self.interval = float(interval or 10.0)
+    self.report = report
+    self.top = int(top or 20)
+    self.counts = collections.Counter()
+    self.samples = 0
+    self._labels = {}
+    self._unresolved = set()
+    self._modules = {}
+    self._modules_count = None
+
+  def _module_for(self, filename):
+    modules = self.context.modules
+    if len(modules) != self._modules_count:
+      try:
+        self._modules = {str(k): v for k, v in list(modules.items())}
+      except RuntimeError:
+        pass  # Changed size during iteration, try again with the next sample.
+      else:
+        self._modules_count = len(self._modules)
+    return self._modules.get(filename)
+
+  def _label(self, frame):
+    code = frame.f_code
+    label = self._labels.get(code)
+    if label is not None and code in self._unresolved and \
+        len(self.context.modules) != self._modules_count:
+      label = None  # The code may belong to a module that was loaded since.
+    if label is None:
+      module = self._module_for(code.co_filename) if self.context else None
+      if module is not None:
+        where = module.name
+        self._unresolved.discard(code)
+      else:
+        where = frame.f_globals.get('__name__') or os.path.basename(code.co_filename)
+        if self.context:
+          self._unresolved.add(code)
+      label = '{}:{}'.format(where, code.co_name).replace(';', ',')
+      self._labels[code] = label
+    return label
+
+  def sample(self):
+    """
+    Records the current stack of every thread except for the tracer.
+    """
+
+    own_ident = threading.get_ident()
+    for thread_id, frame in stackframes().items():
+      if thread_id == own_ident:
+        continue
+      stack = []
+      while frame is not None:
+        stack.append(self._label(frame))
+        frame = frame.f_back
+      stack.reverse()
+      self.counts[tuple(stack)] += 1
+    self.samples += 1
+
+  def format_folded(self, fp):
+    """
+    Writes the collapsed stacks and their counts to *fp*.
+    """
+
+    for stack, count in sorted(self.counts.items()):
+      fp.write('{} {}\n'.format(';'.join(stack), count))
+
+  def hot_functions(self):
+    """
+    Returns a list of `(label, self_count, total_count)` tuples, sorted by
+    the number of samples in which the function was at the top of the stack
+    (its own time) and then by the number of samples in which it was on the
+    stack at all.
+    """
+
+    own = collections.Counter()
+    total = collections.Counter()
+    for stack, count in self.counts.items():
+      own[stack[-1]] += count
+      for label in set(stack):
+        total[label] += count
+    result = [(label, own[label], total[label]) for label in total]
+    result.sort(key=lambda x: (-x[1], -x[2], x[0]))
+    return result
+
+  def format_report(self, fp, top=None):
+    """
+    Writes a table of the *top* hot functions to *fp*.
+    """
+
+    top = self.top if top is None else top
+    nstacks = sum(self.counts.values()) or 1
+    fp.write('{} samples, {} stacks\n\n'.format(self.samples, nstacks))
+    fp.write('{:>7} {:>7}  {}\n'.format('self%', 'total%', 'function'))
+    for label, own, total in self.hot_functions()[:top]:
+      fp.write('{:>6.1f}% {:>6.1f}%  {}\n'.format(
+        100.0 * own / nstacks, 100.0 * total / nstacks, label))
+
+  def write(self):
+    with open(self.fname, 'w') as fp:
+      self.format_folded(fp)
+    if self.report:
+      with open(self.report, 'w') as fp:
+        self.format_report(fp)
+
+  def run(self):
+    print('Started SamplingProfilerTracer to "{}" at {}Hz'
+      .format(self.fname, self.frequency))
+    period = 1.0 / self.frequency
+    next_write = time.time() + self.interval
+    while not self.stop_requested():
+      self.sample()
+      if time.time() >= next_write:
+        self.write()
+        next_write = time.time() + self.interval
+      time.sleep(period)
+    self.write()
+
+
+class _TrackedLockBase(object):
+
+  def __init__(self, name=None):
+    self._lock = _allocate_lock()
+    self.name = name or hex(id(self))
+    self.owner = None
+    self.waiters = {}
+    self.acquisitions = 0
+    self.contentions = 0
+    self.wait_time = 0.0
+    _tracked_locks.add(self)
+
+  def __repr__(self):
+    return '<{} {} owner={}>'.format(type(self).__name__, self.name, self.owner)
+
+  def _acquire(self, ident, blocking, timeout):
+    if self._lock.acquire(False):
+      result = True
+    elif not blocking:
+      return False
+    else:
+      self.contentions += 1
+      start = self.waiters[ident] = timer()
+      try:
+        if timeout is None or timeout < 0:
+          result = self._lock.acquire()
+        elif sys.version_info[0] >= 3:
+          result = self._lock.acquire(True, timeout)
+        else:
+          result = self._poll(timeout)
+      finally:
+        del self.waiters[ident]
+        self.wait_time += timer() - start
+    if result:
+      self.owner = ident
+      self.acquisitions += 1
+    return result
+
+  def _poll(self, timeout):
+    # Python 2 locks can not wait with a timeout, poll them like the
+    # Python 2 implementation of threading.Condition.wait() does.
+    deadline = timer() + timeout
+    delay = 0.0005
+    while not self._lock.acquire(False):
+      remaining = deadline - timer()
+      if remaining <= 0:
+        return False
+      delay = min(delay * 2, remaining, 0.05)
+      time.sleep(delay)
+    return True
+
+  def _at_fork_reinit(self):
+    # Called by threading in the child process after os.fork().
+    if hasattr(self._lock, '_at_fork_reinit'):
+      self._lock._at_fork_reinit()
+    else:
+      self._lock = _allocate_lock()
+    self.owner = None
+    self.waiters = {}
+
+  def locked(self):
+    return self._lock.locked()
+
+  def __enter__(self):
+    return self.acquire()
+
+  def __exit__(self, *args):
+    self.release()
+
+
+class TrackedLock(_TrackedLockBase):
+  """
+  A replacement for #threading.Lock that records its owner, the threads that
+  wait for it and how much time they spent waiting. The statistics are not
+  synchronized, they are accurate enough to find the hot spots.
+  """
+
+  def acquire(self, blocking=True, timeout=-1):
+    return self._acquire(_get_ident(), blocking, timeout)
+
+  def release(self):
+    self.owner = None
+    self._lock.release()
+
+
+class TrackedRLock(_TrackedLockBase):
+  """
+  A replacement for #threading.RLock, see #TrackedLock. It implements the
+  private interface that #threading.Condition uses for waiting.
+  """
+
+  def __init__(self, name=None):
+    super(TrackedRLock, self).__init__(name)
+    self._count = 0
+
+  def acquire(self, blocking=True, timeout=-1):
+    ident = _get_ident()
+    if self.owner == ident:
+      self._count += 1
+      return True
+    result = self._acquire(ident, blocking, timeout)
+    if result:
+      self._count = 1
+    return result
+
+  def release(self):
+    if self.owner != _get_ident():
+      raise RuntimeError('cannot release un-acquired lock')
+    self._count -= 1
+    if not self._count:
+      self.owner = None
+      self._lock.release()
+
+  def _at_fork_reinit(self):
+    super(TrackedRLock, self)._at_fork_reinit()
+    self._count = 0
+
+  def _is_owned(self):
+    return self.owner == _get_ident()
+
+  def _release_save(self):
+    state = (self._count, self.owner)
+    self._count = 0
+    self.owner = None
+    self._lock.release()
+    return state
+
+  def _acquire_restore(self, state):
+    self._acquire(_get_ident(), True, None)
+    self._count, self.owner = state
+
+
+_tracked_locks = weakref.WeakSet()
+_original_locks = None
+
+
+def _creation_site():
+  frame = sys._getframe(2)
+  return '{}:{}'.format(frame.f_code.co_filename, frame.f_lineno)
+
+
+def install_lock_tracking():
+  """
+  Replaces #threading.Lock and #threading.RLock with factories for
+  #TrackedLock and #TrackedRLock objects. Only locks that are created
+  afterwards are tracked. The locks are named after the place they were
+  created at.
+  """
+
+  global _original_locks
+  if _original_locks is None:
+    _original_locks = (threading.Lock, threading.RLock)
+    threading.Lock = lambda: TrackedLock(_creation_site())
+    threading.RLock = lambda *a, **kw: TrackedRLock(_creation_site())
+
+
+def uninstall_lock_tracking():
+  """
+  Restores the original #threading.Lock and #threading.RLock. Locks that
+  have been created while tracking was installed keep working.
+  """
+
+  global _original_locks
+  if _original_locks is not None:
+    threading.Lock, threading.RLock = _original_locks
+    _original_locks = None
+
+
+def tracked_locks():
+  return list(_tracked_locks)
+
+
+def wait_for_cycles(locks=None):
+  """
+  Builds the wait-for graph from the owners and waiters of the tracked
+  *locks* and returns a list of its cycles. Every cycle is a list of
+  `(thread_id, lock)` tuples where the thread waits for the lock that is
+  owned by the next thread in the list.
+  """
+
+  waits_for = {}
+  for lock in (tracked_locks() if locks is None else locks):
+    owner = lock.owner
+    if owner is None:
+      continue
+    for ident in list(lock.waiters):
+      waits_for[ident] = (lock, owner)
+
+  cycles = []
+  seen = set()
+  for start in waits_for:
+    path = []
+    ident = start
+    while ident in waits_for and ident not in seen:
+      seen.add(ident)
+      path.append(ident)
+      ident = waits_for[ident][1]
+    if ident in path:
+      cycle = path[path.index(ident):]
+      cycles.append([(x, waits_for[x][0]) for x in cycle])
+  return cycles
+
+
+#: Methods that wait for another thread, see #blocking_call().
+BLOCKING_CALLS = frozenset(['acquire', 'wait', 'get', 'put', 'join'])
+
+
+def _instructions(code):
+  """
+  Yields `(offset, opname, argval)` for the instructions of *code*.
+  """
+
+  if hasattr(dis, 'get_instructions'):
+    for instr in dis.get_instructions(code):
+      yield instr.offset, instr.opname, instr.argval
+    return
+  co_code = bytearray(code.co_code)
+  offset = 0
+  while offset < len(co_code):
+    op = co_code[offset]
+    argval = None
+    if op >= dis.HAVE_ARGUMENT:
+      arg = co_code[offset + 1] | (co_code[offset + 2] << 8)
+      if op in dis.hasname:
+        argval = code.co_names[arg]
+      yield offset, dis.opname[op], argval
+      offset += 3
+    else:
+      yield offset, dis.opname[op], argval
+      offset += 1
+
+
+def blocking_call(frame):
+  """
+  Returns the name of the method that is being called in *frame* if it is
+  one of the #BLOCKING_CALLS (eg. `Lock.acquire()`, `Condition.wait()` or
+  `Queue.get()`), otherwise #None. Threads that are in `time.sleep()` or
+  `select.select()` are not blocked by other threads.
+  """
+
+  name = None
+  for offset, opname, argval in _instructions(frame.f_code):
+    if offset > frame.f_lasti:
+      break
+    if opname in ('LOAD_ATTR', 'LOAD_METHOD'):
+      name = argval
+  return name if name in BLOCKING_CALLS else None
+
+
+class ContentionTracer(BaseThread):
+  """
+  Samples the stacks of all threads every *interval* seconds and reports
+  threads that are found waiting in the same #blocking_call() (such as
+  `Lock.acquire()`, `Condition.wait()` or `Queue.get()`) in at least
+  *threshold* consecutive samples. If *track_locks* is #True,
+  #install_lock_tracking() is called when the tracer is created and the
+  report includes wait-for cycles (deadlocks) and the *top* locks that
+  threads spent the most time waiting for.
+
+  The report is written to *fname* every *report_interval* seconds and when
+  the tracer is stopped.
+  """
+
+  def __init__(self, interval=None, threshold=None, fname=None,
+               report_interval=None, track_locks=False, top=None):
+    super(ContentionTracer, self).__init__()
+    self.interval = float(interval or 1.0)
+    self.threshold = int(threshold or 5)
+    self.fname = fname or 'contention.txt'
+    self.report_interval = float(report_interval or 10.0)
+    self.track_locks = track_locks
+    self.top = int(top or 10)
+    self._positions = {}
+    if track_locks:
+      install_lock_tracking()
+
+  def sample(self):
+    """
+    Records the position of every thread except for the tracer.
+    """
+
+    now = time.time()
+    own_ident = threading.get_ident()
+    positions = {}
+    for thread_id, frame in stackframes().items():
+      if thread_id == own_ident:
+        continue
+      key = (frame.f_code, frame.f_lasti, id(frame))
+      prev = self._positions.get(thread_id)
+      if prev and prev[0] == key:
+        positions[thread_id] = (key, prev[1] + 1, prev[2], frame)
+      else:
+        positions[thread_id] = (key, 1, now, frame)
+    self._positions = positions
+
+  def blocked_threads(self):
+    """
+    Returns a list of dictionaries that describe the threads that have been
+    waiting in the same #blocking_call() for at least #threshold samples,
+    longest first.
+    """
+
+    names = {t.ident: t.name for t in threading.enumerate()}
+    now = time.time()
+    result = []
+    for thread_id, (key, count, since, frame) in self._positions.items():
+      if count < self.threshold:
+        continue
+      call = blocking_call(frame)
+      if call is None:
+        continue
+      code = frame.f_code
+      result.append({
+        'id': thread_id,
+        'name': names.get(thread_id),
+        'samples': count,
+        'seconds': now - since,
+        'location': '{}:{} in {}'.format(code.co_filename, frame.f_lineno, code.co_name),
+        'call': call,
+      })
+    result.sort(key=lambda x: -x['seconds'])
+    return result
+
+  def report(self):
+    """
+    Returns a JSON serializable dictionary with the #blocked_threads(), the
+    wait-for cycles and the top contended locks.
+    """
+
+    result = {'blocked': self.blocked_threads(), 'cycles': [], 'locks': []}
+    if self.track_locks:
+      for cycle in wait_for_cycles():
+        result['cycles'].append([{'thread': ident, 'lock': lock.name}
+          for ident, lock in cycle])
+      now = timer()
+      locks = []
+      for lock in tracked_locks():
+        waiting = sum(now - t for t in list(lock.waiters.values()))
+        if lock.contentions:
+          locks.append({'name': lock.name, 'wait_time': lock.wait_time + waiting,
+            'contentions': lock.contentions, 'acquisitions': lock.acquisitions,
+            'waiters': len(lock.waiters), 'owner': lock.owner})
+      locks.sort(key=lambda x: -x['wait_time'])
+      result['locks'] = locks[:self.top]
+    return result
+
+  def format_report(self, fp):
+    report = self.report()
+    fp.write('Blocked threads ({}):\n'.format(len(report['blocked'])))
+    for info in report['blocked']:
+      fp.write('  {} "{}" for {:.1f}s ({} samples) in {}() at {}\n'.format(
+        thread_label(info['id']), info['name'], info['seconds'],
+        info['samples'], info['call'], info['location']))
+    if self.track_locks:
+      fp.write('\nWait-for cycles ({}):\n'.format(len(report['cycles'])))
+      for cycle in report['cycles']:
+        parts = ['Thread {} --[{}]-->'.format(x['thread'], x['lock']) for x in cycle]
+        fp.write('  {} Thread {}\n'.format(' '.join(parts), cycle[0]['thread']))
+      fp.write('\nTop contended locks:\n')
+      for info in report['locks']:
+        fp.write('  {:>9.3f}s waited, {} contentions, {} acquisitions, {} waiting  {}\n'
+          .format(info['wait_time'], info['contentions'], info['acquisitions'],
+                  info['waiters'], info['name']))
+
+  def write(self):
+    with open(self.fname, 'w') as fp:
+      self.format_report(fp)
+
+  def stop(self, wait=True):
+    super(ContentionTracer, self).stop(wait)
+    if self.track_locks:
+      uninstall_lock_tracking()
+
+  def run(self):
+    print('Started ContentionTracer to "{}" at an interval of {}s'
+      .format(self.fname, self.interval))
+    next_write = time.time() + self.report_interval
+    while not self.stop_requested():
+      self.sample()
+      if time.time() >= next_write:
+        self.write()
+        next_write = time.time() + self.report_interval
+      time.sleep(self.interval)
+    self.write()
@@ -29,6 +29,7 @@ import functools
 import getpass
 import nodepy
 import os
+import requests
 import six
 import sys
 import textwrap
@@ -38,6 +39,15 @@ import manifest from './manifest'
 import refstring from './refstring'
 import semver from './semver'
 import _install from './install'
+import _cache from './cache'
+import _lockfile from './lockfile'
+import _metacache from './metacache'
+import _pipstore from './pipstore'
+import _registry from './registry'
+import _server from './server'
+import _solver from './solver'
+import decorators from './util/decorators'
+import text from './util/text'
 import logger from './logger'
 import {RegistryClient} from './registry'
 import {PackageLifecycle} from './package_lifecycle'
@@ -119,15 +129,30 @@ def create_installer(args):
   """
 
   location = get_install_location(args.g, args.root)
+  cache = None
+  if not args.no_cache or args.offline:
+    cache = _cache.PackageCache.from_config(require.context.config)
+  pip_store = None
+  use_pip_store = require.context.config.get('cache.pip_store', 'false')
+  if args.pip_store or use_pip_store.strip().lower() in ('1', 'yes', 'on', 'true'):
+    if not args.no_cache:
+      pip_store = _pipstore.PipStore.from_config(require.context.config)
   installer = _install.Installer(
     context=require.context,
     upgrade=args.upgrade,
     install_location=get_install_location(args.g, args.root),
     pip_use_target_option=args.pip_use_target_option,
     recursive=args.recursive,
-    verbose=args.v
+    verbose=args.v,
+    zip_install=args.zip,
+    jobs=args.jobs,
+    cache=cache,
+    offline=args.offline,
+    link_mode=args.link_mode,
+    pip_store=pip_store
   )
   installer.ignore_installed = args.isolate
+  installer.batch_pip = True
   return installer
 
 
@@ -222,6 +247,36 @@ def get_argument_parser(prog):
   install.add_argument('--production', action='store_true', help='''
     Do not install development dependencies.
     ''')
+  install.add_argument('--frozen-lockfile', action='store_true', help='''
+    Install exactly the package versions recorded in nodepy-lock.json and\
+    fail if a requirement is not satisfied by the lockfile. The lockfile is\
+    not updated.
+    ''')
+  install.add_argument('--no-lockfile', action='store_true', help='''
+    Do not read or write nodepy-lock.json.
+    ''')
+  install.add_argument('--offline', action='store_true', help='''
+    Do not access the network. Node.py packages are installed from the\
+    package cache only and Pip is run with --no-index.
+    ''')
+  install.add_argument('--link-mode', choices=('auto', 'copy'), default='auto', help='''
+    How to place the files of Node.py packages. With "auto" (the default),\
+    files are hardlinked from the package cache, or cloned with reflinks\
+    or copy_file_range() where supported, and copied otherwise. With\
+    "copy", files are always copied.
+    ''')
+  install.add_argument('--no-cache', action='store_true', help='''
+    Do not use the package cache (~/.nodepy/cache/packages, see the\
+    cache.dir option) and the registry metadata cache\
+    (~/.nodepy/cache/metadata, see the cache.metadata_dir option).
+    ''')
+  install.add_argument('--pip-store', action='store_true', help='''
+    Install Python dependencies into the Pip store that is shared by all\
+    projects (~/.nodepy/cache/pip, see the cache.pip_store_dir option) and\
+    hardlink them into the Pip prefixes, so every version is installed by\
+    Pip only once. Enabled by default with the cache.pip_store option.\
+    Ignored with --no-cache.
+    ''')
   install.add_argument('--save', action='store_true', help='''
     Add the installed packages as dependencies to the current project.\
     Requires a nodepy.json manifest in the current working directory or the\
@@ -237,6 +292,11 @@ def get_argument_parser(prog):
   install.add_argument('-v', action='store_true', help='''
     Enable verbose output for nppm and Pip.
     ''')
+  install.add_argument('-j', '--jobs', type=int, default=4, metavar='N', help='''
+    The number of packages to resolve and download concurrently from the\
+    registry. Packages are still installed one after another. Defaults to 4.\
+    Pass 1 to download every package just before it is installed.
+    ''')
   install.add_argument('--internal', action='store_true', help='''
     Install the specified Node.py packages as internal dependencies.\
     This flag has no immediate effect on local install, but the --internal\
@@ -250,6 +310,11 @@ def get_argument_parser(prog):
   install.add_argument('--pure', action='store_true', help='''
     Install Node.py packages without their command-line scripts.
     ''')
+  install.add_argument('--zip', action='store_true', help='''
+    Install every Node.py package as a single <name>.zip archive in the\
+    modules directory instead of expanding its files. The Node.py runtime\
+    loads packages directly from these archives.
+    ''')
 
   uninstall = subparsers.add_parser('uninstall')
   uninstall.add_argument('packages', nargs='+', help='''
@@ -281,6 +346,59 @@ def get_argument_parser(prog):
   dirs.add_argument('--pip-bin', action='store_true')
   dirs.add_argument('--pip-lib', action='store_true')
 
+  cache = subparsers.add_parser('cache', description='''
+    Manage the package cache that is shared by all projects.
+    ''')
+  cache_subparsers = cache.add_subparsers(dest='cache_command')
+  cache_prune = cache_subparsers.add_parser('prune', help='''
+    Remove the least recently used packages from the cache.
+    ''')
+  cache_prune.add_argument('--max-size', help='''
+    The size to reduce the cache to, eg. 500M. Defaults to the\
+    cache.max_size option or 1G.
+    ''')
+  cache_subparsers.add_parser('list', help='''
+    List the packages in the cache.
+    ''')
+  cache_subparsers.add_parser('dir', help='''
+    Print the cache directory.
+    ''')
+
+  registry = subparsers.add_parser('registry', description='''
+    Work with the configured package registries.
+    ''')
+  registry_subparsers = registry.add_subparsers(dest='registry_command')
+  registry_sync = registry_subparsers.add_parser('sync', help='''
+    Download the index of all packages in the registries into the metadata\
+    cache, or only the changes since the last sync. Dependencies are then\
+    solved against the local index without network access.
+    ''')
+  registry_sync.add_argument('registries', nargs='*', help='''
+    The names of the registries to sync. Defaults to all configured\
+    registries.
+    ''')
+  registry_serve = registry_subparsers.add_parser('serve', help='''
+    Serve the package distribution archives in a directory as a registry,\
+    eg. as a mirror in a network without internet access.
+    ''')
+  registry_serve.add_argument('directory', help='''
+    The directory that contains the .tar.gz archives created with\
+    "nppm dist". Uploaded archives are stored in this directory.
+    ''')
+  registry_serve.add_argument('--host', default='127.0.0.1', help='''
+    The address to listen on. Defaults to 127.0.0.1.
+    ''')
+  registry_serve.add_argument('--port', type=int, default=8000, help='''
+    The port to listen on. Defaults to 8000.
+    ''')
+  registry_serve.add_argument('--auth', metavar='USER:PASSWORD', help='''
+    Accept uploads authenticated with this user and password. Without\
+    this option, the registry is read-only.
+    ''')
+  registry_serve.add_argument('--terms', metavar='FILE', help='''
+    A file with the Terms of Use that the registry reports.
+    ''')
+
   run = subparsers.add_parser('run')
   run.add_argument('script', nargs='...', help='''
     The script or program to run plus arguments. Scripts executed with\
@@ -299,6 +417,23 @@ def main(argv=None, prog=None):
   return globals()['do_' + args.command](args)
 
 
+def update_lockfile(installer, mf, filename, dev):
+  """
+  Writes the lockfile for the dependency tree of the manifest *mf* to
+  *filename* if it differs from #_install.Installer.lock.
+  """
+
+  try:
+    lock = installer.create_lockfile(mf, dev=dev)
+  except _solver.SolveError as exc:
+    print('warning: could not update {}: {}'.format(env.LOCKFILE, exc))
+    return
+  if lock != installer.lock:
+    lock.save(filename)
+    print('Updated {}'.format(env.LOCKFILE))
+
+
+@decorators.finally_()
 def do_install(args):
   args.root = args.root or args.system
   if not args.packagedir:
@@ -346,16 +481,31 @@ def do_install(args):
     args.production = not args.dev
 
   installer = create_installer(args)
+  decorators.finally_(installer.close)
+
+  # Read the lockfile. Registry packages that it records are installed
+  # without asking the registry.
+  lockfile_filename = os.path.join(args.packagedir, env.LOCKFILE)
+  if args.frozen_lockfile and (args.no_lockfile or not os.path.isfile(lockfile_filename)):
+    fatal('--frozen-lockfile requires {}'.format(env.LOCKFILE))
+  if not args.no_lockfile and os.path.isfile(lockfile_filename):
+    installer.lock = _lockfile.Lockfile.load(lockfile_filename)
+    installer.frozen_lockfile = args.frozen_lockfile
+  write_lockfile = not args.no_lockfile and not args.frozen_lockfile
 
   # If no packages to install are specified, install the dependencies of the
   # current packages. Imply --upgrade and --develop.
   if pure_install:
     installer.upgrade = True
+    if installer.lock:
+      installer.prefetch((None, x) for x in installer.lock.packages.values())
     success, _manifest = installer.install_from_directory(
         args.packagedir, develop=True, dev=args.dev)
-    if not success:
+    if not success or not installer.flush_python_dependencies():
       return 1
     installer.relink_pip_scripts()
+    if write_lockfile:
+      update_lockfile(installer, _manifest, lockfile_filename, args.dev)
     return 0
 
   # Parse the requirements from the command-line.
@@ -395,16 +545,23 @@ def do_install(args):
 
   # Install Node.py dependencies.
   req_names = {}
+  packages = installer.solve(collections.OrderedDict(
+    (req.name, req) for req in npy_packages if req.type == 'registry'))
+  if packages is None:
+    fatal('installation failed')
+  installer.prefetch(packages)
   for req in npy_packages:
     success, info = installer.install_from_requirement(req)
     if not success:
       fatal('installation failed')
     if req.name:
-      assert info[0] == pkg.name, (info, pkg)
+      assert info[0] == req.name, (info, req)
     req_names[req] = info[0]
     if req.type == 'registry':
       req.selector = semver.Selector('~' + str(info[1]))
 
+  if not installer.flush_python_dependencies():
+    fatal('installation failed')
   installer.relink_pip_scripts()
 
   # Insert extensions.
@@ -450,13 +607,17 @@ def do_install(args):
   if (args.save or args.save_dev or args.save_ext) and (npy_packages or python_deps):
     with open(manifest_filename, 'w') as fp:
       json.dump(manifest_data, fp, indent=2)
+    if write_lockfile:
+      mf = manifest.Manifest(args.packagedir, manifest_data)
+      update_lockfile(installer, mf, lockfile_filename, args.dev)
 
   print()
 
 
+@decorators.finally_()
 def do_uninstall(args):
   packages = []
-  for pkg in args.ref:
+  for pkg in args.packages:
     if pkg == '.' or os.path.exists(pkg):
       filename = os.path.join(pkg, PACKAGE_MANIFEST)
       manifest = load_manifest(filename)
@@ -465,6 +626,7 @@ def do_uninstall(args):
 
   location = get_install_location(args.g, args.root)
   installer = _install.Installer(install_location=location)
+  decorators.finally_(installer.close)
   for pkg in packages:
     installer.uninstall(pkg)
 
@@ -547,6 +709,70 @@ def do_dirs(args):
     print('Pip Lib:\t', dirs['pip_lib'])
 
 
+def do_cache(args):
+  cache = _cache.PackageCache.from_config(require.context.config)
+  if args.cache_command == 'prune':
+    try:
+      max_size = text.parse_size(args.max_size) if args.max_size else None
+    except ValueError as exc:
+      fatal(exc)
+    removed = cache.prune(max_size)
+    print('Removed {} package(s), freed {}'.format(len(removed),
+      text.human_size(sum(x.size for x in removed))))
+  elif args.cache_command == 'list':
+    entries = sorted(cache.entries(), key=lambda x: x.last_used, reverse=True)
+    for entry in entries:
+      packages = ', '.join(cache.packages(entry.sha256)) or '?'
+      print('{}  {:>9}  {}'.format(entry.sha256[:12], text.human_size(entry.size), packages))
+    print('{} package(s), {}'.format(len(entries), text.human_size(sum(x.size for x in entries))))
+  elif args.cache_command == 'dir':
+    print(cache.directory)
+  else:
+    fatal('missing cache command (prune, list or dir)')
+
+
+def do_registry(args):
+  config = require.context.config
+  if args.registry_command == 'sync':
+    metadata_cache = _metacache.MetadataCache.from_config(config)
+    if args.registries:
+      registries = [RegistryClient.get(config, x, metadata_cache) for x in args.registries]
+    else:
+      registries = RegistryClient.get_all(config, cache=True)
+    for registry in registries:
+      try:
+        index, count = registry.sync_index()
+      except (requests.RequestException, _registry.Error) as exc:
+        print('Error: could not sync "{}": {}'.format(registry.name, exc))
+        continue
+      finally:
+        registry.close()
+      if index is None:
+        print('Registry "{}" does not provide an index'.format(registry.name))
+      else:
+        print('Synced "{}": {} package(s) changed, {} package(s) in the index'.format(
+          registry.name, count, len(index.packages)))
+  elif args.registry_command == 'serve':
+    if not os.path.isdir(args.directory):
+      fatal('"{}" is not a directory'.format(args.directory))
+    terms = None
+    if args.terms:
+      with open(args.terms) as fp:
+        terms = fp.read()
+    print('Indexing "{}" ...'.format(args.directory))
+    store = _server.PackageStore(args.directory)
+    server = _server.RegistryServer((args.host, args.port), store, args.auth, terms)
+    print('Serving {} package(s) at {}'.format(len(store.packages), server.url))
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+  else:
+    fatal('missing registry command (sync or serve)')
+
+
 def do_run(args):
   if not PackageLifecycle(require.context, allow_no_manifest=True).run(args.script[0], args.script[1:]):
     fatal("no script '{}'".format(args.script[0]))
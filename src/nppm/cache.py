@@ -0,0 +1,470 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+A package cache that is shared by all projects of a user. It stores the
+downloaded package archives and their unpacked trees by the SHA256 of the
+archive, and an index that maps package names and versions to these digests.
+
+    <directory>/
+      archives/<sha256>.tar.gz
+      trees/<sha256>/
+      index/<name>/<version>.json
+      locks/<sha256>.lock
+      .lock
+
+Every process that uses the cache holds a shared lock on `.lock` while it
+is open, #PackageCache.prune() takes an exclusive lock. Adding an entry is
+protected by the lock file of its digest.
+
+The files in `trees/` are made read-only before a tree is moved into place,
+as they are hardlinked into the projects that install them and a write to
+an installed file would otherwise change the cache and every other project.
+"""
+
+import collections
+import contextlib
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import threading
+
+from nr.fs import issub
+
+import env from './env'
+import manifest from './manifest'
+import semver from './semver'
+import _registry from './registry'
+import {FileLock} from './util/filelock'
+import json from './util/json'
+import text from './util/text'
+
+DEFAULT_DIRECTORY = '~/.nodepy/cache/packages'
+DEFAULT_MAX_SIZE = '1G'
+
+
+class CacheEntry(collections.namedtuple('CacheEntry', 'sha256 size last_used')):
+  pass
+
+
+class PackageCache(object):
+  """
+  Represents the package cache in *directory*. *max_size* is the size in
+  bytes that #prune() reduces the cache to by default.
+  """
+
+  def __init__(self, directory=None, max_size=None):
+    self.directory = os.path.expanduser(directory or DEFAULT_DIRECTORY)
+    self.max_size = text.parse_size(DEFAULT_MAX_SIZE) if max_size is None else max_size
+    self._lock = FileLock(os.path.join(self.directory, '.lock'), shared=True)
+
+  def __repr__(self):
+    return '<PackageCache "{}">'.format(self.directory)
+
+  @classmethod
+  def from_config(cls, config):
+    """
+    Creates a #PackageCache from the `cache.dir` (defaults to
+    `~/.nodepy/cache/packages`) and `cache.max_size` (defaults to `1G`)
+    options of a Node.py #Config.
+    """
+
+    directory = config.get('cache.dir', DEFAULT_DIRECTORY) if config else None
+    max_size = config.get('cache.max_size', DEFAULT_MAX_SIZE) if config else DEFAULT_MAX_SIZE
+    return cls(directory, text.parse_size(max_size))
+
+  def open(self):
+    """
+    Acquires the shared lock of the cache, which prevents other processes
+    from pruning entries that are being installed from.
+    """
+
+    if not self._lock.locked:
+      self._lock.acquire()
+
+  def close(self):
+    self._lock.release()
+
+  def _path(self, *parts):
+    return os.path.join(self.directory, *parts)
+
+  def _index_filename(self, name, version):
+    return self._path('index', name.replace('/', '+'), str(version) + '.json')
+
+  def _write_json(self, filename, data):
+    _makedirs(os.path.dirname(filename))
+    tmpname = '{}.{}.{}.tmp'.format(filename, os.getpid(), threading.current_thread().ident)
+    with open(tmpname, 'w') as fp:
+      json.dump(data, fp)
+    if os.name == 'nt' and os.path.isfile(filename):
+      os.remove(filename)
+    os.rename(tmpname, filename)
+
+  def contains(self, path):
+    """
+    Returns #True if *path* is inside the cache directory.
+    """
+
+    return os.path.abspath(path).startswith(os.path.abspath(self.directory) + os.sep)
+
+  def tree(self, sha256):
+    """
+    Returns the directory of the unpacked archive with the digest *sha256*,
+    or #None if it is not in the cache. Marks the entry as used.
+    """
+
+    directory = self._path('trees', sha256)
+    if not os.path.isdir(directory):
+      return None
+    try:
+      os.utime(directory, None)
+    except OSError:
+      pass
+    return directory
+
+  def lookup(self, name, version):
+    """
+    Returns the index entry (a dictionary with the keys `sha256`, `url` and
+    `registry`) for a package version if its tree is in the cache, otherwise
+    #None.
+    """
+
+    try:
+      with open(self._index_filename(name, version)) as fp:
+        entry = json.load(fp)
+    except (IOError, OSError) as exc:
+      if exc.errno != errno.ENOENT:
+        raise
+      return None
+    except json.JSONDecodeError:
+      return None
+    if not os.path.isdir(self._path('trees', entry['sha256'])):
+      return None
+    return entry
+
+  def versions(self, name):
+    """
+    Returns a list of the versions of the package *name* that are in the
+    cache.
+    """
+
+    dirname = self._path('index', name.replace('/', '+'))
+    if not os.path.isdir(dirname):
+      return []
+    result = []
+    for filename in os.listdir(dirname):
+      if filename.endswith('.json'):
+        version = semver.Version(filename[:-5])
+        if self.lookup(name, version):
+          result.append(version)
+    return result
+
+  def packages(self, sha256):
+    """
+    Returns a list of the identifiers of the package versions in the index
+    that point to the tree with the digest *sha256*.
+    """
+
+    result = []
+    index = self._path('index')
+    for root, dirs, files in os.walk(index):
+      for filename in files:
+        if not filename.endswith('.json'):
+          continue
+        try:
+          with open(os.path.join(root, filename)) as fp:
+            if json.load(fp).get('sha256') != sha256:
+              continue
+        except (IOError, OSError, ValueError):
+          continue
+        name = os.path.relpath(root, index).replace('+', '/')
+        result.append('{}@{}'.format(name, filename[:-5]))
+    return sorted(result)
+
+  def add(self, name, version, fp, sha256, url=None, registry=None):
+    """
+    Adds the package archive in the file-like object *fp* with the digest
+    *sha256* to the cache, unpacks it and records it in the index. Returns
+    the directory of the unpacked tree.
+    """
+
+    with FileLock(self._path('locks', sha256 + '.lock')):
+      directory = self._path('trees', sha256)
+      if not os.path.isdir(directory):
+        archive = self._path('archives', sha256 + '.tar.gz')
+        _makedirs(os.path.dirname(archive))
+        _makedirs(os.path.dirname(directory))
+        with open(archive + '.tmp', 'wb') as dst:
+          shutil.copyfileobj(fp, dst)
+        if os.name == 'nt' and os.path.isfile(archive):
+          os.remove(archive)
+        os.rename(archive + '.tmp', archive)
+        staging = tempfile.mkdtemp(prefix=sha256 + '.', dir=os.path.dirname(directory))
+        try:
+          with tarfile.open(archive) as tar:
+            for rel, member in archive_files(tar):
+              extract_file(tar, member, os.path.join(staging, rel))
+          _freeze(staging)
+          os.rename(staging, directory)
+        except:
+          _rmtree(staging, ignore_errors=True)
+          raise
+    self.record(name, version, sha256, url, registry)
+    return directory
+
+  def add_stream(self, fp, check=None):
+    """
+    Unpacks the package archive that is read from the file-like object *fp*
+    (eg. a #download.ResponseReader) into a staging tree while the archive
+    is written to `archives/` at the same time. Both are moved into place
+    under the SHA256 of the archive once it has been read completely.
+    *check* is called with the digest before that and may raise an
+    exception to discard the archive.
+
+    Returns a tuple of the directory of the unpacked tree and the digest.
+    Record the tree in the index with #record().
+    """
+
+    trees, archives = self._path('trees'), self._path('archives')
+    _makedirs(trees)
+    _makedirs(archives)
+    staging = tempfile.mkdtemp(prefix='stream.', dir=trees)
+    handle, tmpname = tempfile.mkstemp(prefix='.stream.', suffix='.tmp', dir=archives)
+    try:
+      with os.fdopen(handle, 'wb') as dst:
+        tee = _HashingTee(fp, dst)
+        with tarfile.open(fileobj=tee, mode='r|*') as tar:
+          for rel, member in archive_files(tar):
+            extract_file(tar, member, os.path.join(staging, rel))
+        while tee.read(64 * 1024):  # Padding after the end of the archive
+          pass
+      sha256 = tee.hasher.hexdigest()
+      if check is not None:
+        check(sha256)
+      with FileLock(self._path('locks', sha256 + '.lock')):
+        directory = self._path('trees', sha256)
+        if not os.path.isdir(directory):
+          archive = self._path('archives', sha256 + '.tar.gz')
+          if os.name == 'nt' and os.path.isfile(archive):
+            os.remove(archive)
+          os.rename(tmpname, archive)
+          _freeze(staging)
+          os.rename(staging, directory)
+    finally:
+      _rmtree(staging, ignore_errors=True)
+      if os.path.isfile(tmpname):
+        os.remove(tmpname)
+    return directory, sha256
+
+  def record(self, name, version, sha256, url=None, registry=None):
+    """
+    Records the tree with the digest *sha256* as the package *name* in
+    *version* in the index.
+    """
+
+    self._write_json(self._index_filename(name, version),
+      {'sha256': sha256, 'url': url, 'registry': registry})
+
+  def entries(self):
+    """
+    Returns a list of #CacheEntry objects for all package trees in the cache.
+    """
+
+    dirname = self._path('trees')
+    if not os.path.isdir(dirname):
+      return []
+    result = []
+    for sha256 in os.listdir(dirname):
+      if '.' in sha256:
+        continue  # Staging directory
+      size = 0
+      for root, dirs, files in os.walk(os.path.join(dirname, sha256)):
+        for filename in files:
+          size += os.path.getsize(os.path.join(root, filename))
+      archive = self._path('archives', sha256 + '.tar.gz')
+      if os.path.isfile(archive):
+        size += os.path.getsize(archive)
+      last_used = os.path.getmtime(os.path.join(dirname, sha256))
+      result.append(CacheEntry(sha256, size, last_used))
+    return result
+
+  def prune(self, max_size=None):
+    """
+    Removes the least recently used entries until the cache is no larger
+    than *max_size* bytes (defaults to #max_size). Waits until no other
+    process uses the cache. Returns a list of the removed #CacheEntry
+    objects.
+    """
+
+    max_size = self.max_size if max_size is None else max_size
+    with FileLock(self._path('.lock')):
+      entries = sorted(self.entries(), key=lambda x: x.last_used)
+      total = sum(x.size for x in entries)
+      removed = []
+      for entry in entries:
+        if total <= max_size:
+          break
+        _rmtree(self._path('trees', entry.sha256))
+        try:
+          os.remove(self._path('archives', entry.sha256 + '.tar.gz'))
+        except OSError as exc:
+          if exc.errno != errno.ENOENT:
+            raise
+        total -= entry.size
+        removed.append(entry)
+
+      if removed:
+        self._prune_index()
+    return removed
+
+  def _prune_index(self):
+    """
+    Removes index entries that point to trees that are not in the cache.
+    """
+
+    for root, dirs, files in os.walk(self._path('index')):
+      for filename in files:
+        filename = os.path.join(root, filename)
+        try:
+          with open(filename) as fp:
+            sha256 = json.load(fp)['sha256']
+        except (IOError, OSError, ValueError, KeyError):
+          sha256 = None
+        if not sha256 or not os.path.isdir(self._path('trees', sha256)):
+          os.remove(filename)
+
+
+class CacheRegistry(object):
+  """
+  A registry that provides the packages in a #PackageCache. Used for
+  offline installs.
+  """
+
+  name = 'cache'
+
+  def __init__(self, cache):
+    self.cache = cache
+    self.base_url = cache.directory
+
+  def versions(self, package_name):
+    versions = self.cache.versions(package_name)
+    if not versions:
+      raise _registry.PackageNotFound(package_name, semver.Selector('*'))
+    return versions
+
+  def find_package(self, package_name, version_selector):
+    version = version_selector.best_of(self.cache.versions(package_name))
+    if version is None:
+      raise _registry.PackageNotFound(package_name, version_selector)
+    entry = self.cache.lookup(package_name, version)
+    filename = os.path.join(self.cache.tree(entry['sha256']), env.PACKAGE_MANIFEST)
+    with open(filename) as fp:
+      data = json.load(fp, object_pairs_hook=collections.OrderedDict)
+    mf = manifest.Manifest(None, data)
+    return _registry.PackageInfo(mf['name'], semver.Version(mf['version']), mf)
+
+  def download(self, package_name, version, filename=None):
+    raise RuntimeError('"{}@{}" is not in the package cache (offline)'.format(
+      package_name, version))
+
+
+class _HashingTee(object):
+  """
+  A file-like object that reads from *fp*, writes the data to *dst* and
+  computes its SHA256 digest.
+  """
+
+  def __init__(self, fp, dst):
+    self.fp = fp
+    self.dst = dst
+    self.hasher = hashlib.sha256()
+
+  def read(self, size=-1):
+    data = self.fp.read(size)
+    self.hasher.update(data)
+    self.dst.write(data)
+    return data
+
+
+def archive_files(tar):
+  """
+  Yields a tuple of (path, member) for every regular file in the
+  #tarfile.TarFile *tar*. Links, devices and members whose path is absolute
+  or points outside of the directory that the archive is extracted to are
+  skipped.
+  """
+
+  for member in tar:
+    rel = os.path.normpath(member.name)
+    if member.isfile() and not os.path.isabs(rel) and issub(rel):
+      yield rel, member
+
+
+def extract_file(tar, member, filename):
+  """
+  Writes the contents of the regular file *member* of *tar* to *filename*
+  and makes it executable if the member is.
+  """
+
+  _makedirs(os.path.dirname(filename))
+  with contextlib.closing(tar.extractfile(member)) as src:
+    with open(filename, 'wb') as fp:
+      shutil.copyfileobj(src, fp)
+  if member.mode & 0o111:
+    os.chmod(filename, 0o755)
+
+
+def _freeze(directory):
+  """
+  Removes the write permissions of all files in *directory*.
+  """
+
+  for root, dirs, files in os.walk(directory):
+    for name in files:
+      path = os.path.join(root, name)
+      os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) & ~0o222)
+
+
+def _rmtree(directory, ignore_errors=False):
+  """
+  #shutil.rmtree() for trees with read-only files, which can not be removed
+  on Windows without adding the write permission first.
+  """
+
+  def onerror(func, path, excinfo):
+    if isinstance(excinfo[1], OSError) and excinfo[1].errno == errno.EACCES:
+      os.chmod(path, stat.S_IWRITE)
+      return func(path)
+    raise excinfo[1]
+  shutil.rmtree(directory, ignore_errors=ignore_errors, onerror=onerror)
+
+
+def _makedirs(directory):
+  if not os.path.isdir(directory):
+    try:
+      os.makedirs(directory)
+    except OSError as exc:
+      if exc.errno != errno.EEXIST:
+        raise
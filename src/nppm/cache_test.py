@@ -0,0 +1,166 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import semver from './semver'
+import _registry from './registry'
+import {PackageCache, CacheRegistry} from './cache'
+
+
+def make_archive(name, version, size=0):
+  fp = io.BytesIO()
+  with tarfile.open(fileobj=fp, mode='w:gz') as tar:
+    for filename, data in [
+        ('nodepy.json', json.dumps({'name': name, 'version': version}).encode('utf8')),
+        ('data.bin', os.urandom(size))]:
+      info = tarfile.TarInfo(filename)
+      info.size = len(data)
+      tar.addfile(info, io.BytesIO(data))
+  fp.seek(0)
+  return fp, hashlib.sha256(fp.getvalue()).hexdigest()
+
+
+def with_cache(func):
+  def wrapper():
+    cache = PackageCache(tempfile.mkdtemp(suffix='_cache'))
+    cache.open()
+    try:
+      func(cache)
+    finally:
+      cache.close()
+      shutil.rmtree(cache.directory)
+  wrapper.__name__ = func.__name__
+  return wrapper
+
+
+def assert_read_only(directory):
+  for root, dirs, files in os.walk(directory):
+    for name in files:
+      assert not os.stat(os.path.join(root, name)).st_mode & 0o222, name
+
+
+def add(cache, name, version, size=0):
+  fp, sha256 = make_archive(name, version, size)
+  return cache.add(name, semver.Version(version), fp, sha256, 'https://example.org/x', 'default'), sha256
+
+
+@with_cache
+def test_add(cache):
+  fp, sha256 = make_archive('@scope/a', '1.0.0')
+  directory = cache.add('@scope/a', semver.Version('1.0.0'), fp, sha256, 'https://example.org/x', 'default')
+  assert os.path.isfile(os.path.join(directory, 'nodepy.json'))
+  assert cache.contains(directory)
+  assert_equals(cache.tree(sha256), directory)
+  assert_equals(cache.lookup('@scope/a', '1.0.0'),
+    {'sha256': sha256, 'url': 'https://example.org/x', 'registry': 'default'})
+  assert_equals(cache.lookup('@scope/a', '2.0.0'), None)
+  assert_equals(cache.versions('@scope/a'), [semver.Version('1.0.0')])
+  assert_equals(cache.packages(sha256), ['@scope/a@1.0.0'])
+  # Installed packages hardlink the files, they must not be modified.
+  assert_read_only(directory)
+  # Adding the same archive again keeps the existing tree.
+  fp.seek(0)
+  assert_equals(cache.add('@scope/a', semver.Version('1.0.0'), fp, sha256), directory)
+  assert_equals(len(cache.entries()), 1)
+
+
+@with_cache
+def test_add_skips_unsafe_members(cache):
+  fp = io.BytesIO()
+  with tarfile.open(fileobj=fp, mode='w:gz') as tar:
+    for filename in ['nodepy.json', '../../escaped.py', '/abs.py', 'lib/../../up.py']:
+      info = tarfile.TarInfo(filename)
+      info.size = 2
+      tar.addfile(info, io.BytesIO(b'{}'))
+    info = tarfile.TarInfo('link')
+    info.type = tarfile.SYMTYPE
+    info.linkname = '/etc/passwd'
+    tar.addfile(info)
+  fp.seek(0)
+  sha256 = hashlib.sha256(fp.getvalue()).hexdigest()
+  directory = cache.add('a', semver.Version('1.0.0'), fp, sha256)
+  assert_equals(os.listdir(directory), ['nodepy.json'])
+  for root, dirs, files in os.walk(cache.directory):
+    for name in files + dirs:
+      assert name not in ('escaped.py', 'abs.py', 'up.py', 'link'), os.path.join(root, name)
+  assert not os.path.exists('/abs.py')
+
+
+@with_cache
+def test_add_stream(cache):
+  fp, sha256 = make_archive('a', '1.0.0', 100)
+  directory, digest = cache.add_stream(fp)
+  assert_equals(digest, sha256)
+  assert_equals(directory, cache.tree(sha256))
+  assert os.path.isfile(os.path.join(directory, 'data.bin'))
+  assert_read_only(directory)
+  with open(os.path.join(cache.directory, 'archives', sha256 + '.tar.gz'), 'rb') as src:
+    assert_equals(src.read(), fp.getvalue())
+  assert_equals(cache.lookup('a', '1.0.0'), None)
+  cache.record('a', '1.0.0', sha256)
+  assert_equals(cache.lookup('a', '1.0.0')['sha256'], sha256)
+
+  # Rejected archives leave nothing behind.
+  fp, sha256 = make_archive('a', '1.1.0')
+  def check(digest):
+    raise ValueError(digest)
+  assert_raises(ValueError, cache.add_stream, fp, check)
+  assert_equals(cache.tree(sha256), None)
+  assert_equals(len(os.listdir(os.path.join(cache.directory, 'archives'))), 1)
+  assert_equals(len(os.listdir(os.path.join(cache.directory, 'trees'))), 1)
+
+
+@with_cache
+def test_prune(cache):
+  old, old_sha = add(cache, 'a', '1.0.0', 4000)
+  new, new_sha = add(cache, 'a', '1.1.0', 4000)
+  os.utime(old, (time.time() - 100, time.time() - 100))
+  entries = cache.entries()
+  assert_equals(len(entries), 2)
+  cache.close()  # prune() waits for the shared lock
+  removed = cache.prune(max_size=sum(x.size for x in entries) - 1)
+  assert_equals([x.sha256 for x in removed], [old_sha])
+  assert_equals(cache.tree(old_sha), None)
+  assert_equals(cache.tree(new_sha), new)
+  assert_equals(cache.versions('a'), [semver.Version('1.1.0')])
+  assert not os.path.exists(cache._index_filename('a', '1.0.0'))
+
+
+@with_cache
+def test_registry(cache):
+  add(cache, 'a', '1.0.0')
+  add(cache, 'a', '1.2.0')
+  registry = CacheRegistry(cache)
+  assert_equals(sorted(registry.versions('a')), [semver.Version('1.0.0'), semver.Version('1.2.0')])
+  info = registry.find_package('a', semver.Selector('~1.0.0'))
+  assert_equals(info.identifier, 'a@1.0.0')
+  assert_equals(info.manifest['name'], 'a')
+  assert_raises(_registry.PackageNotFound, registry.versions, 'b')
+  assert_raises(_registry.PackageNotFound, registry.find_package, 'a', semver.Selector('>=2.0.0'))
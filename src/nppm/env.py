@@ -20,9 +20,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import distutils.sysconfig
+import email.parser
+import io
 import json
 import os
+import re
 import sys
 
 try:
@@ -37,6 +39,9 @@ MODULES_DIRECTORY = Context.modules_directory
 PIP_DIRECTORY = Context.pipprefix_directory
 PROGRAM_DIRECTORY = os.path.join(os.path.dirname(PIP_DIRECTORY), 'bin')
 LINK_SUFFIX = Context.link_suffix
+ZIPPED_PACKAGE_SUFFIX = Context.zipped_package_suffix
+LOCKFILE = 'nodepy-lock.json'
+INSTALLED_DATABASE = os.path.join(os.path.dirname(MODULES_DIRECTORY), 'installed.db')
 
 
 def is_virtualenv():
@@ -55,6 +60,7 @@ def get_directories(location, auto_upgrade=True):
   - packages
   - bin
   - pip_bin
+  - installed_db (the #installdb.InstalledDatabase of the packages)
 
   Only when *location* is `'local'` or `'global'`, the following keys are
   available:
@@ -75,6 +81,7 @@ def get_directories(location, auto_upgrade=True):
     return {
       'packages': MODULES_DIRECTORY,
       'bin': PROGRAM_DIRECTORY,
+      'installed_db': INSTALLED_DATABASE,
       'pip_prefix': local['data'],
       'pip_bin': local['scripts'],
       'pip_lib': local['purelib']
@@ -86,6 +93,7 @@ def get_directories(location, auto_upgrade=True):
   return {
     # Install Node.py modules near the site-packages.
     'packages': os.path.join(os.path.dirname(scheme['purelib']), 'nodepy-modules'),
+    'installed_db': os.path.join(os.path.dirname(scheme['purelib']), 'nodepy-installed.db'),
     'bin': scheme['scripts'],
     'pip_prefix': scheme['data'],
     # Re-use Pip's script and site-packages directory.
@@ -135,54 +143,127 @@ def get_python_install_type():
   return 'root'
 
 
+class DistInfoIndex(object):
+  """
+  An index of the `.dist-info` directories that Pip creates for installed
+  distributions, by their normalized name (see #normalize_dist_name()).
+  Every directory is listed once and only listed again when its
+  modification time changed, and the metadata of a distribution is read
+  once.
+  """
+
+  def __init__(self):
+    self._dirs = {}   # dirname -> (mtime, {name: dist_info})
+    self._infos = {}  # dist_info -> (mtime, data)
+
+  def clear(self):
+    self._dirs.clear()
+    self._infos.clear()
+
+  def _scan(self, dirname):
+    try:
+      mtime = os.stat(dirname).st_mtime
+    except OSError:
+      return {}
+    cached = self._dirs.get(dirname)
+    if cached and cached[0] == mtime:
+      return cached[1]
+    entries = {}
+    try:
+      names = os.listdir(dirname)
+    except OSError:
+      names = []
+    for fn in sorted(names):
+      if fn.endswith('.dist-info'):
+        name = fn[:-len('.dist-info')].rpartition('-')[0]
+        entries.setdefault(normalize_dist_name(name), os.path.join(dirname, fn))
+    self._dirs[dirname] = (mtime, entries)
+    return entries
+
+  def _load(self, dist_info):
+    try:
+      mtime = os.stat(dist_info).st_mtime
+    except OSError:
+      return None
+    cached = self._infos.get(dist_info)
+    if cached and cached[0] == mtime:
+      return cached[1]
+    data = read_dist_info(dist_info)
+    self._infos[dist_info] = (mtime, data)
+    return data
+
+  def find(self, name, pythonpath=None):
+    """
+    Returns the distribution information of *name* from the first
+    directory in *pythonpath* (defaults to #sys.path) that contains it
+    (see #read_dist_info()), or #None.
+    """
+
+    name = normalize_dist_name(name)
+    for dirname in (sys.path if pythonpath is None else pythonpath):
+      dist_info = self._scan(os.path.abspath(dirname or os.curdir)).get(name)
+      data = self._load(dist_info) if dist_info else None
+      if data is not None:
+        return data
+    return None
+
+
+_dist_info_index = DistInfoIndex()
+
+
+def normalize_dist_name(name):
+  """
+  Normalizes the name of a Python distribution as described in PEP 503,
+  which also matches the names of `.dist-info` directories.
+  """
+
+  return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def read_dist_info(dist_info):
+  """
+  Reads the `METADATA` (or the legacy `metadata.json`) and `top_level.txt`
+  files of a *dist_info* directory. Returns a dictionary with at least the
+  keys `name`, `version`, `top_level` and `.dist-info`, or #None if there
+  is no metadata.
+  """
+
+  filename = os.path.join(dist_info, 'METADATA')
+  if os.path.isfile(filename):
+    with io.open(filename, encoding='utf8', errors='replace') as fp:
+      meta = email.parser.Parser().parse(fp, headersonly=True)
+    data = {'name': meta['Name'], 'version': meta['Version'],
+      'summary': meta['Summary'], 'requires': meta.get_all('Requires-Dist') or []}
+  else:
+    filename = os.path.join(dist_info, 'metadata.json')
+    if not os.path.isfile(filename):
+      return None
+    with open(filename) as fp:
+      data = json.load(fp)
+  data['.dist-info'] = dist_info
+
+  filename = os.path.join(dist_info, 'top_level.txt')
+  if os.path.isfile(filename):
+    with open(filename) as fp:
+      data['top_level'] = fp.read().splitlines()
+  else:
+    data['top_level'] = []
+  return data
+
+
 def get_module_dist_info(module, pythonpath=None):
   """
-  Finds a Python module in the *pythonpath* and returns the distribution
-  information stored by Pip in the respective `.dist-info` directory. If
-  the module can not be found, #None will be returned.
+  Finds a Python module in the *pythonpath* (defaults to #sys.path) and
+  returns the distribution information stored by Pip in the respective
+  `.dist-info` directory (see #read_dist_info()). If the module can not be
+  found, #None will be returned. Lookups use a #DistInfoIndex.
 
   Note that the *module* name does not necessarily reflect the name of the
   Python module name that is used on `import`s, but instead the name of the
   module on PyPI and as defined in the `setup.py` script.
   """
 
-  module = module.replace('-', '_').lower()
-
-  if not pythonpath:
-    pythonpath = sys.path
-  sosuffix = distutils.sysconfig.get_config_var('SO')
-  for dirname in sys.path:
-    if not os.path.isdir(dirname): continue
-    for fn in os.listdir(dirname):
-      if not fn.endswith('.dist-info'): continue
-      if not fn.lower().startswith(module + '-'): continue
-      break
-    else:
-      continue
-    dist_info = os.path.join(dirname, fn)
-    version = fn[len(module) + 1:-len('.dist-info')]
-
-    # Load the metadata.json.
-    fn = os.path.join(dist_info, 'metadata.json')
-    if not os.path.isfile(fn):
-      # TODO: Don't show if no verbose output is desired.
-      print('warning: file \'{}\' does not exist'.format(fn))
-      continue
-    with open(fn) as fp:
-      data =json.load(fp)
-    data['.dist-info'] = dist_info
-
-    # Load the top-level file.
-    fn = os.path.join(dist_info, 'top_level.txt')
-    if os.path.isfile(fn):
-      with open(fn) as fp:
-        data['top_level'] = fp.read().splitlines()
-    else:
-      data['top_level'] = []
-
-    return data
-
-  return None
+  return _dist_info_index.find(module, pythonpath)
 
 
 def cfgvars(dev):
@@ -0,0 +1,69 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+import json
+import os
+import shutil
+import tempfile
+import env from './env'
+
+
+def make_dist_info(dirname, name, version, metadata_json=False):
+  dist_info = os.path.join(dirname, '{}-{}.dist-info'.format(name.replace('-', '_'), version))
+  os.makedirs(dist_info)
+  if metadata_json:
+    with open(os.path.join(dist_info, 'metadata.json'), 'w') as fp:
+      json.dump({'name': name, 'version': version}, fp)
+  else:
+    with open(os.path.join(dist_info, 'METADATA'), 'w') as fp:
+      fp.write('Metadata-Version: 2.1\nName: {}\nVersion: {}\nRequires-Dist: six\n\nDescription\n'.format(name, version))
+  with open(os.path.join(dist_info, 'top_level.txt'), 'w') as fp:
+    fp.write(name.replace('-', '_') + '\n')
+  return dist_info
+
+
+def test_dist_info_index():
+  first, second = tempfile.mkdtemp(), tempfile.mkdtemp()
+  try:
+    index = env.DistInfoIndex()
+    path = [first, second, os.path.join(first, 'missing')]
+    dist_info = make_dist_info(second, 'Foo-Bar', '1.0.0')
+    make_dist_info(first, 'legacy', '0.1', metadata_json=True)
+
+    data = index.find('foo_bar', path)
+    assert_equals(data['name'], 'Foo-Bar')
+    assert_equals(data['version'], '1.0.0')
+    assert_equals(data['requires'], ['six'])
+    assert_equals(data['top_level'], ['Foo_Bar'])
+    assert_equals(data['.dist-info'], dist_info)
+    assert_equals(index.find('legacy', path)['version'], '0.1')
+    assert_equals(index.find('foo-bar', [first]), None)
+    assert_equals(index.find('six', path), None)
+
+    # A new distribution changes the mtime of the directory.
+    make_dist_info(first, 'foo.bar', '2.0.0')
+    os.utime(first, (0, 0))
+    assert_equals(index.find('Foo-Bar', path)['version'], '2.0.0')
+  finally:
+    shutil.rmtree(first)
+    shutil.rmtree(second)
@@ -22,6 +22,7 @@
 
 from __future__ import print_function
 from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
 from nodepy.context import Context
 from nodepy.utils import pathlib
 from nr.fs import issub
@@ -31,10 +32,13 @@ try:
 except ImportError:
   import pip.commands as pip_commands
 
+import collections
 import contextlib
 import errno
+import io
 import nodepy.main
 import os
+import requests
 import shlex
 import shutil
 import six
@@ -43,8 +47,14 @@ import sys
 import tarfile
 import tempfile
 import traceback
+import zipfile
 
 import _registry from './registry'
+import _solver from './solver'
+import _lockfile from './lockfile'
+import _cache from './cache'
+import _installdb from './installdb'
+import _pipstore from './pipstore'
 import refstring from './refstring'
 import env from './env'
 import semver from './semver'
@@ -53,6 +63,8 @@ import manifest from './manifest'
 import _download from './util/download'
 import _script from './util/script'
 import decorators from './util/decorators'
+import {FilePlacer} from './util/place'
+import text from './util/text'
 import {PackageLifecycle} from './package_lifecycle'
 import {PACKAGE_MANIFEST} from './env'
 
@@ -113,25 +125,36 @@ class InvalidPackage(object):
     self.directory = directory
 
 
-def walk_package_files(manifest):
+def package_file_patterns(manifest, gitignore=True):
   """
-  Walks over the files included in a package and yields (abspath, relpath).
+  Returns the (include, exclude) patterns for the files of a package as
+  understood by #_check_include_file(). If *gitignore* is #True, the lines
+  of the `.gitignore` file in the package directory are added to the
+  exclude patterns.
   """
 
   include = manifest.get('include', None)
-  if include is None:
-    exclude = manifest.get('exclude', []) + default_exclude_patterns
-    ignore_file = os.path.join(manifest.directory, '.gitignore')
-    if os.path.isfile(ignore_file):
-      with open(ignore_file) as fp:
-        for line in fp:
-          line = line.strip()
-          if not line: continue
-          if line.startswith('#') or line.startswith('!'): continue
-          exclude.append(line)
-  else:
-    exclude = None
+  if include is not None:
+    return include, None
+  exclude = manifest.get('exclude', []) + default_exclude_patterns
+  ignore_file = os.path.join(manifest.directory, '.gitignore') \
+    if gitignore and manifest.directory else None
+  if ignore_file and os.path.isfile(ignore_file):
+    with open(ignore_file) as fp:
+      for line in fp:
+        line = line.strip()
+        if not line: continue
+        if line.startswith('#') or line.startswith('!'): continue
+        exclude.append(line)
+  return None, exclude
+
 
+def walk_package_files(manifest):
+  """
+  Walks over the files included in a package and yields (abspath, relpath).
+  """
+
+  include, exclude = package_file_patterns(manifest)
   for root, __, files in os.walk(manifest.directory):
     for filename in files:
       filename = os.path.join(root, filename)
@@ -140,33 +163,167 @@ def walk_package_files(manifest):
         yield (filename, rel)
 
 
+def write_package_archive(manifest, filename):
+  """
+  Writes the files of a package into a ZIP archive at *filename* from which
+  the package can be loaded by the Node.py runtime. The members are stored
+  uncompressed so that the runtime can read them without decompressing
+  (see #nodepy.utils.path.zippath.ZipArchive.read_buffer()). The archive is
+  written to a temporary file first and then moved into place.
+
+  Returns the number of files written.
+  """
+
+  count = 0
+  tmpname = filename + '.tmp'
+  try:
+    with zipfile.ZipFile(tmpname, 'w', zipfile.ZIP_STORED) as zipf:
+      for src, rel in walk_package_files(manifest):
+        zipf.write(src, rel.replace(os.sep, '/'))
+        count += 1
+    if os.name == 'nt' and os.path.isfile(filename):
+      os.remove(filename)
+    os.rename(tmpname, filename)
+  finally:
+    if os.path.isfile(tmpname):
+      os.remove(tmpname)
+  return count
+
+
 class Installer:
   """
   This class manages the installation/uninstallation procedure.
+
+  If *zip_install* is #True, packages are installed as a single
+  `<name>.zip` archive in the modules directory instead of being expanded
+  into a `<name>/` directory. Packages that end up with an internal
+  dependency installed into their directory are expanded nonetheless.
+
+  Registry dependencies are solved for the whole dependency tree before
+  they are installed, see #solve(). With *jobs* greater than one, the
+  package metadata and archives are fetched concurrently, see #prefetch().
+  Call #close() when the installer is no longer needed.
+
+  With a #_cache.PackageCache, package archives are downloaded only if they
+  are not already in the cache and are installed from the unpacked trees in
+  the cache, and the registries cache their metadata (see
+  #MetadataCache). With *offline*, the cache is the only registry.
+
+  With #batch_pip, the Python dependencies of all packages are collected
+  and installed with one Pip invocation per prefix when
+  #flush_python_dependencies() is called.
+
+  With a #_pipstore.PipStore as *pip_store*, Pip installs the Python
+  dependencies into the store (once per version and interpreter ABI) and
+  their files are placed into the Pip prefixes from there. This does not
+  apply to root installs and the *pip_use_target_option*.
+
+  With the *link_mode* `'auto'`, files are hardlinked from the trees in the
+  cache, or cloned with reflinks or `copy_file_range()` where the
+  filesystem supports it (see #FilePlacer). `'copy'` always copies.
+
+  Installed packages are recorded in the #_installdb.InstalledDatabase
+  #db, which #find_package() uses instead of reading the manifests.
+
+  If #lock is set to a #_lockfile.Lockfile, registry requirements that match
+  a locked version are installed from the recorded archive URL without
+  asking the registry, and the archives are checked against the recorded
+  SHA256 digests. With #frozen_lockfile, requirements that the lockfile
+  does not satisfy are an error.
   """
 
   def __init__(self, context=None, registry=None, upgrade=False, install_location='local',
-      pip_use_target_option=False, recursive=False, verbose=False):
+      pip_use_target_option=False, recursive=False, verbose=False, zip_install=False,
+      jobs=1, cache=None, offline=False, link_mode='auto', pip_store=None):
     assert install_location in ('local', 'global', 'root')
+    assert link_mode in ('auto', 'copy')
+    if offline and cache is None:
+      raise ValueError('offline installs require a package cache')
     self.context = context or Context()
-    self.reg = [registry] if registry else _registry.RegistryClient.get_all(self.context.config)
+    if offline:
+      self.reg = [_cache.CacheRegistry(cache)]
+    else:
+      self.reg = [registry] if registry else _registry.RegistryClient.get_all(
+        self.context.config, cache=cache is not None)
     self.upgrade = upgrade
     self.install_location = install_location
     self.pip_use_target_option = pip_use_target_option
     self.recursive = recursive
     self.verbose = verbose
+    self.zip_install = zip_install
+    self.jobs = jobs
+    self.cache = cache
+    self.offline = offline
+    self.link_mode = link_mode
+    self.pip_store = pip_store
+    if cache is not None:
+      cache.open()
     self.dirs = env.get_directories(install_location)
     self.dirs['reference_dir'] = os.path.dirname(self.dirs['packages'])
+    self.db = _installdb.InstalledDatabase(self.dirs['installed_db'])
     self.script = _script.ScriptMaker(self.context.config, self.dirs['bin'], self.install_location)
     self.ignore_installed = False
     if install_location in ('local', 'global'):
       self.script.path.append(self.dirs['pip_bin'])
       self.script.pythonpath.extend([self.dirs['pip_lib']])
     self.installed_python_libs = {}
+    self.batch_pip = False
+    self._pip_batch = collections.OrderedDict()  # prefix -> (locs, {name: [(line, requester)]})
     self.currently_installing = []  # stack of currently installing packages
     self.install_base = []  # stack of last module that was installed internally
     self.pure_stack = [False]  # stack of indicators that represent if a pure
                                # installation is performed (pure => dont install scripts)
+    self._pool = None
+    self.lock = None  # lockfile.Lockfile
+    self.frozen_lockfile = False
+    self._solver = None
+    self._resolved = {}  # (name, selector, registry) -> (registry, info)
+    self._prefetched = {}  # (name, version) -> unpacked directory or None
+    self._archives = {}  # (name, version) -> (registry name, url, sha256)
+    self._url_registries = {}  # url -> RegistryClient
+
+  def close(self):
+    """
+    Stops the worker threads, removes the directories of packages that have
+    been prefetched but not installed, closes the registry connections and
+    releases the #cache and the #db.
+    """
+
+    if self._pool is not None:
+      self._pool.close()
+      self._pool.join()
+      self._pool = None
+    for directory in self._prefetched.values():
+      if directory:
+        self._release(directory)
+    self._prefetched.clear()
+    for registry in self.reg + list(self._url_registries.values()):
+      if isinstance(registry, _registry.RegistryClient):
+        registry.close()
+    if self.cache is not None:
+      self.cache.close()
+    self.db.close()
+
+  def _get_file_placer(self, directory):
+    """
+    Returns a #FilePlacer for installing the files of a package from
+    *directory*. Hardlinks are only used for trees in the #cache, which are
+    never modified.
+    """
+
+    if self.link_mode == 'copy':
+      placer = FilePlacer()
+      placer.disabled.update(('reflink', 'copy_file_range'))
+      return placer
+    return FilePlacer(hardlink=self.cache is not None and self.cache.contains(directory))
+
+  def _release(self, directory):
+    """
+    Removes an unpacked package *directory* unless it belongs to the #cache.
+    """
+
+    if self.cache is None or not self.cache.contains(directory):
+      _rmtree(directory, ignore_errors=True)
 
   @contextlib.contextmanager
   def pythonpath_update_context(self):
@@ -206,12 +363,21 @@ class Installer:
     mf['__is_link'] = is_link
     return mf
 
+  def _load_zipped_manifest(self, archive, do_raise=True):
+    with zipfile.ZipFile(archive, 'r') as zipf:
+      with zipf.open(PACKAGE_MANIFEST) as fp:
+        fp = io.TextIOWrapper(fp, 'utf8') if six.PY3 else fp
+        return self._load_manifest(fp, directory=archive, do_raise=do_raise)
+
   def find_package(self, package, internal=False):
     """
     Finds an installed package and returns its #PackageManifest.
     Raises #PackageNotFound if the package could not be found, or possibly
     an #InvalidPackageManifest exception if the manifest is invalid.
 
+    The package is looked up in the #db first. If it is not recorded or the
+    record is outdated, the manifest is loaded and recorded.
+
     If #Installer.strict is set, the package is only looked for in the target
     packages directory instead of all possibly inherited paths.
     """
@@ -222,21 +388,41 @@ class Installer:
     else:
       dirname = os.path.join(self.dirs['packages'], package)
 
+    record = self.db.lookup(dirname)
+    if record is not None:
+      mf = manifest.Manifest(record.directory, record.manifest)
+      mf['__is_link'] = (record.kind == 'link')
+      return mf
+
+    link_fn = dirname + env.LINK_SUFFIX
     lnk = nodepy.resolver.resolve_link(self.context, pathlib.Path(dirname))
     if not lnk.is_dir():
+      archive = dirname + env.ZIPPED_PACKAGE_SUFFIX
+      if os.path.isfile(archive):
+        try:
+          mf = self._load_zipped_manifest(archive)
+        except KeyError:
+          print('Warning: found package archive without {}'.format(PACKAGE_MANIFEST))
+          print("  at '{}'".format(archive))
+          return InvalidPackage(package, archive)
+        self.db.add(dirname, 'archive', mf, [archive])
+        return mf
+      if self.db.get(dirname) is not None:
+        self.db.remove(dirname)
       raise PackageNotFound(package)
 
-    if lnk:
-      manifest_fn = os.path.join(str(lnk), PACKAGE_MANIFEST)
-    else:
-      manifest_fn = os.path.join(dirname, PACKAGE_MANIFEST)
-
+    is_link = os.path.isfile(link_fn)
+    manifest_fn = os.path.join(str(lnk), PACKAGE_MANIFEST)
     if not os.path.isfile(manifest_fn):
       print('Warning: found package directory without {}'.format(PACKAGE_MANIFEST))
       print("  at '{}'".format(dirname))
       return InvalidPackage(package, dirname)
-    else:
-      return self._load_manifest(manifest_fn, directory=dirname, is_link=bool(lnk))
+
+    mf = self._load_manifest(manifest_fn, directory=dirname, is_link=is_link)
+    if mf is not None:
+      self.db.add(dirname, 'link' if is_link else 'directory', mf,
+        [link_fn, manifest_fn] if is_link else [manifest_fn])
+    return mf
 
   def uninstall(self, package_name, internal=False):
     """
@@ -248,13 +434,16 @@ class Installer:
     except PackageNotFound:
       print('Package "{}" not installed'.format(package_name))
       return False
-    else:
-      return self.uninstall_directory(manifest.directory)
+    dependents = [x.name + '@' + x.version for x in self.db.dependents(package_name)]
+    if dependents:
+      print('Note: "{}" is a dependency of {}'.format(package_name, ', '.join(dependents)))
+    return self.uninstall_directory(manifest.directory)
 
   def uninstall_directory(self, directory):
     """
     Uninstalls a package from a directory. Returns True on success, False
-    on failure.
+    on failure. *directory* may also be the path to a package that has been
+    installed as a ZIP archive.
     """
 
     link_fn = os.path.join(directory + env.LINK_SUFFIX)
@@ -265,7 +454,15 @@ class Installer:
       manifest_fn = os.path.join(directory, PACKAGE_MANIFEST)
 
     try:
-      mf = self._load_manifest(manifest_fn)
+      if os.path.isfile(directory):
+        try:
+          mf = self._load_zipped_manifest(directory)
+        except (KeyError, zipfile.BadZipfile):
+          print('Removing previous archive: "{}"'.format(directory))
+          os.remove(directory)
+          return True
+      else:
+        mf = self._load_manifest(manifest_fn)
     except (OSError, IOError) as exc:
       if exc.errno != errno.ENOENT:
         raise
@@ -288,17 +485,28 @@ class Installer:
       print('Error: pre-uninstall script failed.')
       return False
 
-
-    for script_name in mf.get('bin', {}).keys():
-      for script_name in self.expand_script_name(script_name):
-        for filename in self.script.get_files_for_script_name(script_name):
-          print('  * Removing script {} ... '.format(os.path.basename(filename)), end='')
-          try:
-            os.remove(filename)
-          except OSError as e:
-            print('ERROR ({})'.format(e))
-          else:
-            print('OK')
+    # Prefer the script files that were recorded when the package was
+    # installed over the files that the current ScriptMaker would create.
+    package_path = directory
+    if package_path.endswith(env.ZIPPED_PACKAGE_SUFFIX):
+      package_path = package_path[:-len(env.ZIPPED_PACKAGE_SUFFIX)]
+    scripts = self.db.scripts(package_path)
+    if scripts is None:
+      scripts = [(name, filename)
+        for script_name in mf.get('bin', {}).keys()
+        for name in self.expand_script_name(script_name)
+        for filename in self.script.get_files_for_script_name(name)]
+
+    for script_name, filename in scripts:
+      if not os.path.exists(filename):
+        continue
+      print('  * Removing script {} ... '.format(os.path.basename(filename)), end='')
+      try:
+        os.remove(filename)
+      except OSError as e:
+        print('ERROR ({})'.format(e))
+      else:
+        print('OK')
 
     if os.path.isdir(directory):
       print('  * Removing package directory {} ... '.format(os.path.basename(directory)), end='')
@@ -308,6 +516,14 @@ class Installer:
         print('ERROR ({})'.format(e))
       else:
         print('OK')
+    elif os.path.isfile(directory):
+      print('  * Removing package archive {} ... '.format(os.path.basename(directory)), end='')
+      try:
+        os.remove(directory)
+      except OSError as e:
+        print('ERROR ({})'.format(e))
+      else:
+        print('OK')
     link_file = directory + env.LINK_SUFFIX
     if os.path.isfile(link_file):
       print('  * Removing {} ... '.format(os.path.basename(link_file)), end='')
@@ -318,18 +534,19 @@ class Installer:
       else:
         print('OK')
 
+    self.db.remove(package_path)
     return True
 
-  def install_dependencies_for(self, manifest, install_dir, delayed_deps,
+  def install_dependencies_for(self, mf, install_dir, delayed_deps,
         dev=False, internal=False):
     """
     Installs the Node.py and Python dependencies of a #PackageManifest.
     """
 
-    deps = manifest.eval_fields(env.cfgvars(dev), 'dependencies', {})
+    deps = mf.eval_fields(env.cfgvars(dev), 'dependencies', {})
     for name, req in deps.items():
-      if not isinstance(req, _manifest.Requirement):
-        req = _manifest.Requirement.from_line(req, name=name)
+      if not isinstance(req, manifest.Requirement):
+        req = manifest.Requirement.from_line(req, name=name)
       deps[name] = req
 
     if delayed_deps is not None:
@@ -343,16 +560,20 @@ class Installer:
           del deps[name]
 
     if deps:
-      print('Installing dependencies for "{}"{}...'.format(manifest.identifier,
+      print('Installing dependencies for "{}"{}...'.format(mf.identifier,
           ' (dev) ' if dev else ''))
-      if not self.install_dependencies(deps, manifest.directory):
+      if not self.install_dependencies(deps, mf.directory):
         return False
 
-    deps = manifest.eval_fields(env.cfgvars(dev), 'pip_dependencies', {})
+    deps = mf.eval_fields(env.cfgvars(dev), 'pip_dependencies', {})
     if deps:
-      print('Installing Python dependencies for "{}"{}...'.format(
-          manifest.identifier, ' (dev) ' if dev else ''))
-      if not self.install_python_dependencies(deps):
+      # A post-install script may import the Python dependencies, thus they
+      # can not wait for the batched Pip install.
+      immediate = 'post-install' in mf.get('scripts', {})
+      if not self.batch_pip or immediate:
+        print('Installing Python dependencies for "{}"{}...'.format(
+            mf.identifier, ' (dev) ' if dev else ''))
+      if not self.install_python_dependencies(deps, immediate=immediate):
         return False
 
     return True
@@ -370,30 +591,39 @@ class Installer:
         have_package = self.find_package(name, req.internal)
         if isinstance(have_package, InvalidPackage):
           raise PackageNotFound
-        if have_package.get('__is_link'):
+        if have_package.get('__is_link') or req.type != 'registry':
           # If the package is a link -- try re installing always as the
-          # link may have been invalidated.
+          # link may have been invalidated. Packages from paths and Git
+          # repositories may have changed, too.
           raise PackageNotFound
       except PackageNotFound as exc:
         install_deps.append((name, req))
       else:
-        if req.type == 'registry':
-          if not req.selector(semver.Version(have_package['version'])):
-            print('  Warning: Dependency "{}@{}" unsatisfied, have "{}" installed'
-                .format(name, req.selector, have_package.identifier))
-          else:
-            print('  Skipping satisfied dependency "{}@{}", have "{}" installed'
-                .format(name, req.selector, have_package.identifier))
-        else:
-          # Must be a Git URL or a relative path.
-          print('  Skipping "{}" dependency, have "{}" installed'
-            .format(req.type, name, have_package.identifier))
+        version = semver.Version(have_package['version'])
+        locked = self.lock.get(name, req.selector) if self.lock else None
+        if locked is not None and locked.version != version:
+          print('  Installing locked version "{}", have "{}" installed'.format(
+            locked.identifier, have_package.identifier))
+          install_deps.append((name, req))
+          continue
+        if not req.selector(version):
+          print('  Installing "{}@{}", have "{}" installed'.format(
+            name, req.selector, have_package.identifier))
+          install_deps.append((name, req))
+          continue
+        print('  Skipping satisfied dependency "{}@{}", have "{}" installed'
+            .format(name, req.selector, have_package.identifier))
         if self.recursive:
           self.install_dependencies_for(have_package, have_package.directory, None)
 
     if not install_deps:
       return True
 
+    packages = self.solve(collections.OrderedDict(install_deps),
+      self.currently_installing[-1][0].identifier if self.currently_installing else None)
+    if packages is None:
+      return False
+    self.prefetch(packages)
     for name, req in install_deps:
       print('  Installing "{}" ({})'.format(name, req))
       if req.type == 'registry':
@@ -413,14 +643,37 @@ class Installer:
 
     return True
 
-  def install_python_dependencies(self, deps, args=()):
+  def _pip_locations(self):
+    """
+    Returns the directories that Pip installs into for the package that is
+    currently being installed, or #None for the root install location.
+    """
+
+    if self.install_base:
+      return env.pip_locations_for(self.install_base[-1][1])
+    elif self.install_location in ('local', 'global'):
+      return self.dirs
+    elif self.install_location == 'root':
+      return None
+    else:
+      raise RuntimeError('unexpected install location: {!r}'.format(self.install_location))
+
+  def install_python_dependencies(self, deps, args=(), immediate=False):
     """
     Install all Python dependencies specified in *deps* using Pip. Make sure
-    to call #relink_pip_scripts().
+    to call #relink_pip_scripts(). Versions pinned in the #lock take
+    precedence over the versions in *deps*.
+
+    If #batch_pip is enabled, the requirements are only recorded for the
+    current Pip prefix unless *immediate* is #True or *args* are specified.
+    They are installed with a single Pip invocation per prefix by
+    #flush_python_dependencies().
     """
 
     install_modules = []
     for name, version in deps.items():
+      if self.lock and name in self.lock.pip:
+        version = self.lock.pip[name]
       install_modules.append(str(manifest.PipRequirement.from_spec(name, version)))
 
     if not install_modules and not args:
@@ -428,15 +681,91 @@ class Installer:
 
     # TODO: Upgrade strategy?
 
-    if self.install_base:
-      locs = env.pip_locations_for(self.install_base[-1][1])
-    elif self.install_location in ('local', 'global'):
-      locs = self.dirs
-    elif self.install_location == 'root':
-      locs = None
+    locs = self._pip_locations()
+    if self.batch_pip and not immediate and not args:
+      key = locs['pip_prefix'] if locs else None
+      requester = self.currently_installing[-1][0].identifier \
+        if self.currently_installing else None
+      batch = self._pip_batch.setdefault(key, (locs, collections.OrderedDict()))[1]
+      for name, line in zip(deps, install_modules):
+        batch.setdefault(name, []).append((line, requester))
+      return True
+
+    return self._run_pip(locs, install_modules, args, list(deps))
+
+  def flush_python_dependencies(self):
+    """
+    Installs the Python dependencies that have been recorded while
+    #batch_pip was enabled, running Pip once for every prefix with the
+    merged requirements of all packages (see #merge_pip_requirements()).
+    Reports the installed distribution for every package.
+    """
+
+    batches, self._pip_batch = self._pip_batch, collections.OrderedDict()
+    for locs, requirements in batches.values():
+      lines = []
+      for name, items in requirements.items():
+        lines.extend(merge_pip_requirements([line for line, _ in items]))
+      print('Installing {} Python package(s) for {} Node.py package(s) ...'.format(
+        len(requirements), len(set(r for x in requirements.values() for _, r in x))))
+      if not self._run_pip(locs, lines, (), list(requirements)):
+        for name, items in requirements.items():
+          for line, requester in items:
+            print('  {} (required by {})'.format(line, requester or 'root'))
+        return False
+      for name, items in requirements.items():
+        dist_info = self.installed_python_libs.get(name)
+        version = dist_info['version'] if dist_info else '?'
+        for line, requester in items:
+          print('  {} {} for "{}"'.format(name, version, requester or 'root'))
+    return True
+
+  def _run_pip(self, locs, install_modules, args, dep_names):
+    if self.pip_store is not None and locs and not args and not self.pip_use_target_option:
+      return self._install_from_pip_store(locs, install_modules, dep_names)
+    return self._call_pip(locs, install_modules, args, dep_names)
+
+  def _install_from_pip_store(self, locs, install_modules, dep_names):
+    """
+    Installs the requirements *install_modules* into the prefix *locs* from
+    the #pip_store. Requirements that the store can not satisfy are first
+    installed into the store with Pip. If the store still can not resolve
+    them (eg. for URL requirements), Pip installs into the prefix directly.
+    """
+
+    # With #upgrade, only exactly pinned requirements (eg. from the lockfile)
+    # are satisfied from the store without asking Pip for newer versions.
+    store = self.pip_store
+    entries = None
+    if not self.upgrade or all(_pipstore.is_pinned(x) for x in install_modules):
+      entries = store.resolve(install_modules)
+    if entries is None:
+      with store.staging() as staging:
+        staging_locs = env.pip_locations_for(staging)
+        if not self._call_pip(staging_locs, install_modules, ['--ignore-installed'], []):
+          return False
+        store.add_prefix(staging_locs['pip_prefix'])
+      entries = store.resolve(install_modules)
+      if entries is None:
+        print('  Note: the requirements can not be satisfied from the Pip store')
+        return self._call_pip(locs, install_modules, (), dep_names)
+
+    if self.link_mode == 'copy':
+      placer = FilePlacer()
+      placer.disabled.update(('reflink', 'copy_file_range'))
     else:
-      raise RuntimeError('unexpected install location: {!r}'.format(self.install_location))
+      placer = FilePlacer(hardlink=True)
+    linked = [x for x in entries if store.link(x, locs['pip_prefix'], placer)]
+    print('  Placed {} Python package(s) from the Pip store ({} up to date){}'.format(
+      len(linked), len(entries) - len(linked),
+      ': ' + placer.summary() if placer.counts else ''))
+
+    with self.pythonpath_update_context():
+      for dep_name in dep_names:
+        self.installed_python_libs[dep_name] = env.get_module_dist_info(dep_name)
+    return True
 
+  def _call_pip(self, locs, install_modules, args, dep_names):
     if locs:
       if self.pip_use_target_option:
         cmd = ['--target', locs['pip_lib']]
@@ -451,6 +780,8 @@ class Installer:
       cmd += ['--ignore-installed']
     if self.upgrade:
       cmd += ['--upgrade']
+    if self.offline:
+      cmd += ['--no-index']
     if self.verbose:
       cmd.append('--verbose')
 
@@ -462,7 +793,7 @@ class Installer:
         return False
 
       # Important to use this function from within the updated pythonpath context.
-      for dep_name in deps:
+      for dep_name in dep_names:
         self.installed_python_libs[dep_name] = env.get_module_dist_info(dep_name)
 
     return True
@@ -508,13 +839,9 @@ class Installer:
       req = manifest.Requirement.from_line(req)
     req.inherit_values()
 
-    registry = None
-    if req.registry:
-      registry = RegistryClient(req.registry, req.registry)
-
     if req.selector:
       return self.install_from_registry(req.name, req.selector, dev=dev,
-        registry=registry, internal=req.internal, pure=req.pure)
+        regs=req.registry, internal=req.internal, pure=req.pure)
     if req.git_url:
       return self.install_from_git(req.git_url, req.recursive, internal=req.internal, pure=req.pure)
     if req.path:
@@ -540,7 +867,7 @@ class Installer:
 
   @decorators.finally_()
   def install_from_directory(self, directory, develop=False, dev=False,
-      expect=None, movedir=False, internal=False, pure=None):
+      expect=None, movedir=False, internal=False, pure=None, upgrade=None):
     """
     Installs a package from a directory. The directory must have a
     `nodepy.json` file. If *expect* is specified, it must be a tuple of
@@ -556,16 +883,20 @@ class Installer:
     expect (None, (str, semver.Version)): If specified, a tuple of the
       name and version of the package that we expect to install from this
       directory.
-    movedir (bool): This is set by #install_from_git() to move the source
-      directory to the target install directory isntead of a normal
-      install.
+    movedir (bool): This is set by #install_from_git() and
+      #install_from_registry() to move the source directory to the target
+      install directory isntead of a normal install.
     internal (bool): Install as an internal dependency.
     pure (bool): Don't install command-line scripts (`"bin"` section).
+    upgrade (bool): Replace an existing installation of the package.
+      Defaults to #upgrade.
 
     # Returns
     (success, manifest)
     """
 
+    if upgrade is None:
+      upgrade = self.upgrade
     filename = os.path.normpath(os.path.abspath(os.path.join(directory, PACKAGE_MANIFEST)))
 
     try:
@@ -581,7 +912,7 @@ class Installer:
 
     if expect is not None and (
         manifest['name'] != expect[0] or
-        (expect[1] and manifest['version'] != expect[1])):
+        (expect[1] and semver.Version(manifest['version']) != expect[1])):
       print('Error: Expected to install "{}@{}" but got "{}" in "{}"'
           .format(expect[0], expect[1], manifest.identifier, directory))
       return False, manifest
@@ -600,6 +931,7 @@ class Installer:
     else:
       print('Installing "{}"...'.format(manifest.identifier))
       target_dir = os.path.join(self.dirs['packages'], manifest['name'])
+    package_path = target_dir
 
     # Push onto the stack of currently installing packages
     self.currently_installing.append((manifest, directory if develop else target_dir))
@@ -612,14 +944,19 @@ class Installer:
 
     # Error if the target directory already exists. The package must be
     # uninstalled before it can be installed again.
-    if os.path.exists(target_dir):
-      if not self.upgrade:
-        print('  Note: install directory "{}" already exists, specify --upgrade'.format(target_dir))
+    target_archive = target_dir + env.ZIPPED_PACKAGE_SUFFIX
+    for existing in (target_dir, target_archive):
+      if not os.path.exists(existing):
+        continue
+      if not upgrade:
+        print('  Note: install directory "{}" already exists, specify --upgrade'.format(existing))
         return True, manifest
-      if not self.uninstall_directory(target_dir):
+      if not self.uninstall_directory(existing):
         return False, manifest
 
     installed_files = []
+    installed_scripts = []
+    record = ('directory', [os.path.join(target_dir, PACKAGE_MANIFEST)])
 
     # The movedir option is used for installing from Git repositories.
     # We should move the Git directory to the target directory immediately
@@ -629,7 +966,8 @@ class Installer:
       print('Moving "{}" to "{}" ...'.format(manifest.identifier, target_dir))
       _makedirs(os.path.dirname(target_dir))
       shutil.move(directory, target_dir)
-      installed_files.append(target_dir)
+      for root, __, names in os.walk(target_dir):
+        installed_files += [os.path.join(root, x) for x in names]
       directory = target_dir
 
     plc = PackageLifecycle(self.context, manifest=manifest)
@@ -664,14 +1002,28 @@ class Installer:
           fp.write(target)
 
         installed_files.append(linkfn)
+        record = ('link', [linkfn, os.path.join(os.path.abspath(directory), PACKAGE_MANIFEST)])
+      elif self.zip_install and not os.path.exists(target_dir):
+        _makedirs(os.path.dirname(target_archive))
+        count = write_package_archive(manifest, target_archive)
+        print('  Wrote {} file(s) to "{}"'.format(count, os.path.basename(target_archive)))
+        installed_files.append(target_archive)
+        target_dir = target_archive
+        record = ('archive', [target_archive])
       else:
+        if self.zip_install:
+          print('  Note: "{}" has dependencies installed into its directory, '
+            'not installing as ZIP archive'.format(target_dir))
         _makedirs(target_dir)
+        placer = self._get_file_placer(directory)
         for src, rel in walk_package_files(manifest):
           dst = os.path.join(target_dir, rel)
           _makedirs(os.path.dirname(dst))
-          print('  Copying', rel, '...')
-          shutil.copyfile(src, dst)
+          method = placer.place(src, dst)
+          if self.verbose:
+            print('  {} {}'.format(method, rel))
           installed_files.append(dst)
+        print('  Installed {} file(s) ({})'.format(sum(placer.counts.values()), placer.summary()))
 
     if not pure:
       # Create scripts for the 'bin' field in the package manifest.
@@ -680,14 +1032,9 @@ class Installer:
         for script_name in script_names:
           print('  Installing script "{}" to "{}"...'.format(script_name, self.script.directory))
           filename = os.path.abspath(os.path.join(target_dir, filename))
-          installed_files += self.script.make_nodepy(
-              script_name, filename)
-
-    # Write down the names of the installed files.
-    #with open(os.path.join(target_dir, env.INSTALLED_FILES), 'w') as fp:
-    #  for fn in installed_files:
-    #    fp.write(fn)
-    #    fp.write('\n')
+          filenames = self.script.make_nodepy(script_name, filename)
+          installed_files += filenames
+          installed_scripts += [(script_name, x) for x in filenames]
 
     try:
       plc.run('post-install', [], script_only=True, directory=target_dir, globals={'installer': self})
@@ -696,6 +1043,12 @@ class Installer:
       print('Error: post-install script failed.')
       return False, manifest
 
+    # Record the package with its files in the installed package database.
+    installed_manifest = _manifest.Manifest(target_dir if record[0] == 'archive'
+      else package_path, manifest)
+    self.db.add(package_path, record[0], installed_manifest, record[1],
+      installed_files, installed_scripts)
+
     if delayed_deps:
       print('Installing delayed dependencies for "{}"{}...'.format(
           manifest.identifier, ' (dev) ' if dev else ''))
@@ -703,7 +1056,7 @@ class Installer:
 
     return True, manifest
 
-  def install_from_archive(self, archive, dev=False, expect=None, pure=None):
+  def install_from_archive(self, archive, dev=False, expect=None, internal=False, pure=None):
     """
     Install a package from an archive.
     """
@@ -713,20 +1066,449 @@ class Installer:
     try:
       with tarfile.open(archive) as tar:
         tar.extractall(directory)
-      return self.install_from_directory(directory, dev=dev, expect=expect, pure=pure)
+      return self.install_from_directory(directory, dev=dev, expect=expect,
+        internal=internal, pure=pure)
     finally:
       _rmtree(directory)
 
+  def _get_registries(self, regs):
+    if self.offline:
+      return self.reg
+    if isinstance(regs, six.string_types):
+      if regs not in self._url_registries:
+        self._url_registries[regs] = _registry.RegistryClient(regs, regs)
+      return [self._url_registries[regs]]
+    elif isinstance(regs, _registry.RegistryClient):
+      return [regs]
+    elif regs is None:
+      return self.reg
+    return regs
+
+  @staticmethod
+  def _registry_key(regs):
+    if regs is None or isinstance(regs, six.string_types):
+      return regs
+    if isinstance(regs, _registry.RegistryClient):
+      regs = [regs]
+    return tuple(x.base_url for x in regs)
+
+  def _get_pool(self):
+    if self._pool is None:
+      self._pool = ThreadPool(self.jobs)
+    return self._pool
+
+  def _map(self, func, iterable):
+    if self.jobs < 2:
+      return list(map(func, iterable))
+    return self._get_pool().map(func, iterable)
+
+  def _is_installed(self, package_name):
+    dirname = os.path.join(self.dirs['packages'], package_name)
+    return os.path.exists(dirname) or os.path.exists(dirname + env.LINK_SUFFIX) \
+        or os.path.exists(dirname + env.ZIPPED_PACKAGE_SUFFIX)
+
+  def _preferred_version(self, package_name):
+    if self.lock and package_name in self.lock.packages:
+      return self.lock.packages[package_name].version
+    if self.upgrade:
+      return None
+    return self._installed_version(package_name)
+
+  def _fixed_package(self, package_name):
+    """
+    Returns the manifest of the installed package *package_name* if the
+    #_solver.Solver must keep its version, that is unless #upgrade is set,
+    the package is in the #lock or it is a link.
+    """
+
+    if self.upgrade or (self.lock and package_name in self.lock.packages):
+      return None
+    try:
+      package = self.find_package(package_name)
+    except PackageNotFound:
+      return None
+    if isinstance(package, InvalidPackage) or package.get('__is_link'):
+      return None
+    return package
+
+  def _installed_version(self, package_name):
+    try:
+      package = self.find_package(package_name)
+    except PackageNotFound:
+      return None
+    if isinstance(package, InvalidPackage):
+      return None
+    return semver.Version(package['version'])
+
+  def _archive_request(self, registry, info):
+    """
+    Returns a tuple of a function that sends the request for the archive of
+    the package *info* (a #_registry.PackageInfo or #_lockfile.LockedPackage)
+    and the name of the registry. The function accepts a dictionary of
+    additional headers and returns a streamed #requests.Response, as used
+    by #_download.ResponseReader.
+    """
+
+    if self.offline:
+      raise RuntimeError('"{}" is not in the package cache (offline)'.format(info.identifier))
+    if isinstance(info, _lockfile.LockedPackage):
+      request = lambda headers: requests.get(info.url, headers=headers, stream=True, timeout=30)
+      return request, info.registry
+    request = lambda headers: registry.download(info.name, info.version, headers=headers)
+    return request, registry.name
+
+  def _record_archive(self, info, registry_name, url, sha256):
+    """
+    Records the URL and SHA256 digest of the archive of the package *info*
+    for the lockfile. Raises an #_lockfile.IntegrityError if the digest does
+    not match the lockfile.
+    """
+
+    if isinstance(info, _lockfile.LockedPackage):
+      info.check(sha256)
+    self._archives[(info.name, str(info.version))] = (registry_name, url, sha256)
+
+  def _download(self, registry, info, fp, progress=False):
+    """
+    Downloads the archive of the package *info* into the file-like object
+    *fp*, records it with #_record_archive() and returns the number of bytes.
+    """
+
+    request, registry_name = self._archive_request(registry, info)
+    reader = _download.download(request, fp, progress=progress)
+    fp.seek(0)
+    self._record_archive(info, registry_name, reader.url, reader.sha256())
+    return reader.size
+
+  def _stream_unpack(self, registry, info, progress=False):
+    """
+    Extracts the archive of the package *info* into a staging directory
+    while it is being downloaded, without writing the archive to disk
+    first. Files that are not included in the package are skipped as they
+    arrive if the manifest is known up front (see #_registry.PackageInfo),
+    otherwise they are removed once the `nodepy.json` has been extracted.
+
+    The staging directory is created next to the packages directory so that
+    #install_from_directory() can rename it into place. Returns a tuple of
+    (directory, size).
+    """
+
+    request, registry_name = self._archive_request(registry, info)
+    parent = self.dirs['packages']
+    _makedirs(parent)
+    directory = tempfile.mkdtemp(prefix='.{}-{}.'.format(
+      info.name.replace('/', '+'), info.version), suffix='.staging', dir=parent)
+    try:
+      manifest = getattr(info, 'manifest', None)
+      if manifest is not None:
+        include, exclude = package_file_patterns(manifest, gitignore=False)
+      reader = _download.ResponseReader(request, progress)
+      with contextlib.closing(reader):
+        with tarfile.open(fileobj=reader, mode='r|*') as tar:
+          for rel, member in _cache.archive_files(tar):
+            if manifest is not None and rel != PACKAGE_MANIFEST and \
+                not _check_include_file(rel, include, exclude):
+              continue
+            _cache.extract_file(tar, member, os.path.join(directory, rel))
+        reader.finish()
+      self._record_archive(info, registry_name, reader.url, reader.sha256())
+
+      if manifest is None:
+        filename = os.path.join(directory, PACKAGE_MANIFEST)
+        if os.path.isfile(filename):
+          keep = set(x[1] for x in walk_package_files(self._load_manifest(filename)))
+          for root, __, files in os.walk(directory):
+            for name in files:
+              path = os.path.join(root, name)
+              if os.path.relpath(path, directory) not in keep:
+                os.remove(path)
+    except:
+      _rmtree(directory, ignore_errors=True)
+      raise
+    return directory, reader.size
+
+  def _from_cache(self, info):
+    """
+    Returns the directory of the package *info* in the #cache, or #None.
+    """
+
+    if self.cache is None:
+      return None
+    ident = (info.name, str(info.version))
+    if isinstance(info, _lockfile.LockedPackage) and info.sha256:
+      entry = {'sha256': info.sha256, 'url': info.url, 'registry': info.registry}
+    else:
+      entry = self.cache.lookup(info.name, info.version)
+      if entry is None:
+        return None
+    directory = self.cache.tree(entry['sha256'])
+    if directory is not None:
+      self._archives[ident] = (entry['registry'], entry['url'], entry['sha256'])
+    return directory
+
+  def _download_and_unpack(self, registry, info, progress=False):
+    """
+    Downloads the archive of a package and unpacks it while it arrives,
+    into the #cache (see #_cache.PackageCache.add_stream()) or into a
+    staging directory (see #_stream_unpack()). Runs in a worker thread and
+    returns a tuple of (info, directory, size, error). The size is #None if
+    the package was taken from the cache.
+    """
+
+    try:
+      directory = self._from_cache(info)
+      if directory is not None:
+        return info, directory, None, None
+      if self.cache is None:
+        directory, size = self._stream_unpack(registry, info, progress)
+      else:
+        request, registry_name = self._archive_request(registry, info)
+        reader = _download.ResponseReader(request, progress)
+        with contextlib.closing(reader):
+          directory, sha256 = self.cache.add_stream(reader,
+            lambda sha256: self._record_archive(info, registry_name, reader.url, sha256))
+        self.cache.record(info.name, info.version, sha256, reader.url, registry_name)
+        size = reader.size
+      return info, directory, size, None
+    except Exception as exc:
+      return info, None, 0, exc
+
+  def _get_solver(self):
+    if self._solver is None:
+      self._solver = _solver.Solver(lambda req: self._get_registries(req.registry),
+        preferred=self._preferred_version, fixed=self._fixed_package, map=self._map)
+    return self._solver
+
+  def solve(self, deps, parent=None):
+    """
+    Chooses the versions of the registry dependencies in *deps* (a
+    dictionary that maps package names to #manifest.Requirement objects or
+    requirement strings) and of their dependencies with the
+    #_solver.Solver. #install_from_registry() installs the chosen versions.
+    Installed packages that are not in *deps* keep their version unless
+    #upgrade is set, a conflict with them fails the solve. Requirements
+    that have been solved before or that are satisfied by the #lock are
+    skipped.
+
+    Returns a list of the `(registry, info)` tuples of the chosen packages,
+    or #None if no set of versions satisfies all requirements.
+    """
+
+    reqs = collections.OrderedDict()
+    for name, req in _solver.Solver.registry_requirements(deps).items():
+      if self.lock and self.lock.get(name, req.selector):
+        continue
+      if (name, str(req.selector), self._registry_key(req.registry)) not in self._resolved:
+        reqs[name] = req
+    if not reqs:
+      return []
+    if self.frozen_lockfile:
+      for name, req in reqs.items():
+        print('Error: "{}@{}" is not satisfied by the lockfile'.format(name, req.selector))
+      return None
+
+    print('Resolving {} package(s) ...'.format(len(reqs)))
+    try:
+      solution = self._get_solver().solve(reqs, parent)
+    except _solver.SolveError as exc:
+      print('Error: {}'.format(exc))
+      if exc.fixed is not None:
+        print('  Specify --upgrade to replace the installed version.')
+      return None
+
+    for _, req in solution.requirements:
+      if req.name not in solution.packages:
+        continue  # Installed and fixed to its version.
+      key = (req.name, str(req.selector), self._registry_key(req.registry))
+      self._resolved[key] = (solution.registries[req.name], solution.packages[req.name])
+    return list(solution)
+
+  def prefetch(self, packages):
+    """
+    Downloads and unpacks the `(registry, info)` tuples in *packages* (as
+    returned by #solve()) with #jobs worker threads.
+
+    #install_from_registry() uses the results, thus packages are still
+    installed one after another in dependency order, but without waiting
+    for the network. Packages that could not be downloaded here are left to
+    #install_from_registry(), which reports the error. Packages that have
+    been prefetched before or that are already installed (in the same
+    version if #upgrade is set) are skipped. Does
+    nothing if #jobs is less than two.
+    """
+
+    if self.jobs < 2:
+      return
+
+    pool = self._get_pool()
+    results = []
+    for registry, info in packages:
+      ident = (info.name, str(info.version))
+      if ident in self._prefetched:
+        continue
+      if self._is_installed(info.name) and (not self.upgrade or
+          self._installed_version(info.name) == info.version):
+        continue
+      self._prefetched[ident] = None
+      results.append((info, pool.apply_async(self._download_and_unpack, (registry, info))))
+
+    if not results:
+      return
+    num_downloads = len(results)
+    print('Downloading {} package(s) with {} jobs ...'.format(num_downloads, self.jobs))
+    total_size = 0
+    for index, (info, result) in enumerate(results):
+      # get() raises the errors that the worker did not catch itself.
+      try:
+        info, directory, size, error = result.get()
+      except Exception as exc:
+        directory, size, error = None, 0, exc
+      self._prefetched[(info.name, str(info.version))] = directory
+      if error is not None:
+        print('  [{}/{}] Could not download "{}": {}'.format(
+          index + 1, num_downloads, info.identifier, error))
+      elif size is None:
+        print('  [{}/{}] "{}" (cached)'.format(index + 1, num_downloads, info.identifier))
+      else:
+        total_size += size
+        print('  [{}/{}] "{}" ({})'.format(index + 1, num_downloads,
+          info.identifier, text.human_size(size)))
+    print('  Downloaded {}'.format(text.human_size(total_size)))
+
+  def _hash_archive(self, registry, info):
+    if self._from_cache(info) is None:
+      with tempfile.TemporaryFile() as tmp:
+        self._download(registry, info, tmp)
+
+  def _locked_manifest(self, locked):
+    """
+    Returns the manifest of the #_lockfile.LockedPackage *locked* from the
+    installed package or from the #cache, or #None if it is not available
+    without asking a registry.
+    """
+
+    try:
+      mf = self.find_package(locked.name)
+    except PackageNotFound:
+      mf = None
+    if mf is not None and not isinstance(mf, InvalidPackage) and \
+        semver.Version(mf['version']) == locked.version:
+      return mf
+    directory = self.cache.tree(locked.sha256) if self.cache is not None else None
+    if directory is not None:
+      return self._load_manifest(os.path.join(directory, PACKAGE_MANIFEST))
+    return None
+
+  def _keep_locked(self, deps):
+    """
+    Walks the dependency tree of *deps* through the packages in the #lock
+    that still satisfy their requirements and whose manifest is available
+    (see #_locked_manifest()). Returns a tuple of an ordered dictionary that
+    maps the names of these packages to tuples of (locked_package, manifest)
+    and an ordered dictionary of the requirements that must be solved, or
+    #None if the lock does not fit the tree.
+    """
+
+    kept = collections.OrderedDict()
+    unsolved = collections.OrderedDict()
+    pending = [deps]
+    while pending:
+      for name, req in _solver.Solver.registry_requirements(pending.pop(0)).items():
+        if name in kept:
+          if not req.selector(kept[name][0].version):
+            return None
+          continue
+        locked = self.lock.get(name, req.selector) if self.lock else None
+        mf = self._locked_manifest(locked) if locked and locked.sha256 else None
+        if mf is None:
+          if name in unsolved and str(unsolved[name].selector) != str(req.selector):
+            return None
+          unsolved[name] = req
+          continue
+        kept[name] = (locked, mf)
+        pending.append(mf.eval_fields(env.cfgvars(False), 'dependencies', {}))
+    if any(name in kept for name in unsolved):
+      return None
+    return kept, unsolved
+
+  def create_lockfile(self, manifest, dev=False):
+    """
+    Creates a #_lockfile.Lockfile for the dependency tree of the package
+    *manifest*. Packages in the current #lock that still satisfy the tree
+    are kept (see #_keep_locked()), only the remaining requirements are
+    solved, preferring the installed versions. The whole tree is solved
+    again if the result does not fit the kept packages. Archives that have
+    not been downloaded by this installer and that are not recorded in the
+    current #lock are downloaded to compute their digest. Raises a
+    #_solver.SolveError if the tree can not be solved.
+    """
+
+    vars = env.cfgvars(dev)
+    deps = manifest.eval_fields(vars, 'dependencies', {})
+    kept = self._keep_locked(deps)
+    if kept is not None:
+      kept, unsolved = kept
+      solution = self._get_solver().solve(unsolved, manifest.identifier)
+      if any(kept[x.name][0].version != x.version for x in solution.packages.values()
+             if x.name in kept):
+        kept = None
+    if kept is None:
+      kept = collections.OrderedDict()
+      solution = self._get_solver().solve(deps, manifest.identifier)
+
+    packages = collections.OrderedDict((k, v[0]) for k, v in kept.items())
+    missing = []
+    for registry, info in solution:
+      if info.name in packages:
+        continue
+      ident = (info.name, str(info.version))
+      locked = self.lock.packages.get(info.name) if self.lock else None
+      if ident in self._archives:
+        registry_name, url, sha256 = self._archives[ident]
+        packages[info.name] = _lockfile.LockedPackage(info.name, info.version, registry_name, url, sha256)
+      elif locked is not None and locked.version == info.version and locked.sha256:
+        packages[info.name] = locked
+      else:
+        missing.append((registry, info))
+    if missing:
+      print('Computing the digests of {} package(s) ...'.format(len(missing)))
+      self._map(lambda x: self._hash_archive(*x), missing)
+      for registry, info in missing:
+        registry_name, url, sha256 = self._archives[(info.name, str(info.version))]
+        packages[info.name] = _lockfile.LockedPackage(info.name, info.version, registry_name, url, sha256)
+
+    pip = collections.OrderedDict()
+    manifests = [(manifest, vars)] + [(x[1], env.cfgvars(False)) for x in kept.values()] + \
+      [(x.manifest, env.cfgvars(False)) for x in solution.packages.values() if x.name not in kept]
+    for mf, mf_vars in manifests:
+      for name, spec in mf.eval_fields(mf_vars, 'pip_dependencies', {}).items():
+        dist_info = self.installed_python_libs.get(name)
+        if dist_info is None and name not in self.installed_python_libs:
+          dist_info = env.get_module_dist_info(name)
+        pip[name] = '==' + dist_info['version'] if dist_info else spec
+
+    return _lockfile.Lockfile(packages, pip)
+
   def install_from_registry(self, package_name, selector, dev=False, regs=None,
                             internal=False, pure=None):
     """
-    Install a package from a registry.
+    Install a package from a registry. Uses the version from the #lock if
+    it satisfies *selector*, otherwise the version chosen by #solve() or the
+    best match from the registry. Uses the results of #prefetch() if the
+    package has been prefetched. An installed version is only replaced if
+    #upgrade is set, if it differs from the #lock or if it does not
+    satisfy *selector*.
 
     # Returns
     (success, (package_name, package_version))
     """
 
-    # Check if the package already exists.
+    locked = self.lock.get(package_name, selector) if self.lock else None
+    upgrade = self.upgrade
+
+    # Check if the package already exists. A version that differs from
+    # the #lock or that does not satisfy the selector is replaced even
+    # without #upgrade.
     try:
       package = self.find_package(package_name, internal)
       if isinstance(package, InvalidPackage):
@@ -734,51 +1516,60 @@ class Installer:
     except PackageNotFound:
       pass
     else:
-      if not selector(package.version):
-        print('  Warning: Dependency "{}@{}" unsatisfied, have "{}" installed'
-            .format(package_name, selector, package.identifier))
-      if not self.upgrade:
-        print('package "{}@{}" already installed, specify --upgrade'.format(
-            package.name, package.version))
-        return True, (package.name, package.version)
-
-    if isinstance(regs, six.string_types):
-      regs = [_registry.RegistryClient(regs, regs)]
-    elif isinstance(regs, _registry.RegistryClient):
-      regs = [regs]
-    elif regs is None:
-      regs = self.reg
-
-    print('Finding package matching "{}@{}"...'.format(package_name, selector))
-    for registry in regs:
-      print('  Checking registry "{}" ({})...'.format(registry.name, registry.base_url), end=' ')
-      try:
-        info = registry.find_package(package_name, selector)
-      except _registry.PackageNotFound as exc:
-        print('NOT FOUND')
-        continue
-      else:
-        print('FOUND ({}@{})'.format(info.name, info.version))
-        break
-    else:
-      print('Error: package "{}@{}" could not be located'.format(package_name, selector))
+      version = semver.Version(package['version'])
+      upgrade = self.upgrade or not selector(version) or \
+          (locked is not None and locked.version != version)
+      if not upgrade:
+        print('package "{}" already installed, specify --upgrade'.format(
+            package.identifier))
+        return True, (package['name'], version)
+
+    key = (package_name, str(selector), self._registry_key(regs))
+    resolved = self._resolved.get(key)
+    if locked is not None:
+      registry, info = None, locked
+    elif resolved is not None:
+      registry, info = resolved
+    elif self.frozen_lockfile:
+      print('Error: "{}@{}" is not satisfied by the lockfile'.format(package_name, selector))
       return False, None
+    else:
+      print('Finding package matching "{}@{}"...'.format(package_name, selector))
+      for registry in self._get_registries(regs):
+        print('  Checking registry "{}" ({})...'.format(registry.name, registry.base_url), end=' ')
+        try:
+          info = registry.find_package(package_name, selector)
+        except _registry.PackageNotFound as exc:
+          print('NOT FOUND')
+          continue
+        else:
+          print('FOUND ({}@{})'.format(info.name, info.version))
+          break
+      else:
+        print('Error: package "{}@{}" could not be located'.format(package_name, selector))
+        return False, None
     assert info.name == package_name, info
 
-    print('Downloading "{}@{}"...'.format(info.name, info.version))
-    response = registry.download(info.name, info.version)
-    filename = _download.get_response_filename(response)
+    directory = self._prefetched.pop((info.name, str(info.version)), None)
+    if not directory:
+      directory = self._from_cache(info)
+    if directory is None:
+      print('Downloading "{}@{}"...'.format(info.name, info.version))
+      progress = _download.DownloadProgress(30, prefix='  ')
+      _, directory, _, error = self._download_and_unpack(registry, info, progress)
+      if error is not None:
+        print('Error: could not download "{}": {}'.format(info.identifier, error))
+        return False, None
 
-    tmp = None
+    # Staging directories are renamed into place instead of copying files.
+    movedir = not self.zip_install and not (
+      self.cache is not None and self.cache.contains(directory))
     try:
-      with tempfile.NamedTemporaryFile(suffix='_' + filename, delete=False) as tmp:
-        progress = _download.DownloadProgress(30, prefix='  ')
-        _download.download_to_fileobj(response, tmp, progress=progress)
-      success = self.install_from_archive(tmp.name, dev=dev, pure=pure,
-        expect=(package_name, info.version), internal=internal)
+      success = self.install_from_directory(directory, dev=dev, pure=pure,
+        expect=(package_name, info.version), internal=internal, movedir=movedir,
+        upgrade=upgrade)[0]
     finally:
-      if tmp and os.path.isfile(tmp.name):
-        os.remove(tmp.name)
+      self._release(directory)
 
     return success, (package_name, info.version)
 
@@ -822,6 +1613,35 @@ class InstallError(Exception):
   pass
 
 
+def merge_pip_requirements(lines):
+  """
+  Merges the Pip requirement strings in *lines* that refer to the same
+  distribution into one requirement with the intersection of their version
+  specifiers and the union of their extras. Requirements with a URL or an
+  environment marker are kept as they are. Returns a list of requirement
+  strings.
+  """
+
+  result = []
+  merged = collections.OrderedDict()  # name -> (name, extras, specifier)
+  for line in lines:
+    req = manifest.PipRequirement.from_line(line)
+    if req.link or not req.req or req.markers:
+      if line not in result:
+        result.append(line)
+      continue
+    key = req.req.name.lower()
+    if key in merged:
+      name, extras, specifier = merged[key]
+      merged[key] = (name, extras | set(req.req.extras), specifier & req.req.specifier)
+    else:
+      merged[key] = (req.req.name, set(req.req.extras), req.req.specifier)
+  for name, extras, specifier in merged.values():
+    extras = '[{}]'.format(','.join(sorted(extras))) if extras else ''
+    result.append('{}{}{}'.format(name, extras, ','.join(sorted(str(x) for x in specifier))))
+  return result
+
+
 @contextlib.contextmanager
 def later(__func, *args, **kwargs):
   try:
@@ -0,0 +1,480 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import {Installer, PackageNotFound, merge_pip_requirements} from './install'
+import {PackageCache} from './cache'
+import {InstalledDatabase} from './installdb'
+import {Lockfile, LockedPackage} from './lockfile'
+import manifest from './manifest'
+import semver from './semver'
+import _registry from './registry'
+
+
+class FakeResponse(object):
+
+  status_code = 200
+
+  def __init__(self, url, data):
+    self.url = url
+    self.headers = {'Content-Length': str(len(data))}
+    self.data = data
+
+  def raise_for_status(self):
+    pass
+
+  def iter_content(self, chunk_size):
+    for i in range(0, len(self.data), chunk_size):
+      yield self.data[i:i+chunk_size]
+
+  def close(self):
+    pass
+
+
+class FakeRegistry(object):
+  """
+  A registry that serves packages from memory and counts the requests.
+  """
+
+  name = 'fake'
+  base_url = 'fake://'
+
+  def __init__(self, packages, files=None):
+    self.packages = packages
+    self.files = files or {}
+    self.lock = threading.Lock()
+    self.finds = []
+    self.downloads = []
+
+  def versions(self, package_name):
+    if package_name not in self.packages:
+      raise _registry.PackageNotFound(package_name, semver.Selector('*'))
+    return [semver.Version(x) for x in self.packages[package_name]]
+
+  def find_package(self, package_name, selector):
+    with self.lock:
+      self.finds.append(package_name)
+    versions = self.packages.get(package_name, {})
+    version = selector.best_of([semver.Version(x) for x in versions])
+    if version is None:
+      raise _registry.PackageNotFound(package_name, selector)
+    data = dict(versions[str(version)], name=package_name, version=str(version))
+    return _registry.PackageInfo(package_name, version, manifest.Manifest(None, data))
+
+  def download(self, package_name, version, headers=None):
+    with self.lock:
+      self.downloads.append(package_name)
+    fp = io.BytesIO()
+    with tarfile.open(fileobj=fp, mode='w:gz') as tar:
+      data = json.dumps(dict(self.packages[package_name][str(version)],
+        name=package_name, version=str(version))).encode('utf8')
+      info = tarfile.TarInfo('nodepy.json')
+      info.size = len(data)
+      tar.addfile(info, io.BytesIO(data))
+      for name, data in self.files.get(package_name, {}).items():
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return FakeResponse('fake://' + package_name + '.tar.gz', fp.getvalue())
+
+
+packages = {
+  'a': {'1.0.0': {'dependencies': {'b': '~1.0.0', 'c': '~1.0.0'}}},
+  'b': {'1.0.0': {}, '1.0.3': {'dependencies': {'c': '~1.0.0'}}},
+  'c': {'1.0.1': {}},
+}
+
+
+def make_installer(registry, jobs, **kwargs):
+  installer = Installer(registry=registry, jobs=jobs, **kwargs)
+  directory = tempfile.mkdtemp(suffix='_nodepy')
+  installer.dirs['packages'] = os.path.join(directory, 'modules')
+  installer.db = InstalledDatabase(os.path.join(directory, 'installed.db'))
+  os.mkdir(installer.dirs['packages'])
+  return installer
+
+
+def test_prefetch():
+  registry = FakeRegistry(packages)
+  installer = make_installer(registry, 4)
+  try:
+    installer.prefetch(installer.solve({'a': '~1.0.0'}))
+    assert_equals(sorted(installer._prefetched), [('a', '1.0.0'), ('b', '1.0.3'), ('c', '1.0.1')])
+    assert_equals(sorted(registry.downloads), ['a', 'b', 'c'])
+    # Every package version is looked up only once.
+    assert_equals(sorted(registry.finds), ['a', 'b', 'c'])
+    directories = list(installer._prefetched.values())
+    for directory in directories:
+      assert os.path.isfile(os.path.join(directory, 'nodepy.json'))
+    # Solving the same requirements again is a no-op.
+    assert_equals(installer.solve({'a': '~1.0.0'}), [])
+    assert_equals(len(registry.downloads), 3)
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+  assert not any(os.path.exists(x) for x in directories)
+  assert_equals(installer._prefetched, {})
+
+
+def test_prefetch_skips_installed():
+  registry = FakeRegistry(packages)
+  installer = make_installer(registry, 2)
+  try:
+    os.mkdir(os.path.join(installer.dirs['packages'], 'c'))
+    with open(os.path.join(installer.dirs['packages'], 'c', 'nodepy.json'), 'w') as fp:
+      json.dump({'name': 'c', 'version': '1.0.1'}, fp)
+    installer.prefetch(installer.solve({'a': '~1.0.0'}))
+    assert_equals(sorted(installer._prefetched), [('a', '1.0.0'), ('b', '1.0.3')])
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+
+
+def test_prefetch_disabled():
+  registry = FakeRegistry(packages)
+  installer = make_installer(registry, 1)
+  try:
+    installer.prefetch(installer.solve({'a': '~1.0.0'}))
+    assert_equals(registry.downloads, [])
+    assert_equals(installer._prefetched, {})
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+
+
+def test_prefetch_cache_error():
+  class BrokenCache(PackageCache):
+    def lookup(self, name, version):
+      raise OSError('broken cache')
+  cache = BrokenCache(tempfile.mkdtemp(suffix='_cache'))
+  registry = FakeRegistry(packages)
+  installer = make_installer(registry, 2, cache=cache)
+  try:
+    # The error is reported instead of leaving the installer waiting.
+    installer.prefetch([(registry, registry.find_package('c', semver.Selector('1.0.1')))])
+    assert_equals(installer._prefetched, {('c', '1.0.1'): None})
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+    shutil.rmtree(cache.directory)
+
+
+def test_prefetch_worker_error():
+  registry = FakeRegistry(packages)
+  installer = make_installer(registry, 2)
+  def fail(registry, info):
+    raise RuntimeError('worker failed')
+  installer._download_and_unpack = fail
+  try:
+    installer.prefetch(installer.solve({'a': '~1.0.0'}))
+    assert_equals(installer._prefetched,
+      {('a', '1.0.0'): None, ('b', '1.0.3'): None, ('c', '1.0.1'): None})
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+
+
+def test_solve_conflict():
+  registry = FakeRegistry(packages)
+  installer = make_installer(registry, 1)
+  try:
+    assert_equals(installer.solve({'a': '~1.0.0', 'c': '>=2.0.0'}), None)
+    assert_equals(installer.solve({'d': '~1.0.0'}), None)
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+
+
+def test_solve_installed_conflict():
+  registry = FakeRegistry(dict(packages,
+    c={'1.0.1': {}, '2.0.0': {}},
+    x={'1.0.0': {'dependencies': {'c': '~2.0.0'}}}))
+  installer = make_installer(registry, 1)
+  try:
+    os.mkdir(os.path.join(installer.dirs['packages'], 'c'))
+    with open(os.path.join(installer.dirs['packages'], 'c', 'nodepy.json'), 'w') as fp:
+      json.dump({'name': 'c', 'version': '1.0.1'}, fp)
+    # The installed version is kept and is not part of the solution.
+    assert_equals(sorted(str(info.identifier) for _, info in installer.solve({'a': '~1.0.0'})),
+      ['a@1.0.0', 'b@1.0.3'])
+    # It conflicts with the requirement of the new package.
+    assert_equals(installer.solve({'x': '~1.0.0'}), None)
+    installer.upgrade = True
+    assert_equals(sorted(str(info.identifier) for _, info in installer.solve({'x': '~1.0.0'})),
+      ['c@2.0.0', 'x@1.0.0'])
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+
+
+def test_lockfile():
+  registry = FakeRegistry(packages)
+  installer = make_installer(registry, 2)
+  root = manifest.Manifest(None, {'name': 'root', 'version': '1.0.0',
+    'dependencies': {'a': '~1.0.0'}, 'pip_dependencies': {'nodepy-missing-dist': '>=1.0'}})
+  try:
+    installer.prefetch(installer.solve({'a': '~1.0.0'}))
+    lock = installer.create_lockfile(root)
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+  assert_equals(sorted(lock.packages), ['a', 'b', 'c'])
+  assert_equals(str(lock.packages['b'].version), '1.0.3')
+  assert_equals(lock.packages['b'].url, 'fake://b.tar.gz')
+  assert_equals(len(lock.packages['b'].sha256), 64)
+  assert_equals(dict(lock.pip), {'nodepy-missing-dist': '>=1.0'})
+  # The digests of the prefetched archives are reused.
+  assert_equals(sorted(registry.downloads), ['a', 'b', 'c'])
+
+  # Requirements that the lockfile satisfies need no registry requests.
+  registry = FakeRegistry(packages)
+  installer = make_installer(registry, 2)
+  installer.lock = lock
+  installer.frozen_lockfile = True
+  try:
+    assert_equals(installer.solve({'a': '~1.0.0', 'b': '>=1.0.0'}), [])
+    assert_equals(installer.solve({'b': '<1.0.3'}), None)
+    assert_equals(registry.finds, [])
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+
+
+def test_update_lockfile():
+  cache = PackageCache(tempfile.mkdtemp(suffix='_cache'))
+  registry = FakeRegistry(dict(packages, d={'1.0.0': {}}))
+  installer = make_installer(registry, 1, cache=cache)
+  root = manifest.Manifest(None, {'name': 'root', 'version': '1.0.0',
+    'dependencies': {'a': '~1.0.0'}})
+  try:
+    installer.upgrade = True
+    assert installer.install_from_registry('a', semver.Selector('~1.0.0'))[0]
+    installer.lock = installer.create_lockfile(root)
+
+    # An unchanged tree is locked from the installed packages.
+    installer._solver = None
+    del registry.finds[:]
+    assert_equals(installer.create_lockfile(root), installer.lock)
+    assert_equals(registry.finds, [])
+
+    # Only the new requirement is solved.
+    root['dependencies']['d'] = '*'
+    lock = installer.create_lockfile(root)
+    assert_equals(sorted(lock.packages), ['a', 'b', 'c', 'd'])
+    assert_equals(registry.finds, ['d'])
+
+    # Packages that no longer satisfy the tree are solved again.
+    root['dependencies']['b'] = '<1.0.3'
+    lock = installer.create_lockfile(root)
+    assert_equals(str(lock.packages['b'].version), '1.0.0')
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+    shutil.rmtree(cache.directory)
+
+
+def test_package_cache():
+  cache = PackageCache(tempfile.mkdtemp(suffix='_cache'))
+  try:
+    registry = FakeRegistry(packages)
+    installer = make_installer(registry, 2, cache=cache)
+    try:
+      installer.prefetch(installer.solve({'a': '~1.0.0'}))
+      directories = list(installer._prefetched.values())
+    finally:
+      installer.close()
+      shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+    # The trees in the cache are not removed.
+    assert all(cache.contains(x) and os.path.isdir(x) for x in directories)
+    assert_equals(sorted(registry.downloads), ['a', 'b', 'c'])
+
+    # Another installer does not download the packages again.
+    registry = FakeRegistry(packages)
+    installer = make_installer(registry, 2, cache=cache)
+    try:
+      installer.prefetch(installer.solve({'a': '~1.0.0'}))
+      assert_equals(sorted(installer._prefetched.values()), sorted(directories))
+      assert_equals(registry.downloads, [])
+    finally:
+      installer.close()
+      shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+
+    # Offline installs take the packages from the cache.
+    installer = make_installer(None, 1, cache=cache, offline=True)
+    try:
+      assert_equals(sorted(str(info.identifier) for _, info in installer.solve({'a': '~1.0.0'})),
+        ['a@1.0.0', 'b@1.0.3', 'c@1.0.1'])
+      assert_equals(installer.solve({'b': '~1.1.0'}), None)
+    finally:
+      installer.close()
+      shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+  finally:
+    shutil.rmtree(cache.directory)
+
+
+def test_install_from_cache():
+  cache = PackageCache(tempfile.mkdtemp(suffix='_cache'))
+  registry = FakeRegistry(packages)
+  installer = make_installer(registry, 1, cache=cache)
+  try:
+    assert installer.install_from_registry('c', semver.Selector('~1.0.0'))[0]
+    installed = os.path.join(installer.dirs['packages'], 'c', 'nodepy.json')
+    sha256 = cache.lookup('c', '1.0.1')['sha256']
+    cached = os.path.join(cache.tree(sha256), 'nodepy.json')
+    # The archive was written to the cache while it was unpacked.
+    assert os.path.isfile(os.path.join(cache.directory, 'archives', sha256 + '.tar.gz'))
+    if hasattr(os, 'link'):
+      assert os.path.samefile(installed, cached)
+    with open(installed) as fp:
+      assert_equals(json.load(fp)['version'], '1.0.1')
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+    shutil.rmtree(cache.directory)
+
+  installer = make_installer(FakeRegistry(packages), 1, link_mode='copy')
+  try:
+    assert installer.install_from_registry('c', semver.Selector('~1.0.0'))[0]
+    assert_equals(installer._get_file_placer(installer.dirs['packages']).disabled,
+      set(['hardlink', 'reflink', 'copy_file_range']))
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+
+
+def test_install_streamed():
+  files = {'d': {'index.py': b'x = 1\n', 'index.pyc': b'', 'lib/util.py': b'y = 2\n',
+    '../evil.py': b''}}
+  registry = FakeRegistry({'d': {'1.0.0': {'exclude': ['*.pyc']}}}, files)
+  installer = make_installer(registry, 1)
+  try:
+    assert installer.install_from_registry('d', semver.Selector('~1.0.0'))[0]
+    directory = os.path.join(installer.dirs['packages'], 'd')
+    found = set()
+    for root, __, names in os.walk(directory):
+      found.update(os.path.relpath(os.path.join(root, x), directory) for x in names)
+    assert_equals(found, set(['nodepy.json', 'index.py', os.path.join('lib', 'util.py')]))
+    # The staging directory was renamed into place.
+    assert_equals(os.listdir(installer.dirs['packages']), ['d'])
+    assert_equals(installer._archives[('d', '1.0.0')][0], 'fake')
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+
+
+def test_installed_database():
+  registry = FakeRegistry(packages)
+  installer = make_installer(registry, 1)
+  try:
+    installer.upgrade = True
+    assert installer.install_from_registry('a', semver.Selector('~1.0.0'))[0]
+    db = installer.db
+    assert_equals([(x.name, x.version, x.kind) for x in db.packages()],
+      [('a', '1.0.0', 'directory'), ('b', '1.0.3', 'directory'), ('c', '1.0.1', 'directory')])
+    assert_equals(sorted(x.name for x in db.dependents('c')), ['a', 'b'])
+    path = os.path.join(installer.dirs['packages'], 'c')
+    assert_in(os.path.join(path, 'nodepy.json'), db.files(path))
+    assert_equals(db.scripts(path), [])
+
+    # Satisfied dependencies are found in the database.
+    del registry.downloads[:]
+    assert installer.install_dependencies({'c': '~1.0.0'}, '.')
+    assert_equals(registry.downloads, [])
+    assert_equals(installer.find_package('c')['version'], '1.0.1')
+
+    # Changes to the manifest invalidate the record.
+    filename = os.path.join(path, 'nodepy.json')
+    with open(filename, 'w') as fp:
+      json.dump({'name': 'c', 'version': '1.0.20'}, fp)
+    os.utime(filename, (0, 0))
+    assert_equals(installer.find_package('c')['version'], '1.0.20')
+    assert_equals(db.get(path).version, '1.0.20')
+    assert not db.get(path).complete
+
+    assert installer.uninstall('b')
+    assert_equals(db.get(os.path.join(installer.dirs['packages'], 'b')), None)
+    shutil.rmtree(path)
+    assert_raises(PackageNotFound, installer.find_package, 'c')
+    assert_equals([x.name for x in db.packages()], ['a'])
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+
+
+def test_install_locked_version():
+  cache = PackageCache(tempfile.mkdtemp(suffix='_cache'))
+  registry = FakeRegistry({'c': {'1.0.0': {}, '1.0.1': {}}})
+  installer = make_installer(registry, 1, cache=cache)
+  try:
+    assert installer.install_from_registry('c', semver.Selector('1.0.1'))[0]
+    sha256 = cache.lookup('c', '1.0.1')['sha256']
+    shutil.rmtree(os.path.join(installer.dirs['packages'], 'c'))
+    assert installer.install_from_registry('c', semver.Selector('1.0.0'))[0]
+    assert_equals(installer.find_package('c')['version'], '1.0.0')
+
+    # The locked version replaces the installed one without --upgrade.
+    installer.lock = Lockfile({'c': LockedPackage('c', semver.Version('1.0.1'),
+      'fake', 'fake://c.tar.gz', sha256)})
+    del registry.downloads[:]
+    assert installer.install_dependencies({'c': '~1.0.0'}, '.')
+    assert_equals(installer.find_package('c')['version'], '1.0.1')
+    assert_equals(registry.downloads, [])
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
+    shutil.rmtree(cache.directory)
+
+
+def test_merge_pip_requirements():
+  assert_equals(merge_pip_requirements(['requests>=2.0', 'six', 'Requests[security]<3', 'six>=1.10']),
+    ['requests[security]<3,>=2.0', 'six>=1.10'])
+  assert_equals(merge_pip_requirements(['six; python_version < "3"', 'six>=1.0']),
+    ['six; python_version < "3"', 'six>=1.0'])
+
+
+def test_batch_pip():
+  installer = make_installer(FakeRegistry(packages), 1)
+  calls = []
+  installer._run_pip = lambda locs, modules, args, names: calls.append((modules, names)) or True
+  installer.batch_pip = True
+  try:
+    for name, deps in [('x', {'requests': '>=2.0'}), ('y', {'requests': '<3', 'six': ''})]:
+      installer.currently_installing.append((manifest.Manifest(None, {'name': name, 'version': '1.0.0'}), None))
+      assert installer.install_python_dependencies(deps)
+      installer.currently_installing.pop()
+    assert_equals(calls, [])
+    assert installer.flush_python_dependencies()
+    assert_equals(len(calls), 1)
+    assert_equals(calls[0][0], ['requests<3,>=2.0', 'six'])
+    assert_equals(calls[0][1], ['requests', 'six'])
+    assert installer.flush_python_dependencies()
+    assert_equals(len(calls), 1)
+  finally:
+    installer.close()
+    shutil.rmtree(os.path.dirname(installer.dirs['packages']))
@@ -0,0 +1,325 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+A SQLite database of the packages that are installed into a Node.py
+packages directory (`.nodepy/installed.db` for local installs). It records
+the manifest, the installed files and scripts and the dependencies of
+every package, and is updated in one transaction per install and
+uninstall. Finding out whether a package is installed, and in which
+version, does then not require to read and validate its manifest.
+
+A record is only used while the files that it was created from (the
+manifest, and the link file or archive) have the same modification time
+and size. Packages that were installed before the database existed are
+recorded when they are found (without the list of files and scripts).
+"""
+
+import collections
+import contextlib
+import os
+import six
+import sqlite3
+import threading
+import time
+
+import json from './util/json'
+
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+  CREATE TABLE IF NOT EXISTS packages (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    manifest TEXT NOT NULL,
+    stamps TEXT NOT NULL,
+    complete INTEGER NOT NULL,
+    installed_at REAL NOT NULL
+  );
+  CREATE INDEX IF NOT EXISTS packages_name ON packages (name);
+  CREATE TABLE IF NOT EXISTS files (
+    path TEXT NOT NULL,
+    filename TEXT NOT NULL
+  );
+  CREATE INDEX IF NOT EXISTS files_path ON files (path);
+  CREATE TABLE IF NOT EXISTS scripts (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    filename TEXT NOT NULL
+  );
+  CREATE INDEX IF NOT EXISTS scripts_path ON scripts (path);
+  CREATE TABLE IF NOT EXISTS dependencies (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    requirement TEXT NOT NULL,
+    cfg TEXT
+  );
+  CREATE INDEX IF NOT EXISTS dependencies_path ON dependencies (path);
+  CREATE INDEX IF NOT EXISTS dependencies_name ON dependencies (name);
+'''
+
+
+class InstalledPackage(collections.namedtuple('InstalledPackage',
+    'path name version kind directory manifest stamps complete installed_at')):
+  """
+  A package in the #InstalledDatabase. The *path* is the install location
+  of the package without the link or archive suffix, *kind* is one of
+  `directory`, `link` and `archive`. The *manifest* is the decoded JSON
+  of the package manifest, and *directory* the directory that the manifest
+  is associated with. *stamps* is a list of `[filename, mtime, size]`
+  lists. *complete* is #False for packages that have been recorded when
+  they were found instead of when they were installed.
+  """
+
+  def is_fresh(self):
+    """
+    Returns #True if the files in #stamps did not change since the package
+    was recorded.
+    """
+
+    for filename, mtime, size in self.stamps:
+      try:
+        st = os.stat(filename)
+      except OSError:
+        return False
+      if st.st_mtime != mtime or st.st_size != size:
+        return False
+    return True
+
+
+class InstalledDatabase(object):
+  """
+  Represents the database in the file *filename*. The file (and its
+  directory) is only created when the first package is recorded. If the
+  database can not be opened or written, it is disabled and all lookups
+  return nothing.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.disabled = False
+    self._conn = None
+    self._lock = threading.RLock()
+
+  def __repr__(self):
+    return '<InstalledDatabase "{}">'.format(self.filename)
+
+  def _connect(self, create):
+    if self._conn is None and not self.disabled:
+      if not create and not os.path.isfile(self.filename):
+        return None
+      try:
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.isdir(dirname):
+          os.makedirs(dirname)
+        conn = sqlite3.connect(self.filename, timeout=30, check_same_thread=False)
+        conn.executescript(SCHEMA)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+          raise RuntimeError('unsupported schema version {}'.format(version))
+        conn.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+      except (OSError, sqlite3.Error, RuntimeError) as exc:
+        print('Warning: can not open "{}": {}'.format(self.filename, exc))
+        self.disabled = True
+        return None
+      self._conn = conn
+    return self._conn
+
+  def close(self):
+    with self._lock:
+      if self._conn is not None:
+        self._conn.close()
+        self._conn = None
+
+  @contextlib.contextmanager
+  def transaction(self):
+    """
+    A context manager that yields a cursor for modifying the database, or
+    #None if the database is disabled. The changes are committed when the
+    context exits without an exception, otherwise they are rolled back.
+    """
+
+    with self._lock:
+      conn = self._connect(create=True)
+      if conn is None:
+        yield None
+        return
+      try:
+        cursor = conn.cursor()
+        yield cursor
+        conn.commit()
+      except sqlite3.Error as exc:
+        conn.rollback()
+        print('Warning: can not update "{}": {}'.format(self.filename, exc))
+        self.disabled = True
+      except BaseException:
+        conn.rollback()
+        raise
+
+  def _query(self, sql, *args):
+    with self._lock:
+      conn = self._connect(create=False)
+      if conn is None:
+        return []
+      try:
+        return conn.execute(sql, args).fetchall()
+      except sqlite3.Error as exc:
+        print('Warning: can not read "{}": {}'.format(self.filename, exc))
+        self.disabled = True
+        return []
+
+  def get(self, path):
+    """
+    Returns the #InstalledPackage that is installed at *path*, or #None.
+    """
+
+    rows = self._query('SELECT * FROM packages WHERE path = ?', os.path.abspath(path))
+    return _package_from_row(rows[0]) if rows else None
+
+  def lookup(self, path):
+    """
+    Like #get(), but returns #None if the record is outdated (see
+    #InstalledPackage.is_fresh()).
+    """
+
+    package = self.get(path)
+    if package is not None and not package.is_fresh():
+      return None
+    return package
+
+  def packages(self, name=None):
+    """
+    Returns a list of all #InstalledPackage objects, or of those with the
+    specified *name*.
+    """
+
+    if name is None:
+      rows = self._query('SELECT * FROM packages ORDER BY name, path')
+    else:
+      rows = self._query('SELECT * FROM packages WHERE name = ? ORDER BY path', name)
+    return [_package_from_row(x) for x in rows]
+
+  def files(self, path):
+    """
+    Returns the list of files that were installed for the package at
+    *path*, or #None if they are not known.
+    """
+
+    package = self.get(path)
+    if package is None or not package.complete:
+      return None
+    rows = self._query('SELECT filename FROM files WHERE path = ?', package.path)
+    return [x[0] for x in rows]
+
+  def scripts(self, path):
+    """
+    Returns a list of `(script_name, filename)` tuples for the scripts that
+    were installed for the package at *path*, or #None if they are not
+    known.
+    """
+
+    package = self.get(path)
+    if package is None or not package.complete:
+      return None
+    return [tuple(x) for x in self._query(
+      'SELECT name, filename FROM scripts WHERE path = ?', package.path)]
+
+  def dependents(self, name):
+    """
+    Returns a list of the #InstalledPackage objects that depend on the
+    package *name* (in any `cfg(...)` section of their manifest).
+    """
+
+    rows = self._query('SELECT DISTINCT packages.* FROM packages JOIN dependencies '
+      'ON packages.path = dependencies.path WHERE dependencies.name = ? '
+      'ORDER BY packages.name', name)
+    return [_package_from_row(x) for x in rows]
+
+  def add(self, path, kind, manifest, stamp_files, files=None, scripts=None):
+    """
+    Records the package with the *manifest* (a #manifest.Manifest) that is
+    installed at *path*, replacing a previous record. *stamp_files* are the
+    files that are checked to determine if the record is still valid. If
+    *files* and *scripts* (a list of `(script_name, filename)` tuples) are
+    #None, the record is not #InstalledPackage.complete. Nothing is
+    recorded if one of the *stamp_files* does not exist.
+    """
+
+    path = os.path.abspath(path)
+    stamps = []
+    for filename in stamp_files:
+      try:
+        st = os.stat(filename)
+      except OSError:
+        return
+      stamps.append([os.path.abspath(filename), st.st_mtime, st.st_size])
+    data = collections.OrderedDict((k, v) for k, v in manifest.items() if k != '__is_link')
+    complete = files is not None or scripts is not None
+
+    with self.transaction() as cursor:
+      if cursor is None:
+        return
+      _delete(cursor, 'path = ?', path)
+      cursor.execute('INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+        path, manifest['name'], str(manifest.get('version', '')), kind,
+        os.path.abspath(manifest.directory), json.dumps(data, default=str),
+        json.dumps(stamps), int(complete), time.time()))
+      cursor.executemany('INSERT INTO files VALUES (?, ?)',
+        [(path, os.path.abspath(x)) for x in files or ()])
+      cursor.executemany('INSERT INTO scripts VALUES (?, ?, ?)',
+        [(path, name, os.path.abspath(x)) for name, x in scripts or ()])
+      dependencies = []
+      for cfg, deps in manifest.iter_fields('dependencies'):
+        for name, req in (deps or {}).items():
+          if isinstance(req, dict):
+            req = json.dumps(req)
+          elif not isinstance(req, six.string_types):
+            req = str(req)
+          dependencies.append((path, name, req, cfg))
+      cursor.executemany('INSERT INTO dependencies VALUES (?, ?, ?, ?)', dependencies)
+
+  def remove(self, path):
+    """
+    Removes the record of the package at *path* and of all packages that
+    are installed inside of it (internal dependencies).
+    """
+
+    path = os.path.abspath(path)
+    with self.transaction() as cursor:
+      if cursor is not None:
+        pattern = path.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        _delete(cursor, "path = ? OR path LIKE ? ESCAPE '\\'", path, pattern + os.sep + '%')
+
+
+def _package_from_row(row):
+  data = list(row)
+  data[5] = json.loads(data[5], object_pairs_hook=collections.OrderedDict)
+  data[6] = json.loads(data[6])
+  data[7] = bool(data[7])
+  return InstalledPackage(*data)
+
+
+def _delete(cursor, where, *args):
+  for table in ('files', 'scripts', 'dependencies', 'packages'):
+    cursor.execute('DELETE FROM {} WHERE {}'.format(table, where), args)
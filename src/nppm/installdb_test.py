@@ -0,0 +1,79 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+import json
+import os
+import shutil
+import tempfile
+import manifest from './manifest'
+import {InstalledDatabase} from './installdb'
+
+
+def make_package(directory, name, version, dependencies=None):
+  path = os.path.join(directory, name)
+  os.makedirs(path)
+  data = {'name': name, 'version': version, 'dependencies': dependencies or {}}
+  with open(os.path.join(path, 'nodepy.json'), 'w') as fp:
+    json.dump(data, fp)
+  return path, manifest.Manifest(path, data)
+
+
+def test_installed_database():
+  directory = tempfile.mkdtemp()
+  try:
+    db = InstalledDatabase(os.path.join(directory, '.nodepy', 'installed.db'))
+    assert_equals(db.get(directory), None)
+    assert not os.path.exists(db.filename)
+
+    path, mf = make_package(directory, 'a', '1.0.0', {'b': '~1.0.0'})
+    mf['__is_link'] = False
+    filename = os.path.join(path, 'nodepy.json')
+    db.add(path, 'directory', mf, [filename], [filename], [('a', '/bin/a')])
+    package = db.lookup(path)
+    assert_equals((package.name, package.version, package.kind), ('a', '1.0.0', 'directory'))
+    assert_equals(list(package.manifest), ['name', 'version', 'dependencies'])
+    assert_equals(db.files(path), [filename])
+    assert_equals(db.scripts(path), [('a', os.path.abspath('/bin/a'))])
+    assert_equals([x.name for x in db.dependents('b')], ['a'])
+
+    # Internal dependencies are removed together with their parent.
+    inner, mf = make_package(os.path.join(path, '.nodepy', 'modules'), 'b', '1.0.1')
+    db.add(inner, 'directory', mf, [os.path.join(inner, 'nodepy.json')])
+    assert_equals(db.files(inner), None)
+    other, mf = make_package(directory, 'a_b', '1.0.0')
+    db.add(other, 'directory', mf, [os.path.join(other, 'nodepy.json')])
+    assert_equals([x.name for x in db.packages()], ['a', 'a_b', 'b'])
+
+    os.utime(filename, (0, 0))
+    assert_equals(db.lookup(path), None)
+    assert_equals(db.get(path).name, 'a')
+    db.remove(path)
+    assert_equals([x.name for x in db.packages()], ['a_b'])
+    db.close()
+
+    # Recording does nothing if the stamp files are missing.
+    db.add(path, 'directory', mf, [os.path.join(directory, 'missing.json')])
+    assert_equals(db.get(path), None)
+    db.close()
+  finally:
+    shutil.rmtree(directory)
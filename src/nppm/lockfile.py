@@ -0,0 +1,171 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+The `nodepy-lock.json` file records the exact versions of the registry
+packages in the dependency tree of a package, where their archives were
+downloaded from and their SHA256 digests, as well as the pinned versions of
+the Pip dependencies in the tree.
+
+```json
+{
+  "lockfileVersion": 1,
+  "packages": {
+    "some-package": {
+      "version": "1.2.0",
+      "registry": "default",
+      "resolved": "https://ppym.org/api/download/some-package/1.2.0/some-package-1.2.0.tar.gz",
+      "sha256": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+    }
+  },
+  "pip": {
+    "requests": "==2.19.1"
+  }
+}
+```
+"""
+
+import collections
+import hashlib
+
+import semver from './semver'
+import json from './util/json'
+
+VERSION = 1
+
+
+class IntegrityError(Exception):
+  """
+  Raised when the SHA256 digest of a downloaded package archive does not
+  match the digest that is recorded in the lockfile.
+  """
+
+  def __init__(self, identifier, expected, actual):
+    self.identifier = identifier
+    self.expected = expected
+    self.actual = actual
+
+  def __str__(self):
+    return 'SHA256 mismatch for "{}": expected {}, got {}'.format(
+      self.identifier, self.expected, self.actual)
+
+
+class LockedPackage(collections.namedtuple('LockedPackage', 'name version registry url sha256')):
+  """
+  A registry package that is recorded in the lockfile.
+  """
+
+  @property
+  def identifier(self):
+    return '{}@{}'.format(self.name, self.version)
+
+  def check(self, sha256):
+    """
+    Raises an #IntegrityError if *sha256* does not match the recorded digest.
+    """
+
+    if self.sha256 and sha256 != self.sha256:
+      raise IntegrityError(self.identifier, self.sha256, sha256)
+
+
+class Lockfile(object):
+  """
+  Represents the contents of a `nodepy-lock.json` file.
+
+  # Attributes
+  packages (collections.OrderedDict): Maps package names to #LockedPackage
+    objects.
+  pip (collections.OrderedDict): Maps the names of Pip packages to pinned
+    version specifiers.
+  """
+
+  def __init__(self, packages=None, pip=None):
+    self.packages = collections.OrderedDict(packages or ())
+    self.pip = collections.OrderedDict(pip or ())
+
+  def __eq__(self, other):
+    if isinstance(other, Lockfile):
+      return self.to_json() == other.to_json()
+    return False
+
+  def __ne__(self, other):
+    return not (self == other)
+
+  def get(self, name, selector):
+    """
+    Returns the #LockedPackage for *name* if its version matches the
+    #semver.Selector *selector*, otherwise #None.
+    """
+
+    package = self.packages.get(name)
+    if package is not None and selector(package.version):
+      return package
+    return None
+
+  def to_json(self):
+    packages = collections.OrderedDict()
+    for name in sorted(self.packages):
+      package = self.packages[name]
+      packages[name] = collections.OrderedDict([
+        ('version', str(package.version)),
+        ('registry', package.registry),
+        ('resolved', package.url),
+        ('sha256', package.sha256)
+      ])
+    pip = collections.OrderedDict((k, self.pip[k]) for k in sorted(self.pip))
+    return collections.OrderedDict([
+      ('lockfileVersion', VERSION),
+      ('packages', packages),
+      ('pip', pip)
+    ])
+
+  @classmethod
+  def from_json(cls, data):
+    if data.get('lockfileVersion') != VERSION:
+      raise ValueError('unsupported lockfileVersion: {!r}'.format(
+        data.get('lockfileVersion')))
+    packages = []
+    for name, value in data.get('packages', {}).items():
+      packages.append((name, LockedPackage(name, semver.Version(value['version']),
+        value.get('registry'), value['resolved'], value.get('sha256'))))
+    return cls(packages, data.get('pip', {}).items())
+
+  @classmethod
+  def load(cls, filename):
+    with open(filename) as fp:
+      return cls.from_json(json.load(fp, object_pairs_hook=collections.OrderedDict))
+
+  def save(self, filename):
+    with open(filename, 'w') as fp:
+      json.dump(self.to_json(), fp, indent=2)
+      fp.write('\n')
+
+
+def sha256_of(fp, chunk_size=64 * 1024):
+  """
+  Returns the hex SHA256 digest of the contents of the file-like object *fp*
+  starting from its current position.
+  """
+
+  hasher = hashlib.sha256()
+  for data in iter(lambda: fp.read(chunk_size), b''):
+    hasher.update(data)
+  return hasher.hexdigest()
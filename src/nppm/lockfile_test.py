@@ -0,0 +1,71 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+import io
+import os
+import tempfile
+import semver from './semver'
+import {Lockfile, LockedPackage, IntegrityError, sha256_of} from './lockfile'
+
+
+def make_lockfile():
+  return Lockfile([
+    ('b', LockedPackage('b', semver.Version('1.0.3'), 'default', 'https://example.org/b-1.0.3.tar.gz', 'ab' * 32)),
+    ('a', LockedPackage('a', semver.Version('2.0.0'), 'default', 'https://example.org/a-2.0.0.tar.gz', 'cd' * 32)),
+  ], [('requests', '==2.19.1')])
+
+
+def test_roundtrip():
+  lock = make_lockfile()
+  fd, filename = tempfile.mkstemp(suffix='_nodepy-lock.json')
+  os.close(fd)
+  try:
+    lock.save(filename)
+    loaded = Lockfile.load(filename)
+  finally:
+    os.remove(filename)
+  assert_equals(loaded, lock)
+  assert_equals(list(loaded.to_json()['packages']), ['a', 'b'])
+  assert_equals(loaded.packages['b'].version, semver.Version('1.0.3'))
+  assert_equals(loaded.pip['requests'], '==2.19.1')
+
+
+@raises(ValueError)
+def test_unsupported_version():
+  Lockfile.from_json({'lockfileVersion': 99, 'packages': {}})
+
+
+def test_get():
+  lock = make_lockfile()
+  assert_equals(lock.get('b', semver.Selector('~1.0.0')).identifier, 'b@1.0.3')
+  assert_equals(lock.get('b', semver.Selector('>=1.1.0')), None)
+  assert_equals(lock.get('c', semver.Selector('*')), None)
+
+
+def test_check():
+  digest = sha256_of(io.BytesIO(b'archive'))
+  package = LockedPackage('a', semver.Version('1.0.0'), None, 'https://example.org/a.tar.gz', digest)
+  package.check(digest)
+  with assert_raises(IntegrityError) as cm:
+    package.check('0' * 64)
+  assert 'a@1.0.0' in str(cm.exception)
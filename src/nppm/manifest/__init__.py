@@ -36,6 +36,10 @@ import refstring from '../refstring'
 try:
   import pip._internal.req as pip_req
   import pip._internal.exceptions as pip_exceptions
+  try:
+    import pip._internal.req.constructors
+  except ImportError:
+    pass
 except ImportError:
   import pip.req as pip_req
   import pip.exceptions as pip_exceptions
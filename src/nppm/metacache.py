@@ -0,0 +1,262 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+An on-disk cache for the metadata that a #registry.RegistryClient receives
+from a registry, so that repeated installs do not ask the registry the same
+questions again.
+
+    <directory>/<registry>/
+      versions/<name>.json
+      manifests/<name>/<version>.json
+      index.jsonl
+
+The version list of a package is used without asking the registry for
+*ttl* seconds after it was fetched. After that, it is revalidated with the
+`ETag` that the registry sent (`If-None-Match`). The manifest of a package
+version never changes once it has been published, thus it is cached until
+the cache is cleared.
+
+The `index.jsonl` is a #RegistryIndex, a local copy of the index of all
+packages in the registry that is created with `nppm registry sync`.
+"""
+
+import collections
+import errno
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+import json from './util/json'
+
+DEFAULT_DIRECTORY = '~/.nodepy/cache/metadata'
+DEFAULT_TTL = 300
+
+
+class MetadataCache(object):
+  """
+  Represents the metadata cache in *directory*. Version lists that are
+  younger than *ttl* seconds are considered fresh.
+  """
+
+  def __init__(self, directory=None, ttl=DEFAULT_TTL):
+    self.directory = os.path.expanduser(directory or DEFAULT_DIRECTORY)
+    self.ttl = ttl
+
+  def __repr__(self):
+    return '<MetadataCache "{}">'.format(self.directory)
+
+  @classmethod
+  def from_config(cls, config):
+    """
+    Creates a #MetadataCache from the `cache.metadata_dir` (defaults to
+    `~/.nodepy/cache/metadata`) and `cache.metadata_ttl` (in seconds,
+    defaults to 300) options of a Node.py #Config.
+    """
+
+    directory = config.get('cache.metadata_dir', DEFAULT_DIRECTORY)
+    ttl = float(config.get('cache.metadata_ttl', DEFAULT_TTL))
+    return cls(directory, ttl)
+
+  def _path(self, base_url, *parts):
+    key = hashlib.sha1(base_url.rstrip('/').encode('utf8')).hexdigest()[:16]
+    return os.path.join(self.directory, key, *parts)
+
+  def _read_json(self, filename):
+    try:
+      with open(filename) as fp:
+        return json.load(fp, object_pairs_hook=collections.OrderedDict)
+    except (IOError, OSError) as exc:
+      if exc.errno != errno.ENOENT:
+        raise
+      return None
+    except ValueError:
+      return None
+
+  def _write_json(self, filename, data):
+    _makedirs(os.path.dirname(filename))
+    tmpname = '{}.{}.{}.tmp'.format(filename, os.getpid(), threading.current_thread().ident)
+    with open(tmpname, 'w') as fp:
+      json.dump(data, fp)
+    if os.name == 'nt' and os.path.isfile(filename):
+      os.remove(filename)
+    os.rename(tmpname, filename)
+
+  def get_versions(self, base_url, name):
+    """
+    Returns the cached version list entry of the package *name* in the
+    registry at *base_url*, or #None. The entry is a dictionary with the
+    keys `status` (`ok`, `not-found` or `unsupported`), `versions` (a list
+    of version strings), `etag` and `fetched` (a timestamp).
+    """
+
+    return self._read_json(self._path(base_url, 'versions', name.replace('/', '+') + '.json'))
+
+  def set_versions(self, base_url, name, status, versions=(), etag=None):
+    """
+    Stores the version list of the package *name*. Pass the same arguments
+    again to mark an entry that has been revalidated as fresh.
+    """
+
+    data = {'status': status, 'versions': [str(x) for x in versions],
+      'etag': etag, 'fetched': time.time()}
+    self._write_json(self._path(base_url, 'versions', name.replace('/', '+') + '.json'), data)
+
+  def is_fresh(self, timestamp):
+    """
+    Returns #True if data that was fetched at *timestamp* is younger than
+    the #ttl.
+    """
+
+    return timestamp is not None and time.time() - timestamp < self.ttl
+
+  def index(self, base_url):
+    """
+    Returns the #RegistryIndex of the registry at *base_url*.
+    """
+
+    return RegistryIndex(self._path(base_url, 'index.jsonl'))
+
+  def get_manifest(self, base_url, name, version):
+    """
+    Returns the cached manifest data of a package version, or #None.
+    """
+
+    return self._read_json(self._path(base_url, 'manifests',
+      name.replace('/', '+'), str(version) + '.json'))
+
+  def set_manifest(self, base_url, name, version, data):
+    self._write_json(self._path(base_url, 'manifests',
+      name.replace('/', '+'), str(version) + '.json'), data)
+
+  def clear(self):
+    """
+    Removes all entries from the cache.
+    """
+
+    shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class RegistryIndex(object):
+  """
+  A local copy of the index of a registry, ie. the manifests of all versions
+  of all packages, stored as JSON lines sorted by the package name. The first
+  line holds the `serial` of the registry's index and the time it was
+  `synced`, every other line is an object with the `name` of a package and
+  its `versions` (mapping version strings to manifests).
+
+  The registry sends its index from `GET /api/index`, in the same format,
+  and only the packages that changed since a previous serial if the `since`
+  parameter is specified. In that case the header may contain `"full":
+  false`, and lines with `"deleted": true` remove a package.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.lock = threading.RLock()
+    self.serial = None
+    self.synced = None
+    self.packages = None  # name -> {version: manifest data}
+
+  def exists(self):
+    return os.path.isfile(self.filename)
+
+  def load(self):
+    """
+    Reads the index file unless it has already been loaded. Does nothing if
+    the file does not exist.
+    """
+
+    with self.lock:
+      if self.packages is not None or not self.exists():
+        return
+      with open(self.filename) as fp:
+        self.apply(fp)
+
+  def apply(self, lines):
+    """
+    Applies the JSON *lines* of a full index or a delta to the index.
+    Returns the number of packages that have been updated.
+    """
+
+    with self.lock:
+      lines = iter(lines)
+      header = json.loads(next(lines))
+      if self.packages is None or header.get('full', True):
+        self.packages = {}
+      count = 0
+      for line in lines:
+        line = line.strip()
+        if not line:
+          continue
+        entry = json.loads(line, object_pairs_hook=collections.OrderedDict)
+        if entry.get('deleted'):
+          self.packages.pop(entry['name'], None)
+        else:
+          self.packages[entry['name']] = entry['versions']
+        count += 1
+      self.serial = header.get('serial')
+      self.synced = header.get('synced', time.time())
+      return count
+
+  def save(self):
+    with self.lock:
+      _makedirs(os.path.dirname(self.filename))
+      tmpname = '{}.{}.tmp'.format(self.filename, os.getpid())
+      with open(tmpname, 'w') as fp:
+        json.dump({'serial': self.serial, 'synced': self.synced}, fp)
+        fp.write('\n')
+        for name in sorted(self.packages):
+          json.dump({'name': name, 'versions': self.packages[name]}, fp, sort_keys=True)
+          fp.write('\n')
+      if os.name == 'nt' and os.path.isfile(self.filename):
+        os.remove(self.filename)
+      os.rename(tmpname, self.filename)
+
+  def versions(self, name):
+    """
+    Returns the list of version strings of the package *name*, or #None if
+    the package is not in the index.
+    """
+
+    self.load()
+    versions = (self.packages or {}).get(name)
+    return None if versions is None else list(versions)
+
+  def manifest(self, name, version):
+    """
+    Returns the manifest data of a package version or #None.
+    """
+
+    self.load()
+    return (self.packages or {}).get(name, {}).get(str(version))
+
+
+def _makedirs(directory):
+  if not os.path.isdir(directory):
+    try:
+      os.makedirs(directory)
+    except OSError as exc:
+      if exc.errno != errno.EEXIST:
+        raise
@@ -120,7 +120,7 @@ class PackageLifecycle(object):
     # version, let the user confirm that he/she really wants to upload the file.
     basename = os.path.basename(filename)
     if basename.startswith(self.manifest.identifier) and basename \
-        != registry.get_package_archive_name(self.manifest['name'], self.manifest['version']):
+        != get_package_archive_name(self.manifest['name'], self.manifest['version']):
       print('This looks a like a package distribution archive, but it ')
       print('does not match with the package\'s current version. Do you ')
       print('really want to upload this file? [y/n] ')
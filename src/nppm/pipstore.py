@@ -0,0 +1,456 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+A store of installed Python distributions that is shared by all projects of
+a user. Pip installs every version of a distribution into the store only
+once, the Pip prefixes of projects and of packages with internal
+dependencies are then populated by placing the files from the store (see
+#util.place.FilePlacer, hardlinks where possible).
+
+    <directory>/<abi>/<name>/<version>/
+      entry.json
+      tree/
+
+The `tree/` mirrors the layout of a Pip prefix (eg.
+`lib/python3.6/site-packages/...` and `bin/...`). Distributions are stored
+per interpreter ABI (see #get_abi_tag()) as they can contain extension
+modules. The scripts that Pip generated refer to the interpreter of the
+environment that the distribution was first installed into, they are
+written with the shebang of the current interpreter instead of being
+linked (see #PipStore.link()).
+"""
+
+import collections
+import contextlib
+import csv
+import email.parser
+import errno
+import io
+import os
+import platform
+import re
+import shutil
+import sys
+import sysconfig
+import tempfile
+
+import pkg_resources
+
+import {normalize_dist_name as normalize_name} from './env'
+import json from './util/json'
+import {FilePlacer} from './util/place'
+
+DEFAULT_DIRECTORY = '~/.nodepy/cache/pip'
+
+
+class StoreEntry(collections.namedtuple('StoreEntry',
+    'name version directory dist_info requires files')):
+  """
+  A distribution in the #PipStore. The *dist_info* directory and the
+  *files* are paths relative to the Pip prefix, separated by `/`.
+  *requires* are the `Requires-Dist` lines of the distribution's metadata.
+  """
+
+  @property
+  def tree(self):
+    return os.path.join(self.directory, 'tree')
+
+
+class PipStore(object):
+  """
+  Represents the Pip store in *directory* for the interpreter *abi*
+  (defaults to the ABI of the current interpreter).
+  """
+
+  def __init__(self, directory=None, abi=None):
+    self.directory = os.path.expanduser(directory or DEFAULT_DIRECTORY)
+    self.abi = abi or get_abi_tag()
+
+  def __repr__(self):
+    return '<PipStore "{}" ({})>'.format(self.directory, self.abi)
+
+  @classmethod
+  def from_config(cls, config):
+    """
+    Creates a #PipStore from the `cache.pip_store_dir` option (defaults to
+    `~/.nodepy/cache/pip`) of a Node.py #Config.
+    """
+
+    return cls(config.get('cache.pip_store_dir', DEFAULT_DIRECTORY))
+
+  def _path(self, *parts):
+    return os.path.join(self.directory, self.abi, *parts)
+
+  @contextlib.contextmanager
+  def staging(self):
+    """
+    A context manager that creates a temporary directory inside the store
+    and removes it on exit. Distributions that Pip installed into a prefix
+    in this directory can be moved into the store with #add_prefix()
+    without copying the files.
+    """
+
+    _makedirs(self.directory)
+    directory = tempfile.mkdtemp(prefix='.staging-', dir=self.directory)
+    try:
+      yield directory
+    finally:
+      _rmtree(directory)
+
+  def entries(self, name):
+    """
+    Returns a list of the #StoreEntry objects for all versions of the
+    distribution *name* in the store.
+    """
+
+    name = normalize_name(name)
+    try:
+      versions = os.listdir(self._path(name))
+    except OSError as exc:
+      if exc.errno != errno.ENOENT:
+        raise
+      return []
+    result = []
+    for version in versions:
+      if not version.startswith('.'):
+        entry = self._load(name, version)
+        if entry:
+          result.append(entry)
+    return result
+
+  def _load(self, name, version):
+    directory = self._path(name, version)
+    try:
+      with open(os.path.join(directory, 'entry.json')) as fp:
+        data = json.load(fp)
+    except (IOError, OSError, ValueError):
+      return None
+    return StoreEntry(data['name'], data['version'], directory,
+      data['dist_info'], data['requires'], data['files'])
+
+  def find(self, name, reqs):
+    """
+    Returns the #StoreEntry of the distribution *name* with the highest
+    version that satisfies all #pkg_resources.Requirement objects in
+    *reqs*, or #None.
+    """
+
+    candidates = [x for x in self.entries(name) if all(x.version in r for r in reqs)]
+    if not candidates:
+      return None
+    return max(candidates, key=lambda x: pkg_resources.parse_version(x.version))
+
+  def resolve(self, lines):
+    """
+    Resolves the Pip requirement *lines* and the dependencies of the
+    selected distributions to entries in the store. Returns a list of
+    #StoreEntry objects, or #None if any requirement can not be satisfied
+    from the store. Requirements with a URL are never satisfied.
+
+    The highest version that satisfies the known requirements is selected
+    for every distribution. When a dependency excludes a version that has
+    already been selected, the resolution starts over with all requirements
+    that have been seen so far. There is no backtracking beyond that.
+    """
+
+    top = []
+    for line in lines:
+      try:
+        req = pkg_resources.Requirement.parse(line)
+      except ValueError:
+        return None
+      if getattr(req, 'url', None):
+        return None
+      if not req.marker or req.marker.evaluate({'extra': ''}):
+        top.append(req)
+
+    constraints = collections.defaultdict(list)
+    while True:
+      chosen = collections.OrderedDict()
+      extras = {}
+      queue = collections.deque(top)
+      while queue:
+        req = queue.popleft()
+        if getattr(req, 'url', None):
+          return None
+        key = normalize_name(req.project_name)
+        if req not in constraints[key]:
+          constraints[key].append(req)
+        entry = chosen.get(key)
+        if entry is None:
+          entry = chosen[key] = self.find(key, constraints[key])
+          if entry is None:
+            return None
+        elif entry.version not in req:
+          break  # Start over, knowing about this requirement.
+
+        # Queue the dependencies of the distribution for extras that have
+        # not been processed yet ('' for the dependencies without extra).
+        pending = set(x.lower() for x in req.extras) | set([''])
+        pending -= extras.setdefault(key, set())
+        extras[key] |= pending
+        for line in entry.requires:
+          dep = pkg_resources.Requirement.parse(line)
+          if dep.marker:
+            if not any(dep.marker.evaluate({'extra': x}) for x in pending):
+              continue
+          elif '' not in pending:
+            continue
+          queue.append(dep)
+      else:
+        return list(chosen.values())
+
+  def add_prefix(self, prefix):
+    """
+    Moves the distributions that Pip installed into *prefix* into the
+    store, unless the store already contains them. The *prefix* should be
+    on the same filesystem as the store (see #staging()). Distributions
+    without a `RECORD` file are skipped. Returns a list of the new
+    #StoreEntry objects.
+    """
+
+    added = []
+    for dist_info in _find_dist_infos(prefix):
+      entry = self._add_dist(prefix, dist_info)
+      if entry:
+        added.append(entry)
+    return added
+
+  def _add_dist(self, prefix, dist_info):
+    record = os.path.join(dist_info, 'RECORD')
+    metadata = os.path.join(dist_info, 'METADATA')
+    if not os.path.isfile(record) or not os.path.isfile(metadata):
+      return None
+    with io.open(metadata, encoding='utf8', errors='replace') as fp:
+      meta = email.parser.Parser().parse(fp, headersonly=True)
+    name, version = meta['Name'], meta['Version']
+    if not name or not version:
+      return None
+    key = normalize_name(name)
+    target = self._path(key, version)
+    if os.path.isdir(target):
+      return None
+
+    files = []
+    site = os.path.dirname(dist_info)
+    with open(record) as fp:
+      for row in csv.reader(fp):
+        if not row:
+          continue
+        path = os.path.normpath(os.path.join(site, row[0]))
+        rel = os.path.relpath(path, prefix)
+        if not rel.startswith(os.pardir) and os.path.isfile(path):
+          files.append(rel.replace(os.sep, '/'))
+
+    _makedirs(self._path(key))
+    staging = tempfile.mkdtemp(prefix='.{}-'.format(version), dir=self._path(key))
+    try:
+      for rel in files:
+        dst = os.path.join(staging, 'tree', *rel.split('/'))
+        _makedirs(os.path.dirname(dst))
+        os.rename(os.path.join(prefix, *rel.split('/')), dst)
+      data = collections.OrderedDict([
+        ('name', name),
+        ('version', version),
+        ('dist_info', os.path.relpath(dist_info, prefix).replace(os.sep, '/')),
+        ('requires', meta.get_all('Requires-Dist') or []),
+        ('files', files),
+      ])
+      with open(os.path.join(staging, 'entry.json'), 'w') as fp:
+        json.dump(data, fp)
+      try:
+        os.rename(staging, target)
+      except OSError:
+        if os.path.isdir(target):  # Added by another process.
+          return None
+        raise
+    finally:
+      if os.path.isdir(staging):
+        _rmtree(staging)
+    return self._load(key, version)
+
+  def link(self, entry, prefix, placer=None, executable=None):
+    """
+    Places the files of the #StoreEntry *entry* into the Pip *prefix* with
+    the #FilePlacer *placer* (which uses hardlinks by default). Python
+    scripts outside of the site-packages directory are copied with their
+    shebang pointing to *executable* (defaults to #sys.executable). Other
+    versions of the distribution that are installed in the prefix are
+    removed first. Returns #False if the version is already installed,
+    #True otherwise.
+    """
+
+    if placer is None:
+      placer = FilePlacer(hardlink=True)
+    if executable is None:
+      executable = sys.executable
+    site = entry.dist_info.rpartition('/')[0] + '/'
+    dist_info = os.path.join(prefix, *entry.dist_info.split('/'))
+    for other in _find_installed(os.path.dirname(dist_info), entry.name):
+      if other == dist_info and os.path.isfile(os.path.join(other, 'RECORD')):
+        return False
+      _remove_dist(other)
+
+    for rel in entry.files:
+      src = os.path.join(entry.tree, *rel.split('/'))
+      dst = os.path.join(prefix, *rel.split('/'))
+      _makedirs(os.path.dirname(dst))
+      if os.path.lexists(dst):
+        os.remove(dst)
+      if not rel.startswith(site) and _write_script(src, dst, executable):
+        continue
+      if placer.place(src, dst) != 'hardlink':
+        shutil.copymode(src, dst)
+    return True
+
+
+def get_abi_tag():
+  """
+  Returns a string that identifies the ABI of the current interpreter and
+  the platform, eg. `cpython-36m-x86_64-linux-gnu-linux-x86_64`.
+  """
+
+  abi = sysconfig.get_config_var('SOABI')
+  if not abi:
+    abi = '{}-{}{}'.format(platform.python_implementation().lower(), *sys.version_info[:2])
+    if sys.version_info[0] == 2 and sys.maxunicode > 0xffff:
+      abi += 'mu'
+  return re.sub(r'[^\w.\-]+', '_', '{}-{}'.format(abi, sysconfig.get_platform()))
+
+
+def is_pinned(line):
+  """
+  Returns #True if the Pip requirement *line* pins an exact version (`==`
+  or `===`), like the requirements that are recorded in a lockfile.
+  """
+
+  try:
+    req = pkg_resources.Requirement.parse(line)
+  except ValueError:
+    return False
+  return len(req.specs) == 1 and req.specs[0][0] in ('==', '===') \
+    and '*' not in req.specs[0][1]
+
+
+def _shebang(executable):
+  """
+  Returns the shebang lines for a script that runs with *executable*, in
+  the form that Pip uses.
+  """
+
+  if ' ' not in executable and len(executable) <= 125:
+    return '#!{}\n'.format(executable)
+  # The kernel does not support long or quoted shebangs.
+  return '#!/bin/sh\n\'\'\'exec\' "{}" "$0" "$@"\n\' \'\'\'\n'.format(executable)
+
+
+def _write_script(src, dst, executable):
+  """
+  Copies the Python script *src* to *dst*, replacing its shebang with the
+  one for *executable*. Returns #False without writing *dst* if *src* is
+  not a Python script.
+  """
+
+  with open(src, 'rb') as fp:
+    lines = fp.readlines()
+  if not lines or not lines[0].startswith(b'#!'):
+    return False
+  if b'python' in lines[0]:
+    del lines[0]
+  elif lines[0].strip() == b'#!/bin/sh' and len(lines) > 2 and \
+      lines[1].startswith(b"'''exec'") and lines[2].strip() == b"' '''":
+    del lines[:3]
+  else:
+    return False
+  with open(dst, 'wb') as fp:
+    fp.write(_shebang(executable).encode(sys.getfilesystemencoding()))
+    fp.writelines(lines)
+  shutil.copymode(src, dst)
+  return True
+
+
+def _find_dist_infos(prefix):
+  for root, dirs, files in os.walk(prefix):
+    for name in dirs[:]:
+      if name.endswith('.dist-info'):
+        dirs.remove(name)
+        yield os.path.join(root, name)
+
+
+def _find_installed(site, name):
+  """
+  Returns the `.dist-info` directories of the distribution *name* in the
+  *site* directory.
+  """
+
+  try:
+    names = os.listdir(site)
+  except OSError as exc:
+    if exc.errno != errno.ENOENT:
+      raise
+    return []
+  name = normalize_name(name)
+  return [os.path.join(site, x) for x in names if x.endswith('.dist-info')
+    and normalize_name(x[:-len('.dist-info')].rpartition('-')[0]) == name]
+
+
+def _remove_dist(dist_info):
+  """
+  Removes the files of an installed distribution that are listed in the
+  `RECORD` of its *dist_info* directory, and the directory itself.
+  """
+
+  site = os.path.dirname(dist_info)
+  dirs = set()
+  record = os.path.join(dist_info, 'RECORD')
+  if os.path.isfile(record):
+    with open(record) as fp:
+      for row in csv.reader(fp):
+        if not row:
+          continue
+        path = os.path.normpath(os.path.join(site, row[0]))
+        try:
+          os.remove(path)
+        except OSError as exc:
+          if exc.errno != errno.ENOENT:
+            raise
+        dirs.add(os.path.dirname(path))
+  _rmtree(dist_info)
+  for dirname in sorted(dirs, key=len, reverse=True):
+    try:
+      os.rmdir(dirname)
+    except OSError:
+      pass
+
+
+def _makedirs(directory):
+  if not os.path.isdir(directory):
+    try:
+      os.makedirs(directory)
+    except OSError as exc:
+      if exc.errno != errno.EEXIST:
+        raise
+
+
+def _rmtree(directory):
+  if os.path.isdir(directory):
+    shutil.rmtree(directory, ignore_errors=True)
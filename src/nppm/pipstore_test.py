@@ -0,0 +1,143 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+import os
+import shutil
+import sys
+import tempfile
+import {PipStore, is_pinned} from './pipstore'
+
+SITE = 'lib/site-packages'
+
+
+def make_dist(prefix, name, version, requires=(), modules=None):
+  """
+  Creates the files of a distribution *name* in the Pip *prefix* like Pip
+  does, including a console script in `bin/`.
+  """
+
+  dist_info = '{}-{}.dist-info'.format(name.replace('-', '_'), version)
+  files = {
+    dist_info + '/METADATA': 'Metadata-Version: 2.1\nName: {}\nVersion: {}\n{}'.format(
+      name, version, ''.join('Requires-Dist: {}\n'.format(x) for x in requires)),
+    '../../bin/' + name: '#!/usr/bin/env python\n',
+  }
+  for module in modules or [name.replace('-', '_')]:
+    files[module + '/__init__.py'] = '__version__ = {!r}\n'.format(version)
+  record = [x + ',,' for x in files] + [dist_info + '/RECORD,,']
+  files[dist_info + '/RECORD'] = '\n'.join(record) + '\n'
+  for filename, data in files.items():
+    path = os.path.normpath(os.path.join(prefix, SITE, filename))
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fp:
+      fp.write(data)
+
+
+def with_store(func):
+  def wrapper():
+    directory = tempfile.mkdtemp(suffix='_pipstore')
+    try:
+      func(PipStore(os.path.join(directory, 'store'), 'test'), directory)
+    finally:
+      shutil.rmtree(directory)
+  wrapper.__name__ = func.__name__
+  return wrapper
+
+
+def fill(store, *dists):
+  with store.staging() as staging:
+    for args in dists:
+      make_dist(staging, *args)
+    return store.add_prefix(staging)
+
+
+@with_store
+def test_add_and_resolve(store, directory):
+  added = fill(store,
+    ('requests', '2.19.1', ['idna (<2.8,>=2.5)', "PySocks (>=1.5.6) ; extra == 'socks'"]),
+    ('idna', '2.7'),
+    ('PySocks', '1.6.8', [], ['socks']))
+  added += fill(store, ('idna', '2.8'))
+  assert_equals(sorted((x.name, x.version) for x in added),
+    [('PySocks', '1.6.8'), ('idna', '2.7'), ('idna', '2.8'), ('requests', '2.19.1')])
+  entry = store.entries('requests')[0]
+  assert_equals(entry.dist_info, SITE + '/requests-2.19.1.dist-info')
+  assert_in('bin/requests', entry.files)
+  assert_equals(fill(store, ('idna', '2.7')), [])
+
+  resolved = store.resolve(['requests>=2.0'])
+  assert_equals([(x.name, x.version) for x in resolved], [('requests', '2.19.1'), ('idna', '2.7')])
+  resolved = store.resolve(['requests[socks]', 'idna'])
+  assert_equals(sorted(x.name for x in resolved), ['PySocks', 'idna', 'requests'])
+  assert_equals(store.resolve(['idna'])[0].version, '2.8')
+  assert_equals(store.resolve(['idna', 'requests'])[0].version, '2.7')
+  assert_equals(store.resolve(['requests', 'idna>=2.8']), None)
+  assert_equals(store.resolve(['six']), None)
+  assert_equals(store.resolve(['idna @ https://example.org/idna.tar.gz']), None)
+  assert_equals(store.resolve(['six; python_version < "2"']), [])
+  assert_equals(PipStore(store.directory, 'other').resolve(['idna']), None)
+
+
+@with_store
+def test_link(store, directory):
+  fill(store, ('idna', '2.7'))
+  fill(store, ('idna', '2.8', [], ['idna', 'idna_compat']))
+  prefix = os.path.join(directory, 'project')
+  old, new = sorted(store.entries('idna'), key=lambda x: x.version)
+
+  assert_equals(store.link(old, prefix), True)
+  assert_equals(store.link(old, prefix), False)
+  filename = os.path.join(prefix, SITE, 'idna', '__init__.py')
+  source = os.path.join(old.tree, SITE, 'idna', '__init__.py')
+  if hasattr(os.path, 'samefile'):
+    assert os.path.samefile(filename, source)
+  # Scripts get the shebang of the interpreter of the prefix.
+  with open(os.path.join(prefix, 'bin', 'idna')) as fp:
+    assert_equals(fp.readline(), '#!' + sys.executable + '\n')
+  other = os.path.join(directory, 'other')
+  store.link(old, other, executable='/opt/my python/bin/python')
+  with open(os.path.join(other, 'bin', 'idna')) as fp:
+    assert_equals(fp.read().split('\n')[:2],
+      ['#!/bin/sh', '\'\'\'exec\' "/opt/my python/bin/python" "$0" "$@"'])
+  with open(os.path.join(old.tree, 'bin', 'idna')) as fp:
+    assert_equals(fp.read(), '#!/usr/bin/env python\n')
+
+  # Replaces the files of the other version.
+  assert_equals(store.link(new, prefix), True)
+  with open(filename) as fp:
+    assert_equals(fp.read(), "__version__ = '2.8'\n")
+  assert os.path.isfile(os.path.join(prefix, SITE, 'idna_compat', '__init__.py'))
+  assert not os.path.exists(os.path.join(prefix, SITE, 'idna-2.7.dist-info'))
+  assert os.path.isfile(os.path.join(prefix, SITE, 'idna-2.8.dist-info', 'RECORD'))
+  with open(source) as fp:
+    assert_equals(fp.read(), "__version__ = '2.7'\n")
+
+
+def test_is_pinned():
+  assert is_pinned('idna==2.7')
+  assert is_pinned('requests[socks]===2.19.1')
+  assert not is_pinned('idna==2.*')
+  assert not is_pinned('idna>=2.7')
+  assert not is_pinned('idna>=2.7,==2.7')
+  assert not is_pinned('idna')
@@ -28,13 +28,15 @@ uploading new packages.
 """
 
 import collections
-import hammock
+import contextlib
 import json
 import os
 import requests
 import six
+from multiprocessing.pool import ThreadPool
 import argschema from './argschema'
 import manifest from './manifest'
+import {MetadataCache} from './metacache'
 import semver from './semver'
 import refstring from './refstring'
 import text from './util/text'
@@ -102,6 +104,18 @@ class Error(Exception):
     return self.response.status_code
 
 
+class PackageInfo(collections.namedtuple('PackageInfo', 'name version manifest')):
+  """
+  Information on a package version that is available in a registry, as
+  returned by #RegistryClient.find_package(). The *manifest* is the
+  #manifest.Manifest of the package version that was sent by the registry.
+  """
+
+  @property
+  def identifier(self):
+    return '{}@{}'.format(self.name, self.version)
+
+
 class PackageNotFound(Exception):
   """
   Raised by #Registry.find_package() if there is no package matching the
@@ -123,14 +137,31 @@ class RegistryClient(object):
   file. The server will reply with an error if an unauthorized request was
   made.
 
+  All requests are sent through one #requests.Session that keeps up to
+  *max_connections* connections to the registry alive. Further concurrent
+  requests wait for a free connection.
+
   # Parameters
   base_url (str): The base URL of the package registry.
   username (str): Username for authorized actions.
   password (str): Password for authorized actions.
+  timeout (float): Timeout in seconds for connecting to the registry and
+    for waiting on data. Configured with the `timeout` option of the
+    registry section.
+  max_connections (int): The maximum number of concurrent connections to
+    the registry. Configured with the `max_connections` option.
+  metadata_cache (MetadataCache): If specified, version lists and manifests
+    are cached on disk. Packages are then matched against the cached
+    version list locally instead of asking the registry to pick a version.
+    If the registry index has been downloaded with #sync_index(), it is
+    consulted first (see #MetadataCache.index()).
   """
 
+  DEFAULT_TIMEOUT = 30
+  DEFAULT_MAX_CONNECTIONS = 8
+
   @staticmethod
-  def get(config, name):
+  def get(config, name, metadata_cache=None):
     try:
       regconf = get_config_registry(config, name)
       regurl = regconf['url']
@@ -142,19 +173,113 @@ class RegistryClient(object):
       name,
       regurl,
       username=regconf.get('username'),
-      password=regconf.get('password')
+      password=regconf.get('password'),
+      timeout=float(regconf.get('timeout', RegistryClient.DEFAULT_TIMEOUT)),
+      max_connections=int(regconf.get('max_connections', RegistryClient.DEFAULT_MAX_CONNECTIONS)),
+      metadata_cache=metadata_cache
     )
 
   @staticmethod
-  def get_all(config):
-    return [RegistryClient.get(config, x.name) for x in get_config_registries(config)]
+  def get_all(config, cache=False):
+    """
+    Returns a #RegistryClient for every registry in the *config*. If *cache*
+    is #True, the clients use the #MetadataCache that is configured in
+    *config*.
+    """
+
+    metadata_cache = MetadataCache.from_config(config) if cache else None
+    return [RegistryClient.get(config, x.name, metadata_cache)
+            for x in get_config_registries(config)]
 
-  def __init__(self, name, base_url, username=None, password=None):
+  def __init__(self, name, base_url, username=None, password=None,
+               timeout=DEFAULT_TIMEOUT, max_connections=DEFAULT_MAX_CONNECTIONS,
+               metadata_cache=None):
     self.name = name
     self.base_url = base_url
     self.username = username
     self.password = password
-    self.api = hammock.Hammock(base_url).api
+    self.timeout = timeout
+    self.max_connections = max_connections
+    self.metadata_cache = metadata_cache
+    self.session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+      pool_maxsize=max_connections, pool_block=True)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+    self._bulk_find = None  # True/False once known if POST /api/find works
+    self._index = None
+    self._index_checked = False
+
+  def close(self):
+    """
+    Closes the connections to the registry.
+    """
+
+    self.session.close()
+
+  def sync_index(self):
+    """
+    Downloads the index of all packages in the registry into the
+    #metadata_cache, or only the changes since the last sync. Returns the
+    #RegistryIndex and the number of packages that changed, or `(None, 0)`
+    if the registry does not provide an index.
+    """
+
+    if self.metadata_cache is None:
+      raise RuntimeError('registry index requires a metadata cache')
+    if self._index is None:
+      self._index = self.metadata_cache.index(self.base_url)
+    index = self._index
+    with index.lock:
+      index.load()
+      params = {} if index.serial is None else {'since': index.serial}
+      response = self._request('GET', 'index', params=params, stream=True)
+      with contextlib.closing(response):
+        if response.status_code in (404, 405, 501):
+          return None, 0
+        if response.status_code != 200:
+          self._handle_response(response)
+          raise Error(response, 'Unexpected status code')
+        lines = (x.decode('utf8') for x in response.iter_lines())
+        count = index.apply(lines)
+      index.save()
+    return index, count
+
+  def _get_index(self):
+    """
+    Returns the #RegistryIndex if it has been downloaded before, or #None.
+    An index that is older than the TTL of the #metadata_cache is synced
+    once; if that fails, the old index is used.
+    """
+
+    if self.metadata_cache is None:
+      return None
+    if self._index is None:
+      self._index = self.metadata_cache.index(self.base_url)
+    index = self._index
+    with index.lock:
+      if not index.exists():
+        return None
+      index.load()
+      if not self._index_checked and not self.metadata_cache.is_fresh(index.synced):
+        self._index_checked = True
+        try:
+          self.sync_index()
+        except (requests.RequestException, Error):
+          pass
+    return index
+
+  def _url(self, *parts):
+    return '/'.join([self.base_url.rstrip('/'), 'api'] + [six.text_type(x) for x in parts])
+
+  def _request(self, method, *parts, **kwargs):
+    """
+    Sends a request to the api endpoint made up of *parts* through the
+    pooled #session and returns the #requests.Response.
+    """
+
+    kwargs.setdefault('timeout', self.timeout)
+    return self.session.request(method, self._url(*parts), **kwargs)
 
   def _handle_response(self, response):
     """
@@ -181,15 +306,17 @@ class RegistryClient(object):
 
     return data
 
-  def download(self, package_name, version, filename=None):
+  def download(self, package_name, version, filename=None, headers=None):
     """
     Download the package archive for the specified *package_name* and *version*.
     If *filename* is not specified, the package-archive name is used which is
     generated with #get_package_archive_name(). Note that the file must
     previously be uploaded with `upm upload`.
 
-    Returns a #requests.Response object. The status code of the returned
-    response must be checked!
+    Returns a #requests.Response object. The content is streamed, thus the
+    caller should read it with #requests.Response.iter_content() and close
+    the response when it is done. Additional *headers* can be passed to
+    request a byte range of the archive.
     """
 
     argschema.validate('package_name', package_name, {'type': six.text_type})
@@ -199,8 +326,8 @@ class RegistryClient(object):
     if not filename:
       filename = get_package_archive_name(package_name, version)
 
-    url = self.api.download(package_name, version, filename)
-    response = url.GET()
+    response = self._request('GET', 'download', package_name, version, filename,
+      stream=True, headers=headers)
     response.raise_for_status()
     return response
 
@@ -209,25 +336,202 @@ class RegistryClient(object):
     Finds the best matching package for the specified *package_name* and
     *version_selector*. If the registry does not provide the package, raises
     a #PackageNotFound exception, otherwise it returns #PackageInfo.
+
+    With a #metadata_cache, the version is chosen from the version list of
+    the package and the registry is only asked for the manifest of that
+    version if it is not already cached.
     """
 
     argschema.validate('package_name', package_name, {'type': six.text_type})
     argschema.validate('version_selector', version_selector,
         {'type': semver.Selector})
 
-    response = self.api.find(package_name, version_selector).GET()
+    if self.metadata_cache is not None:
+      version = self._select_version(package_name, version_selector)
+      if version is not None:
+        info = self._cached_package(package_name, version)
+        if info is not None:
+          return info
+        version_selector = semver.Selector(version)
+    return self._fetch_package(package_name, version_selector)
+
+  def _fetch_package(self, package_name, version_selector):
+    response = self._request('GET', 'find', package_name, version_selector)
     try:
       data = self._handle_response(response)
     except Error as exc:
       if exc.message == 'Package not found':
         raise PackageNotFound(package_name, version_selector)
       raise
+    return self._package_info(response, data)
+
+  def find_packages(self, queries):
+    """
+    Finds the best matching package for every `(package_name,
+    version_selector)` tuple in *queries*. Returns a list that contains a
+    #PackageInfo, or #None if the registry does not provide the package,
+    for every query.
+
+    All queries that can not be answered from the #metadata_cache are sent
+    in a single request to the `POST /api/find` endpoint if the registry
+    provides it, otherwise they are sent concurrently.
+    """
 
+    queries = list(queries)
+    for package_name, version_selector in queries:
+      argschema.validate('package_name', package_name, {'type': six.text_type})
+      argschema.validate('version_selector', version_selector,
+          {'type': semver.Selector})
+    if self.metadata_cache is None:
+      return self._fetch_packages(queries)
+
+    result = [None] * len(queries)
+    pending = []  # (index, query)
+    for index, (package_name, version_selector) in enumerate(queries):
+      try:
+        version = self._select_version(package_name, version_selector)
+      except PackageNotFound:
+        continue
+      if version is None:
+        pending.append((index, (package_name, version_selector)))
+        continue
+      result[index] = self._cached_package(package_name, version)
+      if result[index] is None:
+        pending.append((index, (package_name, semver.Selector(version))))
+    infos = self._fetch_packages([x[1] for x in pending])
+    for (index, _), info in zip(pending, infos):
+      result[index] = info
+    return result
+
+  def _fetch_packages(self, queries):
+    if not queries:
+      return []
+
+    if self._bulk_find is not False:
+      body = {'packages': [{'name': n, 'selector': str(s)} for n, s in queries]}
+      response = self._request('POST', 'find', json=body)
+      if response.status_code in (404, 405, 501):
+        self._bulk_find = False
+      else:
+        data = self._handle_response(response)
+        self._bulk_find = True
+        result = []
+        for item in data['packages']:
+          if 'error' in item:
+            if item['error'] != 'Package not found':
+              raise Error(response, str(item['error']))
+            result.append(None)
+          else:
+            result.append(self._package_info(response, item))
+        return result
+
+    def find(query):
+      try:
+        return self._fetch_package(*query)
+      except PackageNotFound:
+        return None
+
+    pool = ThreadPool(min(len(queries), self.max_connections))
     try:
-      # TODO: Pass config props to parse_dict()
-      return manifest.parse_dict(data, [], None, None, copy=False)
-    except manifest.InvalidPackageManifest as exc:
-      raise Error(response, 'Invalid package manifest ({})'.format(exc), data)
+      return pool.map(find, queries)
+    finally:
+      pool.close()
+      pool.join()
+
+  def _select_version(self, package_name, version_selector):
+    """
+    Returns the best version from the version list of the package that
+    matches *version_selector*, or #None if the registry can not list the
+    versions. Raises #PackageNotFound if no version matches.
+    """
+
+    versions = self.versions(package_name)
+    if versions is None:
+      return None
+    version = version_selector.best_of(versions)
+    if version is None:
+      raise PackageNotFound(package_name, version_selector)
+    return version
+
+  def _cached_package(self, package_name, version):
+    index = self._get_index()
+    data = index.manifest(package_name, version) if index is not None else None
+    if data is None:
+      data = self.metadata_cache.get_manifest(self.base_url, package_name, version)
+    if data is None:
+      return None
+    mf = manifest.Manifest(None, data)
+    return PackageInfo(mf['name'], semver.Version(mf['version']), mf)
+
+  def _package_info(self, response, data):
+    mf = manifest.Manifest(None, data)
+    if 'name' not in mf or 'version' not in mf or \
+        any(f.errors for f in manifest.validate(mf)):
+      raise Error(response, 'Invalid package manifest', data)
+    if self.metadata_cache is not None:
+      self.metadata_cache.set_manifest(self.base_url, mf['name'], mf['version'], data)
+    return PackageInfo(mf['name'], semver.Version(mf['version']), mf)
+
+  def versions(self, package_name):
+    """
+    Returns a list of all #semver.Version#s that the registry provides for
+    the package *package_name*. Raises #PackageNotFound if the registry
+    does not know the package. Returns #None if the registry does not
+    support listing the versions of a package.
+
+    With a #metadata_cache, the registry index is used if it has been
+    synced, a package that is not in the index does not exist. Otherwise a
+    fresh cached answer is returned without contacting the registry, and a
+    stale one is revalidated with its ETag.
+    """
+
+    argschema.validate('package_name', package_name, {'type': six.text_type})
+
+    index = self._get_index()
+    if index is not None:
+      versions = index.versions(package_name)
+      if versions is None:
+        raise PackageNotFound(package_name, semver.Selector('*'))
+      return [semver.Version(x) for x in versions]
+
+    cache = self.metadata_cache
+    entry = cache.get_versions(self.base_url, package_name) if cache else None
+    headers = {}
+    if entry is not None:
+      if cache.is_fresh(entry['fetched']):
+        return self._cached_versions(package_name, entry)
+      if entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+
+    response = self._request('GET', 'versions', package_name, headers=headers)
+    if entry is not None and response.status_code == 304:
+      cache.set_versions(self.base_url, package_name, entry['status'],
+        entry['versions'], entry['etag'])
+      return self._cached_versions(package_name, entry)
+
+    etag = response.headers.get('ETag')
+    try:
+      data = self._handle_response(response)
+    except Error as exc:
+      if exc.message == 'Package not found':
+        if cache:
+          cache.set_versions(self.base_url, package_name, 'not-found', etag=etag)
+        raise PackageNotFound(package_name, semver.Selector('*'))
+      if response.status_code in (404, 405, 501):
+        if cache:
+          cache.set_versions(self.base_url, package_name, 'unsupported')
+        return None
+      raise
+    if cache:
+      cache.set_versions(self.base_url, package_name, 'ok', data['versions'], etag)
+    return [semver.Version(x) for x in data['versions']]
+
+  def _cached_versions(self, package_name, entry):
+    if entry['status'] == 'not-found':
+      raise PackageNotFound(package_name, semver.Selector('*'))
+    if entry['status'] == 'unsupported':
+      return None
+    return [semver.Version(x) for x in entry['versions']]
 
   def upload(self, package_name, version, filename, force=False):
     """
@@ -245,7 +549,7 @@ class RegistryClient(object):
     with open(filename, 'rb') as fp:
       files = {os.path.basename(filename): fp}
       params = {'force': 'true' if force else 'false'}
-      response = self.api.upload(package_name, version).POST(
+      response = self._request('POST', 'upload', package_name, version,
           files=files, params=params, auth=(self.username, self.password))
 
     data = self._handle_response(response)
@@ -257,7 +561,7 @@ class RegistryClient(object):
     """
 
     data = {'username': username, 'password': password, 'email': email}
-    response = self.api.register().POST(data=data)
+    response = self._request('POST', 'register', data=data)
     data = self._handle_response(response)
     return data.get('message')
 
@@ -266,4 +570,4 @@ class RegistryClient(object):
     Downloads the Terms of Use from the registry.
     """
 
-    return self._handle_response(self.api.terms.GET())['terms']
+    return self._handle_response(self._request('GET', 'terms'))['terms']
@@ -0,0 +1,220 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+from six.moves import BaseHTTPServer, socketserver, urllib
+import json
+import shutil
+import tempfile
+import threading
+import semver from './semver'
+import {MetadataCache} from './metacache'
+import {PackageNotFound, RegistryClient} from './registry'
+
+packages = {'a': ['1.0.0', '1.1.0'], 'b': ['2.0.0']}
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+
+  def reply(self, status, data, headers=None):
+    body = json.dumps(data).encode('utf8')
+    self.send_response(status)
+    for key, value in (headers or {}).items():
+      self.send_header(key, value)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def find(self, name, selector):
+    versions = [semver.Version(x) for x in packages.get(name, [])]
+    version = semver.Selector(selector).best_of(versions)
+    if version is None:
+      return {'error': 'Package not found'}
+    return {'name': name, 'version': str(version)}
+
+  def do_GET(self):
+    with self.server.lock:
+      self.server.requests.append(('GET', self.path))
+      self.server.clients.add(self.client_address)
+    parts = [urllib.parse.unquote(x) for x in self.path.split('/')]
+    if parts[1:3] == ['api', 'find']:
+      data = self.find(parts[3], parts[4])
+      self.reply(400 if 'error' in data else 200, data)
+    elif parts[1].startswith('api') and parts[2].startswith('index'):
+      query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+      since = query.get('since', [None])[0]
+      header = {'serial': self.server.serial, 'full': since is None}
+      lines = [header] + (self.server.changes if since else [
+        {'name': k, 'versions': dict((v, self.find(k, v)) for v in vs)}
+        for k, vs in sorted(packages.items())])
+      body = ''.join(json.dumps(x) + '\n' for x in lines).encode('utf8')
+      self.send_response(200)
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+    elif parts[1:3] == ['api', 'versions'] and parts[3] in packages:
+      etag = '"{}"'.format(len(packages[parts[3]]))
+      if self.headers.get('If-None-Match') == etag:
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+      else:
+        self.reply(200, {'versions': packages[parts[3]]}, {'ETag': etag})
+    else:
+      self.reply(404, {'error': 'Not found'})
+
+  def do_POST(self):
+    body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf8'))
+    with self.server.lock:
+      self.server.requests.append(('POST', self.path))
+      self.server.clients.add(self.client_address)
+    if not self.server.bulk or self.path != '/api/find':
+      self.reply(405, {'error': 'Method not allowed'})
+      return
+    self.reply(200, {'packages': [self.find(x['name'], x['selector']) for x in body['packages']]})
+
+  def log_message(self, *args):
+    pass
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+def start_server(bulk):
+  server = Server(('127.0.0.1', 0), Handler)
+  server.bulk = bulk
+  server.lock = threading.Lock()
+  server.requests = []
+  server.clients = set()
+  server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+def run_queries(bulk, max_connections=4):
+  server = start_server(bulk)
+  client = RegistryClient('test', server.url, max_connections=max_connections)
+  try:
+    queries = [('a', semver.Selector('~1.0.0')), ('c', semver.Selector('*')),
+      ('b', semver.Selector('>=2.0.0')), ('a', semver.Selector('*'))]
+    result = client.find_packages(queries)
+    result += client.find_packages(queries)
+  finally:
+    client.close()
+    server.shutdown()
+    server.server_close()
+  assert_equals([x and x.identifier for x in result], ['a@1.0.0', None, 'b@2.0.0', 'a@1.1.0'] * 2)
+  return server
+
+
+def test_find_packages_bulk():
+  server = run_queries(bulk=True)
+  assert_equals(server.requests, [('POST', '/api/find')] * 2)
+  assert_equals(len(server.clients), 1)
+
+
+def test_find_packages_fallback():
+  server = run_queries(bulk=False, max_connections=2)
+  # The bulk endpoint is only tried once.
+  assert_equals(server.requests.count(('POST', '/api/find')), 1)
+  assert_equals(len(server.requests), 9)
+  # Connections are kept alive and limited to max_connections.
+  assert len(server.clients) <= 2, server.clients
+
+
+def test_metadata_cache():
+  server = start_server(bulk=False)
+  cache = MetadataCache(tempfile.mkdtemp(suffix='_metadata'), ttl=60)
+  def find(selector):
+    client = RegistryClient('test', server.url, metadata_cache=cache)
+    try:
+      del server.requests[:]
+      return client.find_package('a', semver.Selector(selector)).identifier
+    finally:
+      client.close()
+  try:
+    # The version is chosen locally and only its manifest is fetched.
+    assert_equals(find('~1.0.0'), 'a@1.0.0')
+    assert_equals(server.requests, [('GET', '/api/versions/a'), ('GET', '/api/find/a/=1.0.0')])
+    # Fresh entries are served without any request.
+    assert_equals(find('>=1.0.0'), 'a@1.1.0')
+    assert_equals(server.requests, [('GET', '/api/find/a/=1.1.0')])
+    assert_equals(find('~1.0.0'), 'a@1.0.0')
+    assert_equals(server.requests, [])
+    # Stale entries are revalidated.
+    cache.ttl = 0
+    assert_equals(find('~1.1.0'), 'a@1.1.0')
+    assert_equals(server.requests, [('GET', '/api/versions/a')])
+    assert_equals(cache.get_versions(server.url, 'a')['etag'], '"2"')
+  finally:
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(cache.directory)
+
+
+def test_registry_index():
+  server = start_server(bulk=False)
+  server.serial = 1
+  cache = MetadataCache(tempfile.mkdtemp(suffix='_metadata'), ttl=60)
+  client = RegistryClient('test', server.url, metadata_cache=cache)
+  try:
+    index, count = client.sync_index()
+    assert_equals(count, 2)
+    assert_equals(server.requests, [('GET', '/api/index')])
+    # Packages in the index are found without any request.
+    del server.requests[:]
+    assert_equals(client.find_package('a', semver.Selector('~1.0.0')).identifier, 'a@1.0.0')
+    assert_equals(client.versions('b'), [semver.Version('2.0.0')])
+    # Packages that are not in the index do not exist.
+    with assert_raises(PackageNotFound):
+      client.find_package('c', semver.Selector('*'))
+    assert_equals(client.find_packages([('c', semver.Selector('*'))]), [None])
+    assert_equals(server.requests, [])
+
+    server.serial = 2
+    server.changes = [{'name': 'b', 'deleted': True},
+      {'name': 'a', 'versions': {'1.0.0': {'name': 'a', 'version': '1.0.0'},
+                                 '1.2.0': {'name': 'a', 'version': '1.2.0'}}}]
+    index, count = client.sync_index()
+    assert_equals(count, 2)
+    assert_equals(server.requests, [('GET', '/api/index?since=1')])
+    assert_equals(sorted(index.packages), ['a'])
+
+    # The index is stored sorted and survives a new client.
+    client.close()
+    client = RegistryClient('test', server.url, metadata_cache=cache)
+    del server.requests[:]
+    assert_equals(client.find_package('a', semver.Selector('>=1.0.0')).identifier, 'a@1.2.0')
+    assert_equals(server.requests, [])
+    assert_equals(client._get_index().serial, 2)
+  finally:
+    client.close()
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(cache.directory)
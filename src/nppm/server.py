@@ -0,0 +1,479 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+A small package registry server on top of the standard library's HTTP
+server that serves the package distribution archives in a directory, eg.
+to mirror a registry in a network without internet access or to test
+installs against a deterministic registry. Started with `nppm registry
+serve <directory>`.
+
+The server implements the endpoints that the #registry.RegistryClient
+uses. Package archives may be stored anywhere in the directory; their
+names and versions are read from the `nodepy.json` in the archives when
+the server starts.
+
+    GET  /api/find/<name>/<selector>
+    POST /api/find                      {"packages": [{"name", "selector"}]}
+    GET  /api/versions/<name>           {"versions": [...]}
+    GET  /api/download/<name>/<version>/<filename>
+    GET  /api/index[?since=<serial>]    JSON lines, see #metacache.RegistryIndex
+    POST /api/upload/<name>/<version>   multipart/form-data, HTTP Basic auth
+    POST /api/register
+    GET  /api/terms
+
+All responses carry an `ETag` and `If-None-Match` requests are answered
+with `304 Not Modified`. Downloads support single `Range` requests.
+"""
+
+import base64
+import collections
+import email
+import hashlib
+import os
+import re
+import shutil
+import six
+import tarfile
+import tempfile
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver, urllib
+
+import env from './env'
+import semver from './semver'
+import {get_package_archive_name} from './registry'
+import json from './util/json'
+
+
+class Archive(collections.namedtuple('Archive', 'name version manifest filename sha256 size mtime')):
+  """
+  A package distribution archive in a #PackageStore.
+  """
+
+
+class PackageStore(object):
+  """
+  Indexes the package distribution archives in *directory*. The version
+  index is built once when the store is created and is updated by #add().
+
+  Every change increases the #serial. The package names that changed since
+  a serial are recorded so that clients can sync their #RegistryIndex
+  incrementally. The serial starts at the current time in milliseconds so
+  that serials of a previous server process are never mistaken for the
+  current state.
+
+  The store is used by the threads of the #Server, the indexes are only
+  accessed with the #lock held.
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.packages = {}  # name -> {version string: Archive}
+    self.files = {}  # (name, version, filename) -> path of additional files
+    self.serial = int(time.time() * 1000)
+    self.first_serial = self.serial
+    self.changes = []  # (serial, name)
+    self.lock = threading.RLock()
+    self._scan()
+
+  def _scan(self):
+    for root, dirs, files in os.walk(self.directory):
+      dirs[:] = [x for x in dirs if not x.startswith('.')]
+      for filename in files:
+        path = os.path.join(root, filename)
+        if filename.endswith('.tar.gz'):
+          try:
+            archive = self._read_archive(path)
+          except (IOError, OSError, ValueError, KeyError, tarfile.TarError) as exc:
+            print('  Warning: skipping "{}": {}'.format(path, exc))
+            continue
+          if archive is not None:
+            self.packages.setdefault(archive.name, {})[str(archive.version)] = archive
+        else:
+          parts = os.path.relpath(path, self.directory).split(os.sep)
+          if len(parts) >= 4 and parts[0] == 'files':
+            key = ('/'.join(parts[1:-2]), parts[-2], parts[-1])
+            self.files[key] = path
+
+  def _read_archive(self, filename):
+    """
+    Reads the manifest from the archive *filename* and returns an #Archive,
+    or #None if the file contains no package manifest.
+    """
+
+    with tarfile.open(filename) as tar:
+      try:
+        member = tar.getmember(env.PACKAGE_MANIFEST)
+      except KeyError:
+        return None
+      data = json.loads(tar.extractfile(member).read().decode('utf8'),
+        object_pairs_hook=collections.OrderedDict)
+    hasher = hashlib.sha256()
+    with open(filename, 'rb') as fp:
+      for chunk in iter(lambda: fp.read(64 * 1024), b''):
+        hasher.update(chunk)
+    stat = os.stat(filename)
+    return Archive(data['name'], semver.Version(data['version']), data,
+      filename, hasher.hexdigest(), stat.st_size, stat.st_mtime)
+
+  def versions(self, name):
+    with self.lock:
+      return sorted((x.version for x in self.packages.get(name, {}).values()), reverse=True)
+
+  def find(self, name, selector):
+    """
+    Returns the #Archive of the best version of *name* that matches the
+    #semver.Selector *selector*, or #None.
+    """
+
+    with self.lock:
+      version = selector.best_of(self.versions(name))
+      if version is None:
+        return None
+      return self.packages[name][str(version)]
+
+  def get(self, name, version, filename):
+    """
+    Returns the path of a file of a package version, or #None.
+    """
+
+    with self.lock:
+      archive = self.packages.get(name, {}).get(version)
+      if archive is not None and filename == os.path.basename(archive.filename):
+        return archive.filename
+      return self.files.get((name, version, filename))
+
+  def add(self, name, version, filename, fp, force=False):
+    """
+    Stores the file *filename* with the contents of the file-like object
+    *fp* for a package version. The package distribution archive must
+    contain a manifest with the same name and version. Raises a
+    #ValueError if the file is invalid or already exists without *force*.
+    The file is received and checked before the #lock is taken.
+    """
+
+    if not filename or '/' in filename or '\\' in filename or filename.startswith('.'):
+      raise ValueError('Invalid filename')
+    version = str(semver.Version(version))
+    is_archive = filename == get_package_archive_name(six.text_type(name), version)
+    if is_archive:
+      target = os.path.join(self.directory, filename)
+    else:
+      with self.lock:
+        if version not in self.packages.get(name, {}):
+          raise ValueError('Package distribution must be uploaded first')
+      target = os.path.join(self.directory, 'files', name.replace('/', os.sep), version, filename)
+
+    if os.path.exists(target) and not force:
+      raise ValueError('File already exists')
+    with self.lock:
+      if not os.path.isdir(os.path.dirname(target)):
+        os.makedirs(os.path.dirname(target))
+    fd, tmpname = tempfile.mkstemp(prefix='.', suffix='.upload', dir=os.path.dirname(target))
+    try:
+      with os.fdopen(fd, 'wb') as dst:
+        shutil.copyfileobj(fp, dst)
+      if is_archive:
+        archive = self._read_archive(tmpname)
+        if archive is None or archive.name != name or str(archive.version) != version:
+          raise ValueError('Archive does not contain the manifest of "{}@{}"'.format(name, version))
+    except:
+      os.remove(tmpname)
+      raise
+
+    with self.lock:
+      try:
+        if os.path.exists(target) and not force:
+          raise ValueError('File already exists')
+        if os.name == 'nt' and os.path.isfile(target):
+          os.remove(target)
+        os.rename(tmpname, target)
+      except:
+        os.remove(tmpname)
+        raise
+
+      if is_archive:
+        self.packages.setdefault(name, {})[version] = archive._replace(filename=target)
+        self.serial += 1
+        self.changes.append((self.serial, name))
+      else:
+        self.files[(name, version, filename)] = target
+
+  def index_lines(self, since=None):
+    """
+    Returns the JSON lines of the index, or only of the packages that
+    changed after the serial *since* if it is known to this store.
+    """
+
+    with self.lock:
+      full = since is None or since < self.first_serial or since > self.serial
+      if full:
+        names = sorted(self.packages)
+      else:
+        names = sorted(set(n for s, n in self.changes if s > since))
+      lines = [json.dumps({'serial': self.serial, 'full': full})]
+      for name in names:
+        versions = dict((k, v.manifest) for k, v in self.packages[name].items())
+        lines.append(json.dumps({'name': name, 'versions': versions}, sort_keys=True))
+    return lines
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  Handles the registry API requests for a #RegistryServer.
+  """
+
+  protocol_version = 'HTTP/1.1'
+  server_version = 'nppm-registry'
+
+  def log_message(self, format, *args):
+    if not self.server.quiet:
+      BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+  def _split_path(self):
+    url = urllib.parse.urlsplit(self.path)
+    parts = [urllib.parse.unquote(x) for x in url.path.split('/') if x]
+    if not parts or parts[0] != 'api':
+      return None, urllib.parse.parse_qs(url.query)
+    return parts[1:], urllib.parse.parse_qs(url.query)
+
+  def _send_body(self, status, body, content_type, headers=(), etag=None):
+    if etag is None:
+      etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+    if status == 200 and self.headers.get('If-None-Match') == etag:
+      self.send_response(304)
+      self.send_header('ETag', etag)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('ETag', etag)
+    for key, value in headers:
+      self.send_header(key, value)
+    self.end_headers()
+    if self.command != 'HEAD':
+      self.wfile.write(body)
+
+  def send_json(self, data, status=200):
+    body = json.dumps(data).encode('utf8')
+    self._send_body(status, body, 'application/json')
+
+  def send_error_json(self, status, message):
+    self.send_json({'error': message}, status)
+
+  def do_GET(self):
+    parts, query = self._split_path()
+    if not parts:
+      self.send_error_json(404, 'Not found')
+    elif parts[0] == 'find' and len(parts) >= 3:
+      self.handle_find('/'.join(parts[1:-1]), parts[-1])
+    elif parts[0] == 'versions' and len(parts) >= 2:
+      self.handle_versions('/'.join(parts[1:]))
+    elif parts[0] == 'download' and len(parts) >= 4:
+      self.handle_download('/'.join(parts[1:-2]), parts[-2], parts[-1])
+    elif parts == ['index']:
+      self.handle_index(query.get('since', [None])[0])
+    elif parts == ['terms']:
+      self.send_json({'terms': self.server.terms})
+    else:
+      self.send_error_json(404, 'Not found')
+
+  do_HEAD = do_GET
+
+  def do_POST(self):
+    parts, query = self._split_path()
+    length = int(self.headers.get('Content-Length') or 0)
+    body = self.rfile.read(length)
+    if parts == ['find']:
+      self.handle_bulk_find(body)
+    elif parts and parts[0] == 'upload' and len(parts) >= 3:
+      self.handle_upload('/'.join(parts[1:-1]), parts[-1], body, query)
+    elif parts == ['register']:
+      self.send_error_json(501, 'This registry does not support registration')
+    else:
+      self.send_error_json(404, 'Not found')
+
+  def _find(self, name, selector):
+    try:
+      selector = semver.Selector(selector)
+    except ValueError as exc:
+      return None, str(exc)
+    archive = self.server.store.find(name, selector)
+    if archive is None:
+      return None, 'Package not found'
+    return archive, None
+
+  def handle_find(self, name, selector):
+    archive, error = self._find(name, selector)
+    if error:
+      self.send_error_json(404 if error == 'Package not found' else 400, error)
+    else:
+      self.send_json(archive.manifest)
+
+  def handle_bulk_find(self, body):
+    try:
+      queries = json.loads(body.decode('utf8'))['packages']
+    except (ValueError, KeyError, TypeError):
+      self.send_error_json(400, 'Invalid request')
+      return
+    result = []
+    for query in queries:
+      archive, error = self._find(query.get('name'), query.get('selector', '*'))
+      result.append({'error': error} if error else archive.manifest)
+    self.send_json({'packages': result})
+
+  def handle_versions(self, name):
+    versions = self.server.store.versions(name)
+    if not versions:
+      self.send_error_json(404, 'Package not found')
+    else:
+      self.send_json({'versions': [str(x) for x in versions]})
+
+  def handle_index(self, since):
+    try:
+      since = None if since is None else int(since)
+    except ValueError:
+      self.send_error_json(400, 'Invalid serial')
+      return
+    lines = self.server.store.index_lines(since)
+    body = ('\n'.join(lines) + '\n').encode('utf8')
+    self._send_body(200, body, 'application/x-ndjson')
+
+  def handle_download(self, name, version, filename):
+    path = self.server.store.get(name, version, filename)
+    if path is None or not os.path.isfile(path):
+      self.send_error_json(404, 'File not found')
+      return
+    stat = os.stat(path)
+    etag = '"{}-{}"'.format(int(stat.st_mtime), stat.st_size)
+    if self.headers.get('If-None-Match') == etag:
+      self.send_response(304)
+      self.send_header('ETag', etag)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+
+    start, end = 0, stat.st_size - 1
+    status = 200
+    range_header = self.headers.get('Range')
+    if range_header and self.headers.get('If-Range', etag) == etag:
+      match = re.match(r'^bytes=(\d*)-(\d*)$', range_header.strip())
+      if match and (match.group(1) or match.group(2)):
+        if match.group(1):
+          start = int(match.group(1))
+          if match.group(2):
+            end = min(int(match.group(2)), end)
+        else:
+          start = max(0, stat.st_size - int(match.group(2)))
+        if start >= stat.st_size or start > end:
+          self.send_response(416)
+          self.send_header('Content-Range', 'bytes */{}'.format(stat.st_size))
+          self.send_header('Content-Length', '0')
+          self.end_headers()
+          return
+        status = 206
+
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/gzip')
+    self.send_header('Content-Length', str(end - start + 1))
+    self.send_header('Content-Disposition', 'attachment; filename="{}"'.format(filename))
+    self.send_header('Accept-Ranges', 'bytes')
+    self.send_header('ETag', etag)
+    self.send_header('Last-Modified', self.date_time_string(stat.st_mtime))
+    if status == 206:
+      self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, stat.st_size))
+    self.end_headers()
+    if self.command == 'HEAD':
+      return
+    with open(path, 'rb') as fp:
+      fp.seek(start)
+      remaining = end - start + 1
+      while remaining > 0:
+        data = fp.read(min(remaining, 256 * 1024))
+        if not data:
+          break
+        self.wfile.write(data)
+        remaining -= len(data)
+
+  def _check_auth(self):
+    if not self.server.auth:
+      return False
+    header = self.headers.get('Authorization', '')
+    if not header.startswith('Basic '):
+      return False
+    try:
+      credentials = base64.b64decode(header[6:].encode('ascii')).decode('utf8')
+    except (ValueError, TypeError):
+      return False
+    return credentials == self.server.auth
+
+  def handle_upload(self, name, version, body, query):
+    if not self._check_auth():
+      self.send_error_json(401 if self.server.auth else 403, 'Unauthorized'
+        if self.server.auth else 'This registry does not accept uploads')
+      return
+    content_type = self.headers.get('Content-Type', '')
+    header = 'Content-Type: {}\r\nMIME-Version: 1.0\r\n\r\n'.format(content_type).encode('utf8')
+    if six.PY2:
+      message = email.message_from_string(header + body)
+    else:
+      message = email.message_from_bytes(header + body)
+    files = [x for x in message.get_payload() if x.get_filename()] \
+      if message.is_multipart() else []
+    if len(files) != 1:
+      self.send_error_json(400, 'Expected exactly one file')
+      return
+    force = query.get('force', ['false'])[0] == 'true'
+    data = files[0].get_payload(decode=True)
+    try:
+      self.server.store.add(name, version, files[0].get_filename(), six.BytesIO(data), force)
+    except ValueError as exc:
+      self.send_error_json(400, str(exc))
+      return
+    self.send_json({'message': 'File uploaded to "{}@{}"'.format(name, version)})
+
+
+class RegistryServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """
+  A threaded HTTP server for the packages in a #PackageStore. *auth* is a
+  `user:password` string that is required to upload files. Without it, the
+  registry is read-only.
+  """
+
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, address, store, auth=None, terms=None, quiet=False):
+    BaseHTTPServer.HTTPServer.__init__(self, address, RequestHandler)
+    self.store = store
+    self.auth = auth
+    self.terms = terms or 'This registry is served by `nppm registry serve`.'
+    self.quiet = quiet
+
+  @property
+  def url(self):
+    host, port = self.server_address[:2]
+    return 'http://{}:{}'.format(host, port)
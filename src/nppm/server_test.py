@@ -0,0 +1,179 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import requests
+import semver from './semver'
+import {Installer} from './install'
+import {InstalledDatabase} from './installdb'
+import {MetadataCache} from './metacache'
+import {RegistryClient, get_package_archive_name} from './registry'
+import {PackageStore, RegistryServer} from './server'
+import _download from './util/download'
+
+
+def write_archive(directory, name, version, files=None, **fields):
+  data = dict(fields, name=name, version=version)
+  filename = os.path.join(directory, get_package_archive_name(name, version))
+  with tarfile.open(filename, 'w:gz') as tar:
+    for rel, content in [('nodepy.json', json.dumps(data).encode('utf8'))] + list((files or {}).items()):
+      info = tarfile.TarInfo(rel)
+      info.size = len(content)
+      tar.addfile(info, io.BytesIO(content))
+  return filename
+
+
+def with_registry(func):
+  def wrapper():
+    directory = tempfile.mkdtemp(suffix='_registry')
+    write_archive(directory, 'a', '1.0.0', dependencies={'b': '~1.0.0'})
+    write_archive(directory, 'a', '1.1.0', dependencies={'b': '>=2.0.0'})
+    write_archive(directory, 'b', '1.0.2', files={'index.py': b'x = 1\n'})
+    os.makedirs(os.path.join(directory, 'sub'))
+    write_archive(os.path.join(directory, 'sub'), '@scope/c', '0.1.0')
+    server = RegistryServer(('127.0.0.1', 0), PackageStore(directory), 'user:secret', quiet=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    client = RegistryClient('local', server.url)
+    try:
+      func(server, client)
+    finally:
+      client.close()
+      server.shutdown()
+      server.server_close()
+      shutil.rmtree(directory)
+  wrapper.__name__ = func.__name__
+  return wrapper
+
+
+@with_registry
+def test_find(server, client):
+  assert_equals(client.versions('a'), [semver.Version('1.1.0'), semver.Version('1.0.0')])
+  assert_equals(client.find_package('a', semver.Selector('~1.0.0')).identifier, 'a@1.0.0')
+  assert_equals(client.find_package('@scope/c', semver.Selector('*')).identifier, '@scope/c@0.1.0')
+  result = client.find_packages([('a', semver.Selector('*')), ('x', semver.Selector('*')),
+    ('b', semver.Selector('~1.0.0'))])
+  assert_equals([x and x.identifier for x in result], ['a@1.1.0', None, 'b@1.0.2'])
+  assert client._bulk_find
+  assert 'nppm registry serve' in client.terms()
+
+
+@with_registry
+def test_conditional_requests(server, client):
+  url = server.url + '/api/versions/a'
+  response = requests.get(url)
+  etag = response.headers['ETag']
+  response = requests.get(url, headers={'If-None-Match': etag})
+  assert_equals(response.status_code, 304)
+
+  url = server.url + '/api/download/b/1.0.2/b-1.0.2.tar.gz'
+  full = requests.get(url)
+  assert_equals(full.headers['Accept-Ranges'], 'bytes')
+  response = requests.get(url, headers={'If-None-Match': full.headers['ETag']})
+  assert_equals(response.status_code, 304)
+  response = requests.get(url, headers={'Range': 'bytes=10-'})
+  assert_equals(response.status_code, 206)
+  assert_equals(response.content, full.content[10:])
+  response = requests.get(url, headers={'Range': 'bytes=-5'})
+  assert_equals(response.content, full.content[-5:])
+  response = requests.get(url, headers={'Range': 'bytes={}-'.format(len(full.content))})
+  assert_equals(response.status_code, 416)
+
+  # Resumed downloads through the download engine.
+  fp = io.BytesIO()
+  reader = _download.download(lambda headers: client.download(
+    'b', semver.Version('1.0.2'), headers=headers), fp)
+  assert_equals(fp.getvalue(), full.content)
+  assert_equals(reader.size, len(full.content))
+
+
+@with_registry
+def test_index_and_upload(server, client):
+  client.metadata_cache = MetadataCache(tempfile.mkdtemp(suffix='_metadata'))
+  try:
+    index, count = client.sync_index()
+    assert_equals(count, 3)
+    assert_equals(index.versions('b'), ['1.0.2'])
+
+    source = tempfile.mkdtemp()
+    try:
+      filename = write_archive(source, 'b', '2.0.0')
+      client.username, client.password = 'user', 'wrong'
+      with assert_raises(Exception):
+        client.upload('b', semver.Version('2.0.0'), filename)
+      client.username, client.password = 'user', 'secret'
+      client.upload('b', semver.Version('2.0.0'), filename)
+      with assert_raises(Exception):
+        client.upload('b', semver.Version('2.0.0'), filename)
+      client.upload('b', semver.Version('2.0.0'), filename, force=True)
+    finally:
+      shutil.rmtree(source)
+
+    # Only the changed package is sent.
+    index, count = client.sync_index()
+    assert_equals(count, 1)
+    assert_equals(sorted(index.versions('b')), ['1.0.2', '2.0.0'])
+    assert_equals(client.find_package('a', semver.Selector('*')).identifier, 'a@1.1.0')
+  finally:
+    shutil.rmtree(client.metadata_cache.directory)
+
+
+@with_registry
+def test_store_reads_while_adding(server, client):
+  # The indexes are only read with the lock held, add() changes them under
+  # the lock from another thread.
+  store = server.store
+  results = []
+  calls = [lambda: store.versions('a'), lambda: store.find('a', semver.Selector('*')),
+    lambda: store.get('b', '1.0.2', 'b-1.0.2.tar.gz'), lambda: store.index_lines()]
+  with store.lock:
+    threads = [threading.Thread(target=lambda f=f: results.append(f())) for f in calls]
+    for thread in threads:
+      thread.start()
+      thread.join(0.05)
+    assert_equals(results, [])
+  for thread in threads:
+    thread.join()
+  assert_equals(len(results), 4)
+
+
+@with_registry
+def test_install(server, client):
+  installer = Installer(registry=client, jobs=2)
+  directory = tempfile.mkdtemp(suffix='_nodepy')
+  installer.dirs['packages'] = os.path.join(directory, 'modules')
+  installer.db = InstalledDatabase(os.path.join(directory, 'installed.db'))
+  try:
+    assert installer.install_from_registry(u'a', semver.Selector('~1.0.0'))[0]
+    with open(os.path.join(installer.dirs['packages'], 'b', 'index.py')) as fp:
+      assert_equals(fp.read(), 'x = 1\n')
+  finally:
+    installer.close()
+    shutil.rmtree(directory)
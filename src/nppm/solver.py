@@ -0,0 +1,402 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+A backtracking solver for the registry dependencies of a package tree.
+
+The #Solver collects the #manifest.Requirement objects of every package in the
+tree and chooses one version per package name that satisfies all selectors
+that point to that name. Versions are tried newest first. Packages can be
+fixed to a version (eg. the installed one) that the solver must keep. When
+the selectors of a package can not be satisfied anymore, the solver goes
+back to the last package that had another candidate version.
+"""
+
+import collections
+
+import env from './env'
+import manifest from './manifest'
+import semver from './semver'
+import _registry from './registry'
+
+
+class Constraint(collections.namedtuple('Constraint', 'selector parent')):
+  """
+  A selector for a package and the identifier of the package that requires
+  it (or #None if it is required by the package that is being installed).
+  """
+
+  def __str__(self):
+    return '{} (required by {})'.format(self.selector, self.parent or 'root')
+
+  @property
+  def key(self):
+    return (str(self.selector), self.parent)
+
+  @property
+  def parent_name(self):
+    return self.parent.rpartition('@')[0] if self.parent else None
+
+
+class SolveError(Exception):
+  """
+  Raised by #Solver.solve() when there is no set of versions that satisfies
+  all requirements. Describes the first conflict that was encountered.
+
+  # Parameters
+  name (str): The name of the package that could not be satisfied.
+  constraints (list of Constraint): All constraints for the package.
+  versions (list of semver.Version): The versions that are available.
+  fixed (semver.Version): The version that the package is fixed to, or #None.
+  """
+
+  def __init__(self, name, constraints, versions, fixed=None):
+    self.name = name
+    self.constraints = constraints
+    self.versions = versions
+    self.fixed = fixed
+
+  def __str__(self):
+    if not self.versions and self.fixed is None:
+      lines = ['package "{}" could not be located'.format(self.name)]
+    else:
+      lines = ['no version of "{}" satisfies all requirements'.format(self.name)]
+    for constraint in self.constraints:
+      lines.append('  {}@{}'.format(self.name, constraint))
+    if self.fixed is not None:
+      lines.append('  installed: {}'.format(self.fixed))
+    elif self.versions:
+      lines.append('  available: ' + ', '.join(map(str, sorted(self.versions))))
+    return '\n'.join(lines)
+
+
+class Solution(object):
+  """
+  The result of #Solver.solve().
+
+  # Attributes
+  packages (collections.OrderedDict): Maps the package names to the
+    #_registry.PackageInfo of the chosen version, in the order that they
+    were chosen in. Fixed packages are not included.
+  registries (dict): Maps the package names to the
+    #_registry.RegistryClient that provides the chosen version.
+  requirements (list): A list of `(parent, requirement)` tuples for all
+    registry requirements in the solved tree.
+  """
+
+  def __init__(self, packages, registries, requirements):
+    self.packages = packages
+    self.registries = registries
+    self.requirements = requirements
+
+  def __iter__(self):
+    for name, info in self.packages.items():
+      yield self.registries[name], info
+
+
+class Solver(object):
+  """
+  Finds one version for every package in a dependency tree so that all
+  selectors are satisfied.
+
+  The version list and the manifest of every package version are fetched
+  at most once. The manifests of the best candidates for the dependencies
+  of a package version are fetched in a single batch (see
+  #_registry.RegistryClient.find_packages()).
+
+  When the search fails, the failure is explained by a set of facts: "the
+  chosen version of a package requires a selector for a dependency" and "a
+  package has a version assigned". The solver jumps back to the last
+  package that appears in the explanation, and remembers it so that other
+  branches with the same facts (eg. other versions of a package that
+  impose the same selectors in diamond shaped dependencies) fail without
+  being searched again.
+
+  Registries that do not support #_registry.RegistryClient.versions() only
+  offer the best match for each of the selectors of a package as candidates.
+
+  # Parameters
+  get_registries (callable): A function that returns the list of
+    #_registry.RegistryClient objects to look for a #manifest.Requirement in.
+  vars (dict): The variables to evaluate the dependencies in the package
+    manifests with. Defaults to `env.cfgvars(False)`.
+  preferred (callable): A function that returns the version of a package
+    that should be tried first (eg. the installed version) or #None.
+  fixed (callable): A function that returns the #manifest.PackageManifest
+    of the version that a package must keep (eg. the installed package
+    when not upgrading) or #None. The dependencies of a fixed package are
+    read from that manifest. Does not apply to the requirements passed to
+    #solve().
+  map (callable): A `map()` function that is used to fetch the version
+    lists of the dependencies of a package version. Pass the `map()` of
+    a #multiprocessing.pool.ThreadPool to fetch them concurrently.
+  """
+
+  def __init__(self, get_registries, vars=None, preferred=None, fixed=None, map=map):
+    self.get_registries = get_registries
+    self.vars = env.cfgvars(False) if vars is None else vars
+    self.preferred = preferred
+    self.fixed = fixed
+    self.map = map
+    self._sources = {}  # name -> (registry, versions)
+    self._infos = {}  # (name, version) -> PackageInfo
+    self._found = {}  # (name, selector) -> version or None
+    self._dependencies = {}  # (name, version) -> OrderedDict of Requirements
+    self._matching = {}  # (name, selectors) -> list of versions
+    self._failed = []  # list of frozensets of facts, see _search()
+    self._conflict = None
+    self._fixed = {}  # name -> version or None
+
+  @staticmethod
+  def registry_requirements(deps):
+    """
+    Parses the values in the dictionary *deps* to #manifest.Requirement objects
+    and returns an ordered dictionary of the registry requirements.
+    """
+
+    result = collections.OrderedDict()
+    for name, req in deps.items():
+      if not isinstance(req, manifest.Requirement):
+        req = manifest.Requirement.from_line(req, name=name)
+      if req.type == 'registry':
+        result[name] = req
+    return result
+
+  def _source(self, req):
+    """
+    Returns the registry that provides the package of the requirement *req*
+    and the list of its versions (or #None if the registry can not list
+    them). Returns `(None, [])` if no registry provides the package.
+    """
+
+    try:
+      return self._sources[req.name]
+    except KeyError:
+      pass
+    result = (None, [])
+    for registry in self.get_registries(req):
+      try:
+        versions = registry.versions(req.name)
+      except _registry.PackageNotFound:
+        continue
+      result = (registry, None if versions is None else sorted(versions, reverse=True))
+      break
+    return self._sources.setdefault(req.name, result)
+
+  def _find(self, registry, name, selector):
+    key = (name, str(selector))
+    if key not in self._found:
+      try:
+        info = registry.find_package(name, selector)
+      except _registry.PackageNotFound:
+        self._found[key] = None
+      else:
+        self._infos[(name, str(info.version))] = info
+        self._found[key] = info.version
+    return self._found[key]
+
+  def _get_fixed(self, name):
+    """
+    Returns the version that the package *name* is fixed to, or #None. The
+    dependencies of a fixed package are taken from its manifest.
+    """
+
+    if name not in self._fixed:
+      mf = self.fixed(name) if self.fixed else None
+      version = None
+      if mf is not None:
+        version = semver.Version(mf['version'])
+        deps = mf.eval_fields(self.vars, 'dependencies', {})
+        self._dependencies[(name, str(version))] = self.registry_requirements(deps)
+      self._fixed[name] = version
+    return self._fixed[name]
+
+  def _candidates(self, name, constraints):
+    """
+    Returns the versions of the package *name* that match all *constraints*,
+    the preferred version first and the others newest first. A fixed
+    package only has its fixed version as a candidate.
+    """
+
+    key = (name, frozenset(str(c.selector) for c in constraints))
+    if key in self._matching:
+      return self._matching[key]
+    fixed = self._get_fixed(name)
+    if fixed is not None:
+      result = [fixed] if all(c.selector(fixed) for c in constraints) else []
+      self._matching[key] = result
+      return result
+    registry, versions = self._sources[name]
+    if registry is not None and versions is None:
+      versions = set(self._find(registry, name, c.selector) for c in constraints)
+      versions = sorted((v for v in versions if v is not None), reverse=True)
+    result = [v for v in versions if all(c.selector(v) for c in constraints)]
+    preferred = self.preferred(name) if self.preferred else None
+    if preferred is not None and preferred in result:
+      result.remove(preferred)
+      result.insert(0, preferred)
+    self._matching[key] = result
+    return result
+
+  def _prefetch_infos(self, names, constraints):
+    """
+    Fetches the manifests of the best candidates of the packages *names*
+    with one #_registry.RegistryClient.find_packages() call per registry,
+    so that every level of the dependency tree costs only a few requests.
+    """
+
+    queries = collections.OrderedDict()  # registry -> [(name, selector)]
+    for name in names:
+      registry, versions = self._sources[name]
+      if registry is None or versions is None or not hasattr(registry, 'find_packages'):
+        continue
+      if self._get_fixed(name) is not None:
+        continue
+      candidates = self._candidates(name, constraints[name])
+      if candidates and (name, str(candidates[0])) not in self._infos:
+        queries.setdefault(registry, []).append((name, semver.Selector(candidates[0])))
+    for registry, items in queries.items():
+      for info in registry.find_packages(items):
+        if info is not None:
+          self._infos[(info.name, str(info.version))] = info
+
+  def _get_dependencies(self, name, version):
+    key = (name, str(version))
+    if key not in self._dependencies:
+      if key not in self._infos:
+        registry = self._sources[name][0]
+        self._infos[key] = registry.find_package(name, semver.Selector(version))
+      mf = self._infos[key].manifest
+      deps = mf.eval_fields(self.vars, 'dependencies', {})
+      self._dependencies[key] = self.registry_requirements(deps)
+    return self._dependencies[key]
+
+  def _add_conflict(self, name, constraints, versions):
+    if self._conflict is None:
+      self._conflict = SolveError(name, list(constraints), list(versions),
+        self._fixed.get(name))
+
+  @staticmethod
+  def _requirement_facts(name, constraints):
+    return set((name, str(c.selector), c.parent_name) for c in constraints)
+
+  def _fail(self, facts):
+    facts = frozenset(facts)
+    self._failed.append(facts)
+    return None, facts
+
+  def _search(self, assigned, constraints):
+    """
+    Returns `(assigned, None)` with the versions of all packages, or
+    `(None, facts)` with the set of facts that can not be satisfied
+    together. Facts are `(dep_name, selector, parent_name)` for the
+    requirements of the assigned packages and `(name, version)` for the
+    assigned versions.
+    """
+
+    pending = [n for n in constraints if n not in assigned]
+    if not pending:
+      return assigned, None
+
+    if self._failed:
+      state = set((k, str(v)) for k, v in assigned.items())
+      for n, v in constraints.items():
+        state.update(self._requirement_facts(n, v))
+      for facts in self._failed:
+        if facts <= state:
+          return None, facts
+
+    # Continue with the package that has the least candidates left.
+    options = {}
+    for n in pending:
+      options[n] = self._candidates(n, constraints[n])
+    name = min(pending, key=lambda n: (len(options[n]), n))
+    if not options[name]:
+      registry, versions = self._sources[name]
+      self._add_conflict(name, constraints[name], versions or options[name])
+      return self._fail(self._requirement_facts(name, constraints[name]))
+
+    # The facts that explain why no version of the package works.
+    explanation = self._requirement_facts(name, constraints[name])
+    for version in options[name]:
+      deps = self._get_dependencies(name, version)
+      list(self.map(self._source, [r for r in deps.values() if r.name not in self._sources]))
+      parent = '{}@{}'.format(name, version)
+      new_assigned = collections.OrderedDict(assigned)
+      new_assigned[name] = version
+      new_constraints = dict(constraints)
+      facts = None
+      for dep_name, req in deps.items():
+        constraint = Constraint(req.selector, parent)
+        new_constraints[dep_name] = constraints.get(dep_name, ()) + (constraint,)
+        if dep_name in assigned and not req.selector(assigned[dep_name]):
+          self._add_conflict(dep_name, new_constraints[dep_name], [assigned[dep_name]])
+          facts = set([(dep_name, str(req.selector), name), (dep_name, str(assigned[dep_name]))])
+          break
+      else:
+        self._prefetch_infos([n for n in deps if n not in new_assigned], new_constraints)
+        result, facts = self._search(new_assigned, new_constraints)
+        if result is not None:
+          return result, None
+
+      # If the failure does not depend on this package, no other version
+      # of it can help.
+      own = set(f for f in facts if (f[2] if len(f) == 3 else f[0]) == name)
+      if not own:
+        return None, facts
+      explanation.update(facts - own)
+
+    return self._fail(explanation)
+
+  def solve(self, deps, parent=None):
+    """
+    Solves the dependency tree of the dictionary *deps* that maps package
+    names to #manifest.Requirement objects or requirement strings. Requirements
+    that are not registry requirements are ignored. *parent* is the
+    identifier of the package that requires *deps*, it is used in error
+    messages only.
+
+    Returns a #Solution. Raises #SolveError if no solution exists.
+    """
+
+    self._failed = []
+    self._conflict = None
+    reqs = self.registry_requirements(deps)
+    # Fixed packages may have changed since the last call.
+    self._fixed = dict.fromkeys(reqs)
+    self._matching = {}
+    list(self.map(self._source, [r for r in reqs.values() if r.name not in self._sources]))
+    constraints = dict((n, (Constraint(r.selector, parent),)) for n, r in reqs.items())
+    self._prefetch_infos(list(reqs), constraints)
+    assigned = self._search(collections.OrderedDict(), constraints)[0]
+    if assigned is None:
+      raise self._conflict
+
+    packages = collections.OrderedDict()
+    registries = {}
+    requirements = [(parent, r) for r in reqs.values()]
+    for name, version in assigned.items():
+      ident = '{}@{}'.format(name, version)
+      requirements.extend((ident, r) for r in self._get_dependencies(name, version).values())
+      if self._fixed.get(name) is None:
+        packages[name] = self._infos[(name, str(version))]
+        registries[name] = self._sources[name][0]
+    return Solution(packages, registries, requirements)
@@ -0,0 +1,198 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+import manifest from './manifest'
+import semver from './semver'
+import _registry from './registry'
+import {Solver, SolveError} from './solver'
+
+
+class FakeRegistry(object):
+
+  def __init__(self, packages, list_versions=True):
+    self.packages = packages
+    self.list_versions = list_versions
+    self.requests = []
+
+  def versions(self, package_name):
+    self.requests.append(('versions', package_name))
+    if package_name not in self.packages:
+      raise _registry.PackageNotFound(package_name, semver.Selector('*'))
+    if not self.list_versions:
+      return None
+    return [semver.Version(x) for x in self.packages[package_name]]
+
+  def find_package(self, package_name, selector):
+    self.requests.append(('find', package_name, str(selector)))
+    return self._lookup(package_name, selector)
+
+  def _lookup(self, package_name, selector):
+    versions = self.packages.get(package_name, {})
+    version = selector.best_of([semver.Version(x) for x in versions])
+    if version is None:
+      raise _registry.PackageNotFound(package_name, selector)
+    data = {'name': package_name, 'version': str(version),
+      'dependencies': versions[str(version)]}
+    return _registry.PackageInfo(package_name, version, manifest.Manifest(None, data))
+
+
+class BatchRegistry(FakeRegistry):
+
+  def find_packages(self, queries):
+    self.requests.append(('find_packages', tuple(n for n, _ in queries)))
+    result = []
+    for name, selector in queries:
+      try:
+        result.append(self._lookup(name, selector))
+      except _registry.PackageNotFound:
+        result.append(None)
+    return result
+
+
+def solve(packages, deps, registry_class=FakeRegistry, **kwargs):
+  registry = registry_class(packages, **kwargs)
+  solver = Solver(lambda req: [registry])
+  solution = solver.solve(deps)
+  return registry, dict((k, str(v.version)) for k, v in solution.packages.items())
+
+
+def test_newest():
+  packages = {
+    'a': {'1.0.0': {'b': '>=1.0.0'}, '1.1.0': {'b': '>=1.2.0'}, '2.0.0': {}},
+    'b': {'1.0.0': {}, '1.2.0': {}, '1.3.0': {}},
+  }
+  _, result = solve(packages, {'a': '<2.0.0'})
+  assert_equals(result, {'a': '1.1.0', 'b': '1.3.0'})
+
+
+def test_backtrack():
+  # The newest "a" requires a "c" that conflicts with the one of "b".
+  packages = {
+    'a': {'1.0.0': {'c': '~1.0.0'}, '1.1.0': {'c': '~2.0.0'}},
+    'b': {'1.0.0': {'c': '<2.0.0'}},
+    'c': {'1.0.0': {}, '1.0.5': {}, '2.0.0': {}},
+  }
+  _, result = solve(packages, {'a': '<2.0.0', 'b': '1.0.0'})
+  assert_equals(result, {'a': '1.0.0', 'b': '1.0.0', 'c': '1.0.5'})
+
+
+def test_diamond():
+  # Every version is looked up once, even though there are many paths.
+  packages = {'top': {'1.0.0': dict(('m{}'.format(i), '*') for i in range(20))}}
+  for i in range(20):
+    packages['m{}'.format(i)] = {'1.0.0': {'bottom': '>=1.0.0'}}
+  packages['bottom'] = {'1.0.0': {}, '1.1.0': {}}
+  registry, result = solve(packages, {'top': '*'})
+  assert_equals(result['bottom'], '1.1.0')
+  assert_equals(len(result), 22)
+  assert_equals(len(registry.requests), len(set(registry.requests)))
+
+
+def test_conflict():
+  packages = {
+    'a': {'1.0.0': {'c': '~1.0.0'}},
+    'b': {'1.0.0': {'c': '>=2.0.0'}},
+    'c': {'1.0.0': {}, '2.0.0': {}},
+  }
+  with assert_raises(SolveError) as cm:
+    solve(packages, {'a': '*', 'b': '*'})
+  exc = cm.exception
+  assert_equals(exc.name, 'c')
+  assert_equals(sorted(str(c) for c in exc.constraints),
+    ['>=2.0.0 (required by b@1.0.0)', '~1.0.0 (required by a@1.0.0)'])
+  assert 'available: 1.0.0, 2.0.0' in str(exc)
+
+
+def test_conflict_resets_between_solves():
+  packages = {
+    'a': {'1.0.0': {'c': '~1.0.0'}, '1.1.0': {'c': '~2.0.0'}},
+    'b': {'1.0.0': {'c': '<2.0.0'}},
+    'c': {'1.0.0': {}, '1.0.5': {}, '2.0.0': {}},
+    'x': {'1.0.0': {}},
+  }
+  registry = FakeRegistry(packages)
+  solver = Solver(lambda req: [registry])
+  solver.solve({'a': '<2.0.0', 'b': '1.0.0'})
+  with assert_raises(SolveError) as cm:
+    solver.solve({'x': '>=5.0.0'})
+  assert_equals(cm.exception.name, 'x')
+
+
+def test_backtracking_diamond():
+  # Every "m" pins "bottom" to 1.x and the newer "z" versions need a 2.x, so
+  # the search backtracks over all "m" versions unless it learns that the
+  # conflict does not depend on them.
+  count = 12
+  top = dict(('m{}'.format(i), '*') for i in range(count))
+  top['z'] = '*'
+  packages = {
+    'top': {'1.0.0': top},
+    'z': dict(('2.{}.0'.format(i), {'w': '*'}) for i in range(3)),
+    'w': {'1.0.0': {'bottom': '~2.0.0'}},
+    'bottom': {'1.0.0': {}, '2.0.0': {}},
+  }
+  for i in range(count):
+    packages['m{}'.format(i)] = dict(('1.0.{}'.format(j), {'bottom': '~1.0.0'}) for j in range(3))
+
+  registry = FakeRegistry(packages)
+  solver = Solver(lambda req: [registry])
+  with assert_raises(SolveError) as cm:
+    solver.solve({'top': '*'})
+  assert_equals(cm.exception.name, 'bottom')
+  assert len(solver._failed) < 20, len(solver._failed)
+
+  packages['z']['1.0.0'] = {}
+  _, result = solve(packages, {'top': '*'})
+  assert_equals(result['z'], '1.0.0')
+  assert_equals(result['bottom'], '1.0.0')
+
+
+def test_not_found():
+  with assert_raises(SolveError) as cm:
+    solve({}, {'a': '*'})
+  assert_equals(str(cm.exception), 'package "a" could not be located\n  a@* (required by root)')
+
+
+def test_without_version_listing():
+  packages = {
+    'a': {'1.0.0': {'c': '~1.0.0'}},
+    'b': {'1.0.0': {'c': '>=1.0.0'}},
+    'c': {'1.0.0': {}, '1.0.1': {}, '2.0.0': {}},
+  }
+  _, result = solve(packages, {'a': '*', 'b': '*'}, list_versions=False)
+  assert_equals(result, {'a': '1.0.0', 'b': '1.0.0', 'c': '1.0.1'})
+
+
+def test_batched_manifests():
+  # Every level of the tree is fetched with one batch request.
+  packages = {}
+  for level in range(5):
+    for i in range(3):
+      deps = dict(('p{}-{}'.format(level + 1, j), '*') for j in range(3)) if level < 4 else {}
+      packages['p{}-{}'.format(level, i)] = {'1.0.0': deps, '0.9.0': {}}
+  registry, result = solve(packages, {'p0-0': '*', 'p0-1': '*'}, BatchRegistry)
+  assert_equals(len(result), 14)
+  assert all(v == '1.0.0' for v in result.values())
+  kinds = [r[0] for r in registry.requests]
+  assert_equals(kinds.count('find_packages'), 5)
+  assert_equals(kinds.count('find'), 0)
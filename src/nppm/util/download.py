@@ -20,13 +20,29 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import hashlib
 import posixpath
 import requests
+import socket
 import sys
 import time
+import urllib3
+import text from './text'
 
 from six.moves import urllib
 
+#: The first and the largest size of the chunks that are read from a
+#: response. The size grows while data arrives faster than #CHUNK_TIME.
+MIN_CHUNK_SIZE = 128 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+CHUNK_TIME = 0.1
+
+#: Exceptions that are considered a transient network error which is
+#: retried by #ResponseReader (see #is_transient_error()).
+NETWORK_ERRORS = (requests.ConnectionError, requests.Timeout,
+  requests.exceptions.ChunkedEncodingError, urllib3.exceptions.HTTPError,
+  socket.error)
+
 
 def get_response_filename(response):
   """
@@ -53,30 +69,66 @@ def parse_content_disposition(disp):
   return data
 
 
+def is_transient_error(exc):
+  """
+  Returns #True if *exc* is a network error or a server error (HTTP 5xx)
+  for which it is worth to try the request again.
+  """
+
+  if isinstance(exc, requests.HTTPError):
+    return exc.response is not None and exc.response.status_code >= 500
+  return isinstance(exc, NETWORK_ERRORS)
+
+
+class IntegrityError(Exception):
+  """
+  Raised by #download() if the SHA256 digest of the downloaded data does not
+  match the expected digest.
+  """
+
+  def __init__(self, url, expected, actual):
+    self.url = url
+    self.expected = expected
+    self.actual = actual
+
+  def __str__(self):
+    return 'SHA256 mismatch for "{}": expected {}, got {}'.format(
+      self.url, self.expected, self.actual)
+
+
 class DownloadProgress:
   """
-  Progress-printer for the #download_to_fileobj() function.
+  Progress-printer for #download_to_fileobj() and #ResponseReader. The
+  progress is rendered at most *fps* times per second.
   """
 
-  def __init__(self, width=50, prefix='', print_num_progress=True, print_performance=True):
+  def __init__(self, width=50, prefix='', print_num_progress=True,
+               print_performance=True, fps=10):
     self.width = width
     self.prefix = prefix
     self.spin_offset = 0
     self.print_num_progress = print_num_progress
     self.print_performance = print_performance
+    self.interval = 1.0 / fps
     self.last_update = 0
     self.last_bytes_written = 0
 
   def init(self, content_length, response):
-    pass
+    self.last_update = time.time()
+    self.last_bytes_written = 0
 
   def finish(self, content_length, bytes_written):
+    self.render(content_length, bytes_written)
     sys.stdout.write('\n')
 
   def update(self, content_length, bytes_written):
+    if time.time() - self.last_update >= self.interval:
+      self.render(content_length, bytes_written)
+
+  def render(self, content_length, bytes_written):
     sys.stdout.write('\r\33[K' + self.prefix)
     if content_length:
-      count = int(bytes_written / content_length * self.width)
+      count = min(int(bytes_written / content_length * self.width), self.width)
       sys.stdout.write('[' + '=' * count + ' ' * (self.width - count) + ']')
     else:
       sys.stdout.write('[' + '~' * self.spin_offset + '=' +
@@ -84,21 +136,65 @@ class DownloadProgress:
       self.spin_offset = (self.spin_offset + 1) % self.width
 
     if self.print_num_progress:
-      # TODO: Convert bytes to human readable
-      sys.stdout.write(' ({}/{})'.format(bytes_written, content_length))
+      sys.stdout.write(' ({}/{})'.format(text.human_size(bytes_written),
+        text.human_size(content_length) if content_length else '?'))
 
     if self.print_performance:
       delta_time = time.time() - self.last_update
       delta_bytes = bytes_written - self.last_bytes_written
       if delta_time > 0.0:
-        # TODO: Convert bytes to human readable
         performance = delta_bytes / delta_time
-        sys.stdout.write(' {} Bps'.format(performance))
-      self.last_update = time.time()
-      self.last_bytes_written = bytes_written
+        sys.stdout.write(' {}/s'.format(text.human_size(int(performance))))
+    sys.stdout.flush()
+    self.last_update = time.time()
+    self.last_bytes_written = bytes_written
+
+
+def iter_chunks(response, buffer=None):
+  """
+  Iterates over the content of a streamed #requests.Response in chunks
+  that grow from #MIN_CHUNK_SIZE up to #MAX_CHUNK_SIZE while the data
+  arrives quickly. If the response content is not encoded, the chunks are
+  read directly into *buffer* (a #bytearray of at least #MAX_CHUNK_SIZE
+  bytes, allocated if omitted) and yielded as #memoryview#s that are only
+  valid until the next chunk is read.
+  """
+
+  raw = getattr(response, 'raw', None)
+  encoding = response.headers.get('Content-Encoding', 'identity')
+  chunk_size = MIN_CHUNK_SIZE
+
+  if raw is not None and hasattr(raw, 'readinto') and encoding == 'identity':
+    if buffer is None:
+      buffer = bytearray(MAX_CHUNK_SIZE)
+    view = memoryview(buffer)
+    while True:
+      tstart = time.time()
+      count = raw.readinto(view[:chunk_size])
+      if not count:
+        break
+      yield view[:count]
+      chunk_size = _adapt_chunk_size(chunk_size, time.time() - tstart)
+  else:
+    # iter_content() decodes the content but keeps its chunk size.
+    for data in response.iter_content(chunk_size=chunk_size):
+      yield data
 
 
-def download_to_fileobj(response, fp, progress=False, chunk_size=50):
+def _adapt_chunk_size(chunk_size, elapsed):
+  if elapsed < CHUNK_TIME / 2:
+    return min(chunk_size * 2, MAX_CHUNK_SIZE)
+  if elapsed > CHUNK_TIME * 2:
+    return max(chunk_size // 2, MIN_CHUNK_SIZE)
+  return chunk_size
+
+
+def download_to_fileobj(response, fp, progress=False):
+  """
+  Writes the content of the streamed *response* to *fp*. Returns the number
+  of bytes written. Use #download() to resume interrupted transfers.
+  """
+
   try:
     content_length = int(response.headers.get('Content-Length', 'spam'))
   except ValueError:
@@ -110,10 +206,199 @@ def download_to_fileobj(response, fp, progress=False, chunk_size=50):
   if progress:
     progress.init(content_length, response)
   bytes_written = 0
-  for data in response.iter_content(chunk_size=chunk_size):
+  for data in iter_chunks(response):
     fp.write(data)
     bytes_written += len(data)
     if progress:
       progress.update(content_length, bytes_written)
   if progress:
     progress.finish(content_length, bytes_written)
+  return bytes_written
+
+
+class ResponseReader(object):
+  """
+  A file-like object that reads the content of an HTTP response while it
+  arrives, eg. to pass it to #tarfile.open() in stream mode. Computes the
+  SHA256 digest and size of the data that passes through it.
+
+  If the connection breaks, the request is sent again with a `Range` header
+  to resume where the transfer stopped, up to *retries* times in a row with
+  an exponential *backoff*. Servers that ignore the `Range` header send the
+  whole content again, and the part that has already been read is skipped.
+
+  # Parameters
+  request (function): A function that accepts a dictionary of additional
+    HTTP headers and returns a streamed #requests.Response.
+  progress (bool, DownloadProgress): Progress printer.
+  retries (int): The number of times a request is retried.
+  backoff (float): The seconds to wait before the first retry. The time is
+    doubled for every further retry.
+  """
+
+  def __init__(self, request, progress=False, retries=3, backoff=0.5):
+    if progress is True:
+      progress = DownloadProgress()
+    self.request = request
+    self.progress = progress
+    self.retries = retries
+    self.backoff = backoff
+    self.url = None
+    self.content_length = None
+    self.size = 0
+    self._buffer = bytearray(MAX_CHUNK_SIZE)
+    self._chunks = None
+    self._response = None
+    self._pending = b''
+    self._hasher = hashlib.sha256()
+    self._finished = False
+
+  def _open(self):
+    headers = {'Range': 'bytes={}-'.format(self.size)} if self.size else {}
+    response = self.request(headers)
+    try:
+      response.raise_for_status()
+      try:
+        length = int(response.headers.get('Content-Length', 'spam'))
+      except ValueError:
+        length = None
+      skip = 0
+      if self.size and response.status_code != 206:
+        skip = self.size
+      elif self.size and length is not None:
+        length += self.size
+      if self._response is None:
+        self.url = response.url
+        self.content_length = length
+        if self.progress:
+          self.progress.init(length, response)
+    except:
+      response.close()
+      raise
+    self._response = response
+    self._chunks = iter_chunks(response, self._buffer)
+    return skip
+
+  def _close_response(self):
+    if self._response is not None:
+      self._response.close()
+    self._chunks = None
+
+  def _next_chunk(self):
+    """
+    Returns the next chunk of data that has not been read before, or #None
+    at the end of the content.
+    """
+
+    attempt = 0
+    skip = 0
+    while True:
+      try:
+        if self._chunks is None:
+          skip = self._open()
+        chunk = next(self._chunks)
+      except StopIteration:
+        if skip:
+          raise IOError('"{}" ended before the resumed position'.format(self.url))
+        self._close_response()
+        return None
+      except NETWORK_ERRORS + (requests.HTTPError,) as exc:
+        self._close_response()
+        if attempt >= self.retries or not is_transient_error(exc):
+          raise
+        time.sleep(self.backoff * (2 ** attempt))
+        attempt += 1
+        continue
+      if skip:
+        if len(chunk) <= skip:
+          skip -= len(chunk)
+          continue
+        chunk, skip = chunk[skip:], 0
+      return chunk
+
+  def iter_chunks(self):
+    """
+    Iterates over the remaining content. The yielded chunks may be views of
+    an internal buffer that are only valid until the next chunk is read.
+    """
+
+    if self._pending:
+      chunk, self._pending = self._pending, b''
+      yield chunk
+    while not self._finished:
+      chunk = self._next_chunk()
+      if chunk is None:
+        self._finished = True
+        if self.progress:
+          self.progress.finish(self.content_length, self.size)
+        break
+      self._hasher.update(chunk)
+      self.size += len(chunk)
+      if self.progress:
+        self.progress.update(self.content_length, self.size)
+      yield chunk
+
+  def read(self, size=-1):
+    parts = []
+    length = 0
+    for chunk in self.iter_chunks():
+      if size >= 0 and length + len(chunk) > size:
+        # The rest of the chunk is kept as a view, it stays valid because
+        # the next chunk is only read after it has been consumed.
+        chunk = memoryview(chunk)
+        parts.append(chunk[:size - length].tobytes())
+        self._pending = chunk[size - length:]
+        break
+      parts.append(bytes(chunk))
+      length += len(chunk)
+      if size >= 0 and length == size:
+        break
+    return b''.join(parts)
+
+  def finish(self):
+    """
+    Reads the remaining data of the response. Call this before #sha256()
+    when the consumer might not have read everything (eg. the padding at
+    the end of a tar archive).
+    """
+
+    for _ in self.iter_chunks():
+      pass
+
+  def close(self):
+    self._close_response()
+
+  def sha256(self):
+    return self._hasher.hexdigest()
+
+
+def download(request, fp, sha256=None, progress=False, retries=3, backoff=0.5):
+  """
+  Downloads the content of an HTTP response into the file-like object *fp*
+  with a #ResponseReader, resuming interrupted transfers. If *sha256* is
+  specified, the digest of the content must match or an #IntegrityError is
+  raised.
+
+  Returns the #ResponseReader, which provides the `url`, `size` and
+  `sha256()` of the download.
+  """
+
+  reader = ResponseReader(request, progress, retries, backoff)
+  try:
+    for chunk in reader.iter_chunks():
+      fp.write(chunk)
+  finally:
+    reader.close()
+  if sha256 and reader.sha256() != sha256:
+    raise IntegrityError(reader.url, sha256, reader.sha256())
+  return reader
+
+
+def download_url(url, fp, session=None, timeout=30, **kwargs):
+  """
+  Downloads the file at *url* into *fp*. See #download().
+  """
+
+  get = (session or requests).get
+  request = lambda headers: get(url, headers=headers, stream=True, timeout=timeout)
+  return download(request, fp, **kwargs)
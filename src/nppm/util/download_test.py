@@ -0,0 +1,183 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+from six.moves import BaseHTTPServer
+import hashlib
+import io
+import threading
+import download from './download'
+
+DATA = bytes(bytearray(x % 251 for x in range(3 * download.MAX_CHUNK_SIZE + 17)))
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  Serves #DATA and honors `Range` headers. The server's *failures* list
+  holds the number of bytes after which to drop the connection for the
+  next requests, or the HTTP status code to reply with.
+  """
+
+  def do_GET(self):
+    self.server.requests.append(self.headers.get('Range'))
+    failure = self.server.failures.pop(0) if self.server.failures else None
+    if failure in (500, 503):
+      self.send_error(failure)
+      return
+    start = 0
+    if self.server.ranges and self.headers.get('Range'):
+      start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+      self.send_response(206)
+      self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(DATA) - 1, len(DATA)))
+    else:
+      self.send_response(200)
+    self.send_header('Content-Length', str(len(DATA) - start))
+    self.end_headers()
+    if failure is not None:
+      self.wfile.write(DATA[start:start + failure])
+      self.wfile.flush()
+      self.connection.shutdown(2)
+      self.close_connection = True
+      return
+    self.wfile.write(DATA[start:])
+
+  def log_message(self, *args):
+    pass
+
+
+def with_server(ranges=True, failures=()):
+  server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+  server.ranges = ranges
+  server.failures = list(failures)
+  server.requests = []
+  server.url = 'http://127.0.0.1:{}/archive.tar.gz'.format(server.server_address[1])
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+def fetch(server, **kwargs):
+  fp = io.BytesIO()
+  kwargs.setdefault('backoff', 0)
+  try:
+    reader = download.download_url(server.url, fp, **kwargs)
+  finally:
+    server.shutdown()
+    server.server_close()
+  assert_equals(fp.getvalue(), DATA)
+  return reader
+
+
+def test_download():
+  server = with_server()
+  reader = fetch(server, sha256=SHA256)
+  assert_equals(reader.size, len(DATA))
+  assert_equals(reader.sha256(), SHA256)
+  assert_equals(server.requests, [None])
+
+
+def test_download_resume():
+  server = with_server(failures=[100000, 500])
+  reader = fetch(server)
+  assert_equals(reader.sha256(), SHA256)
+  assert_equals(server.requests, [None, 'bytes=100000-', 'bytes=100000-'])
+
+
+def test_download_without_range_support():
+  server = with_server(ranges=False, failures=[200000])
+  reader = fetch(server, sha256=SHA256)
+  assert_equals(reader.size, len(DATA))
+  assert_equals(server.requests, [None, 'bytes=200000-'])
+
+
+def test_download_retries_exhausted():
+  # Retries are only counted while no data arrives.
+  server = with_server(failures=[0, 0, 0])
+  with assert_raises(download.NETWORK_ERRORS):
+    fetch(server, retries=2)
+
+
+def test_download_integrity():
+  server = with_server()
+  with assert_raises(download.IntegrityError):
+    fetch(server, sha256='0' * 64)
+
+
+def test_reader_read():
+  requests = []
+  def request(headers):
+    requests.append(headers)
+    return FakeResponse(DATA)
+  reader = download.ResponseReader(request)
+  assert_equals(reader.read(10), DATA[:10])
+  assert_equals(reader.read(download.MAX_CHUNK_SIZE), DATA[10:10 + download.MAX_CHUNK_SIZE])
+  assert_equals(reader.read(), DATA[10 + download.MAX_CHUNK_SIZE:])
+  assert_equals(reader.read(), b'')
+  assert_equals(reader.sha256(), SHA256)
+  assert_equals(requests, [{}])
+
+
+def test_reader_read_blocks():
+  reader = download.ResponseReader(lambda headers: FakeResponse(DATA))
+  blocks = []
+  while True:
+    block = reader.read(512)
+    if not block:
+      break
+    blocks.append(block)
+    # The rest of a chunk is not copied for every block.
+    assert not reader._pending or isinstance(reader._pending, memoryview)
+  assert_equals(b''.join(blocks), DATA)
+  assert_equals(reader.sha256(), SHA256)
+
+
+def test_adapt_chunk_size():
+  size = download.MIN_CHUNK_SIZE
+  size = download._adapt_chunk_size(size, 0)
+  assert_equals(size, download.MIN_CHUNK_SIZE * 2)
+  for i in range(10):
+    size = download._adapt_chunk_size(size, 0)
+  assert_equals(size, download.MAX_CHUNK_SIZE)
+  size = download._adapt_chunk_size(size, download.CHUNK_TIME * 3)
+  assert_equals(size, download.MAX_CHUNK_SIZE // 2)
+
+
+class FakeResponse(object):
+
+  status_code = 200
+  url = 'fake://archive.tar.gz'
+
+  def __init__(self, data):
+    self.data = data
+    self.headers = {'Content-Length': str(len(data))}
+
+  def raise_for_status(self):
+    pass
+
+  def iter_content(self, chunk_size):
+    for i in range(0, len(self.data), chunk_size):
+      yield self.data[i:i + chunk_size]
+
+  def close(self):
+    pass
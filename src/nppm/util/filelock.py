@@ -0,0 +1,95 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Advisory file locks that are shared between processes.
+"""
+
+import errno
+import os
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+  import msvcrt
+
+
+class FileLock(object):
+  """
+  An advisory lock on the file *filename*, which is created if it does not
+  exist. A *shared* lock can be held by multiple processes at the same
+  time, an exclusive lock excludes all other locks. On Windows, shared
+  locks are not supported and always succeed.
+  """
+
+  def __init__(self, filename, shared=False):
+    self.filename = filename
+    self.shared = shared
+    self._fd = None
+
+  def __repr__(self):
+    return '<FileLock "{}"{}>'.format(self.filename, ' shared' if self.shared else '')
+
+  def __enter__(self):
+    self.acquire()
+    return self
+
+  def __exit__(self, *a):
+    self.release()
+
+  @property
+  def locked(self):
+    return self._fd is not None
+
+  def acquire(self):
+    if self._fd is not None:
+      raise RuntimeError('{!r} is already acquired'.format(self))
+    dirname = os.path.dirname(self.filename)
+    if dirname and not os.path.isdir(dirname):
+      try:
+        os.makedirs(dirname)
+      except OSError as exc:
+        if exc.errno != errno.EEXIST:
+          raise
+    fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, int('666', 8))
+    try:
+      if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+      elif not self.shared:
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+    except:
+      os.close(fd)
+      raise
+    self._fd = fd
+
+  def release(self):
+    if self._fd is None:
+      return
+    try:
+      if fcntl:
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+      elif not self.shared:
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+    finally:
+      os.close(self._fd)
+      self._fd = None
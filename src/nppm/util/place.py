@@ -0,0 +1,131 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Places files into the install directory with the cheapest method that the
+filesystem supports: hardlinks (only for sources that are never modified,
+like the trees in the package cache), reflinks (copy-on-write clones),
+`copy_file_range()` (in-kernel copies) and regular copies as a fallback.
+"""
+
+import collections
+import errno
+import os
+import shutil
+import sys
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+#: The `FICLONE` ioctl of Linux (btrfs, XFS, ...).
+FICLONE = 0x40049409
+
+#: Errors that indicate that a method is not supported (for the combination
+#: of the source and destination filesystem).
+UNSUPPORTED_ERRORS = frozenset(getattr(errno, x) for x in (
+  'EXDEV', 'EPERM', 'EOPNOTSUPP', 'ENOTSUP', 'EINVAL', 'ENOSYS', 'ENOTTY',
+  'EMLINK') if hasattr(errno, x))
+
+
+def _unsupported():
+  return OSError(errno.ENOSYS, 'not supported on this platform')
+
+
+def hardlink(src, dst):
+  if not hasattr(os, 'link'):
+    raise _unsupported()
+  os.link(src, dst)
+
+
+def reflink(src, dst):
+  if fcntl is None or not sys.platform.startswith('linux'):
+    raise _unsupported()
+  with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def copy_file_range(src, dst):
+  if not hasattr(os, 'copy_file_range'):
+    raise _unsupported()
+  with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+    while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30):
+      pass
+
+
+def copy(src, dst):
+  shutil.copyfile(src, dst)
+
+
+class FilePlacer(object):
+  """
+  Places files with the first method in #METHODS that works. A method that
+  fails with one of the #UNSUPPORTED_ERRORS is not tried again for
+  following files. Hardlinks are only used if *hardlink* is #True.
+
+  # Attributes
+  counts (collections.Counter): The number of files placed per method.
+  """
+
+  METHODS = collections.OrderedDict([
+    ('hardlink', hardlink),
+    ('reflink', reflink),
+    ('copy_file_range', copy_file_range),
+    ('copy', copy),
+  ])
+
+  def __init__(self, hardlink=False):
+    self.counts = collections.Counter()
+    self.disabled = set()
+    if not hardlink:
+      self.disabled.add('hardlink')
+
+  def place(self, src, dst):
+    """
+    Places the file *src* at *dst*. Returns the name of the method that was
+    used.
+    """
+
+    for name, func in self.METHODS.items():
+      if name in self.disabled:
+        continue
+      try:
+        func(src, dst)
+      except (IOError, OSError) as exc:
+        if name == 'copy' or exc.errno not in UNSUPPORTED_ERRORS:
+          raise
+        self.disabled.add(name)
+        if name != 'hardlink' and os.path.isfile(dst):
+          os.remove(dst)
+        continue
+      self.counts[name] += 1
+      return name
+
+  def summary(self):
+    """
+    Returns a string like `12 hardlinked, 1 copied`.
+    """
+
+    labels = {'hardlink': 'hardlinked', 'reflink': 'reflinked',
+      'copy_file_range': 'copied in-kernel', 'copy': 'copied'}
+    return ', '.join('{} {}'.format(self.counts[x], labels[x])
+      for x in self.METHODS if self.counts[x])
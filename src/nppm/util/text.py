@@ -20,6 +20,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import re
+
 
 def truncate(message, from_start, from_end=None):
   """
@@ -36,3 +38,30 @@ def truncate(message, from_start, from_end=None):
       from_end -= len(message) - from_start
     part2 = message[-from_end:]
   return part1 + '...' + part2
+
+
+def human_size(num_bytes):
+  """
+  Formats a number of bytes as a human readable string, eg. `1.4 MB`.
+  """
+
+  for unit in ('B', 'kB', 'MB', 'GB'):
+    if abs(num_bytes) < 1000.0 or unit == 'GB':
+      break
+    num_bytes /= 1000.0
+  if unit == 'B':
+    return '{} B'.format(int(num_bytes))
+  return '{:.1f} {}'.format(num_bytes, unit)
+
+
+def parse_size(value):
+  """
+  Parses a size like `500M`, `2 GB` or `1024` into a number of bytes.
+  Raises a #ValueError if *value* is not a valid size.
+  """
+
+  units = {'': 1, 'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3}
+  match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmg]?)b?\s*$', value, re.I)
+  if not match:
+    raise ValueError('invalid size: {!r}'.format(value))
+  return int(float(match.group(1)) * units[match.group(2).lower()])
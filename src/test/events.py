@@ -0,0 +1,89 @@
+from nodepy.utils import events
+import nodepy
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+
+class TestEventBus(unittest.TestCase):
+
+  def test_subscribe(self):
+    parent = events.EventBus()
+    bus = events.EventBus(parent=parent)
+    self.assertFalse(bus)
+    received = []
+    callback = parent.subscribe(lambda ev: received.append((ev.name, ev.value)), 'a')
+    self.assertTrue(bus)
+    bus.emit('a', value=1)
+    bus.emit('b', value=2)
+    self.assertEqual(received, [('a', 1)])
+    parent.unsubscribe(callback, 'a')
+    self.assertFalse(bus)
+    bus.emit('a', value=3)
+    self.assertEqual(received, [('a', 1)])
+
+  @unittest.skipIf(not hasattr(sys, 'setswitchinterval'), 'Python 3 only')
+  def test_subscribe_from_threads(self):
+    bus = events.EventBus()
+    callbacks = [(lambda ev: None) for i in range(8)]
+    def worker(callback):
+      for i in range(200):
+        bus.subscribe(callback, 'a', 'b')
+        bus.unsubscribe(callback, 'b')
+    threads = [threading.Thread(target=worker, args=(x,)) for x in callbacks]
+    # Switch threads often to make lost updates likely without the lock.
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+      for thread in threads: thread.start()
+      for thread in threads: thread.join()
+    finally:
+      sys.setswitchinterval(interval)
+    self.assertEqual(len(bus._subscribers['a']), 8 * 200)
+    self.assertNotIn('b', bus._subscribers)
+
+
+class TestRuntimeEvents(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    with open(os.path.join(self.tempdir, 'a.py'), 'w') as fp:
+      fp.write('import b from "./b"\nvalue = b.value\n')
+    with open(os.path.join(self.tempdir, 'b.py'), 'w') as fp:
+      fp.write('value = 42\n')
+    with open(os.path.join(self.tempdir, 'c.py'), 'w') as fp:
+      fp.write('raise ValueError("c")\n')
+    self.ctx = nodepy.context.Context()
+    self.events = []
+    self.ctx.events.subscribe(self.events.append)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def test_load(self):
+    a = self.ctx.require(os.path.join(self.tempdir, 'a'), exports=False)
+    names = [(ev.name, getattr(ev, 'module', None) and ev.module.name) for ev in self.events]
+    self.assertEqual(names[:6], [('resolve_start', None), ('resolve_end', 'a'),
+      ('source_read', 'a'), ('preprocess', 'a'), ('preprocess', 'a'), ('compile', 'a')])
+    self.assertEqual(names[-1], ('exec_end', 'a'))
+    self.assertIn(('exec_end', 'b'), names)
+    timestamps = [ev.timestamp for ev in self.events]
+    self.assertEqual(timestamps, sorted(timestamps))
+
+    del self.events[:]
+    self.ctx.require(os.path.join(self.tempdir, 'b'))
+    self.assertEqual([ev.name for ev in self.events], ['resolve_start', 'resolve_end'])
+    self.assertTrue(self.events[1].cache_hit)
+
+  def test_errors(self):
+    with self.assertRaises(nodepy.base.ResolveError):
+      self.ctx.require(os.path.join(self.tempdir, 'missing'))
+    self.assertIsNone(self.events[-1].module)
+    self.assertIsInstance(self.events[-1].error, nodepy.base.ResolveError)
+    with self.assertRaises(ValueError):
+      self.ctx.require(os.path.join(self.tempdir, 'c'))
+    self.assertEqual(self.events[-1].name, 'load_error')
+    self.assertIs(self.events[-1].exc_info[0], ValueError)
@@ -9,7 +9,10 @@ import sys
 
 suite = unittest.TestSuite([
   unittest.defaultTestLoader.loadTestsFromModule(require('./utils')),
-  unittest.defaultTestLoader.loadTestsFromModule(require('./zippath'))
+  unittest.defaultTestLoader.loadTestsFromModule(require('./zippath')),
+  unittest.defaultTestLoader.loadTestsFromModule(require('./tracing')),
+  unittest.defaultTestLoader.loadTestsFromModule(require('./memory')),
+  unittest.defaultTestLoader.loadTestsFromModule(require('./events'))
 ])
 
 if require.main == module:
@@ -0,0 +1,65 @@
+from nodepy.utils import memory
+import json
+import nodepy
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+  from urllib.request import urlopen
+except ImportError:
+  from urllib2 import urlopen
+
+
+@unittest.skipIf(memory.tracemalloc is None, 'tracemalloc is not available')
+class TestMemoryReport(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    with open(os.path.join(self.tempdir, 'nodepy.json'), 'w') as fp:
+      json.dump({'name': 'leakpkg'}, fp)
+    with open(os.path.join(self.tempdir, 'leaky.py'), 'w') as fp:
+      fp.write(
+        'data = [bytearray(100000)]\n'
+        'def grow():\n'
+        '  data.append(bytearray(200000))\n')
+    self.was_tracing = memory.is_tracing()
+    memory.start()
+    self.ctx = nodepy.context.Context()
+    self.leaky = self.ctx.require(os.path.join(self.tempdir, 'leaky'))
+
+  def tearDown(self):
+    self.ctx.require.stoptracing()
+    if not self.was_tracing:
+      memory.tracemalloc.stop()
+    shutil.rmtree(self.tempdir)
+
+  def test_report(self):
+    report = self.ctx.require.memory_report()
+    module = report.modules['leakpkg/leaky']
+    self.assertEqual(module.package, 'leakpkg')
+    self.assertGreaterEqual(module.load_size, 100000)
+    self.assertLess(module.size, 100000)
+    self.assertGreaterEqual(report.packages['leakpkg'].total_size, 100000)
+
+  def test_diff(self):
+    before = self.ctx.require.memory_snapshot()
+    self.leaky.grow()
+    report = self.ctx.require.memory_report(since=before)
+    self.assertTrue(report.diff)
+    module = report.modules['leakpkg/leaky']
+    self.assertGreaterEqual(module.size, 200000)
+    self.assertLess(abs(module.load_size), 100000)
+    self.assertEqual(report.top_packages(1)[0].name, 'leakpkg')
+
+  def test_endpoint(self):
+    self.ctx.require.starttracing('http', options={'host': '127.0.0.1', 'port': 0})
+    url = 'http://127.0.0.1:{}/memory.json'.format(self.ctx.tracer.port)
+    data = json.loads(urlopen(url).read().decode('utf8'))
+    self.assertFalse(data['diff'])
+    self.leaky.grow()
+    data = json.loads(urlopen(url + '?diff&top=1').read().decode('utf8'))
+    self.assertTrue(data['diff'])
+    self.assertEqual(len(data['packages']), 1)
+    self.assertEqual(data['packages'][0]['name'], 'leakpkg')
@@ -0,0 +1,261 @@
+from nodepy.utils import tracing
+import json
+import nodepy
+import os
+import socket
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+  from urllib.request import urlopen
+except ImportError:
+  from urllib2 import urlopen
+
+
+class TestSamplingProfilerTracer(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    with open(os.path.join(self.tempdir, 'spin.py'), 'w') as fp:
+      fp.write(
+        'import time\n'
+        'def spin(seconds):\n'
+        '  end = time.time() + seconds\n'
+        '  while time.time() < end:\n'
+        '    pass\n')
+    self.ctx = nodepy.context.Context()
+    self.spin = self.ctx.require(os.path.join(self.tempdir, 'spin')).spin
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def test_sample(self):
+    tracer = tracing.SamplingProfilerTracer(context=self.ctx)
+    thread = threading.Thread(target=self.spin, args=(0.2,))
+    thread.start()
+    while thread.is_alive():
+      tracer.sample()
+      time.sleep(0.01)
+    self.assertGreater(tracer.samples, 0)
+    hot = {label: (own, total) for label, own, total in tracer.hot_functions()}
+    self.assertGreater(hot['spin:spin'][0], 0)
+    self.assertGreaterEqual(hot['threading:run'][1], hot['spin:spin'][1])
+
+  def test_label_of_late_module(self):
+    # Code that runs before its module is registered in the context gets
+    # labeled again once the module is known.
+    filename = os.path.join(self.tempdir, 'late.py')
+    source = 'import sys\ndef frame():\n  return sys._getframe()\n'
+    with open(filename, 'w') as fp:
+      fp.write(source)
+    namespace = {'__name__': 'unknown'}
+    exec(compile(source, filename, 'exec'), namespace)
+    frame = namespace['frame']()
+    tracer = tracing.SamplingProfilerTracer(context=self.ctx)
+    self.assertEqual(tracer._label(frame), 'unknown:frame')
+    self.ctx.require(os.path.join(self.tempdir, 'late'))
+    self.assertEqual(tracer._label(frame), 'late:frame')
+
+  def test_starttracing(self):
+    fname = os.path.join(self.tempdir, 'profile.folded')
+    report = os.path.join(self.tempdir, 'profile.txt')
+    self.ctx.require.starttracing('profile', options={'path': fname,
+      'report': report, 'frequency': 200})
+    try:
+      self.assertIsInstance(self.ctx.tracer, tracing.SamplingProfilerTracer)
+      self.spin(0.2)
+    finally:
+      self.ctx.require.stoptracing()
+    with open(fname) as fp:
+      lines = fp.read().splitlines()
+    self.assertTrue(any(';spin:spin ' in line for line in lines))
+    for line in lines:
+      stack, count = line.rsplit(' ', 1)
+      self.assertGreater(int(count), 0)
+    with open(report) as fp:
+      self.assertIn('spin:spin', fp.read())
+
+
+class TestHttpServerTracer(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    with open(os.path.join(self.tempdir, 'a.py'), 'w') as fp:
+      fp.write('value = require("./b").value\n')
+    with open(os.path.join(self.tempdir, 'b.py'), 'w') as fp:
+      fp.write('value = 42\n')
+    self.ctx = nodepy.context.Context()
+    self.ctx.require(os.path.join(self.tempdir, 'a'))
+    self.ctx.require(os.path.join(self.tempdir, 'b'))
+
+  def tearDown(self):
+    self.ctx.require.stoptracing()
+    shutil.rmtree(self.tempdir)
+
+  def test_endpoints(self):
+    self.ctx.require.starttracing('http', options={'host': '127.0.0.1', 'port': 0})
+    url = 'http://127.0.0.1:{}'.format(self.ctx.tracer.port)
+
+    def get(path):
+      return json.loads(urlopen(url + path).read().decode('utf8'))
+
+    stacks = get('/stacks.json')
+    main = [x for x in stacks if x['main']]
+    self.assertEqual(len(main), 1)
+    self.assertIn('test_endpoints', [x['name'] for x in main[0]['stack']])
+
+    metrics = get('/metrics.json')
+    self.assertEqual(metrics['modules_loaded'], 2)
+    self.assertEqual(metrics['context']['resolve'], 3)
+    self.assertEqual(metrics['context']['resolve_cache_hits'], 1)
+    self.assertEqual(metrics['context']['load'], 2)
+    self.assertEqual(len(metrics['gc']['counts']), 3)
+
+    modules = get('/modules.json')
+    self.assertEqual([x['name'] for x in modules], ['a', 'b'])
+    self.assertGreaterEqual(modules[0]['load_time'], modules[1]['load_time'])
+
+    self.assertIn(b'(main)', urlopen(url + '/').read())
+
+  @unittest.skipIf(not hasattr(socket, 'AF_UNIX'), 'no unix sockets')
+  def test_unix_socket(self):
+    path = os.path.join(self.tempdir, 'tracer.sock')
+    self.ctx.require.starttracing('http', options={'socket': path})
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    sock.sendall(b'GET /metrics.json HTTP/1.0\r\n\r\n')
+    response = b''
+    while True:
+      data = sock.recv(4096)
+      if not data: break
+      response += data
+    sock.close()
+    body = response.partition(b'\r\n\r\n')[2]
+    self.assertEqual(json.loads(body.decode('utf8'))['modules'], 2)
+    self.ctx.require.stoptracing()
+    self.assertFalse(os.path.exists(path))
+
+  @unittest.skipIf(not hasattr(socket, 'AF_UNIX'), 'no unix sockets')
+  def test_unix_socket_existing_file(self):
+    # A stale socket is replaced, but other files are never removed.
+    path = os.path.join(self.tempdir, 'tracer.sock')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    self.ctx.require.starttracing('http', options={'socket': path})
+    self.ctx.require.stoptracing()
+    self.assertFalse(os.path.exists(path))
+
+    with open(path, 'w') as fp:
+      fp.write('data')
+    with self.assertRaises(OSError):
+      self.ctx.require.starttracing('http', options={'socket': path})
+    with open(path) as fp:
+      self.assertEqual(fp.read(), 'data')
+
+
+class TestContentionTracer(unittest.TestCase):
+
+  def test_blocked_threads(self):
+    event = threading.Event()
+    thread = threading.Thread(target=event.wait, name='waiter')
+    thread.start()
+    sleeper = threading.Thread(target=time.sleep, args=(0.5,), name='sleeper')
+    sleeper.start()
+    try:
+      tracer = tracing.ContentionTracer(threshold=3)
+      for i in range(3):
+        tracer.sample()
+        time.sleep(0.01)
+      blocked = {x['name']: x for x in tracer.blocked_threads()}
+      self.assertIn('waiter', blocked)
+      self.assertEqual(blocked['waiter']['samples'], 3)
+      self.assertIn('in wait', blocked['waiter']['location'])
+      self.assertEqual(blocked['waiter']['call'], 'acquire')
+      self.assertNotIn('sleeper', blocked)
+    finally:
+      event.set()
+      thread.join()
+      sleeper.join()
+
+  @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+  def test_fork(self):
+    tracer = tracing.ContentionTracer(track_locks=True)
+    event = threading.Event()
+    thread = threading.Thread(target=event.wait)
+    try:
+      lock = threading.Lock()
+      thread.start()
+      pid = os.fork()
+      if pid == 0:
+        try:
+          with lock:
+            # Only the forking thread survives if threading reinitialized
+            # the locks of the other threads.
+            code = 0 if threading.enumerate() == [threading.current_thread()] else 1
+        except BaseException:
+          code = 2
+        os._exit(code)
+    finally:
+      tracer.stop(wait=False)
+      event.set()
+      thread.join()
+    self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+  def test_acquire_timeout(self):
+    lock = tracing.TrackedLock('test')
+    lock.acquire()
+    start = time.time()
+    self.assertFalse(lock.acquire(True, 0.05))
+    self.assertGreaterEqual(time.time() - start, 0.04)
+    self.assertFalse(lock._poll(0.01))
+    lock.release()
+    self.assertTrue(lock._poll(0.01))
+    lock.release()
+
+  def test_deadlock(self):
+    tracer = tracing.ContentionTracer(track_locks=True)
+    try:
+      a, b = threading.Lock(), threading.RLock()
+      cond = threading.Condition(threading.RLock())
+    finally:
+      tracer.stop(wait=False)
+    self.assertIsInstance(a, tracing.TrackedLock)
+    self.assertIsInstance(b, tracing.TrackedRLock)
+    self.assertNotIsInstance(threading.Lock(), tracing.TrackedLock)
+
+    with cond:
+      self.assertFalse(cond.wait(0.01))
+
+    barrier = threading.Event()
+    def worker(first, second):
+      with first:
+        barrier.wait()
+        if second.acquire(timeout=1.0):
+          second.release()
+    threads = [threading.Thread(target=worker, args=(a, b)),
+               threading.Thread(target=worker, args=(b, a))]
+    for thread in threads:
+      thread.start()
+    try:
+      barrier.set()
+      for i in range(100):
+        if a.waiters and b.waiters:
+          break
+        time.sleep(0.01)
+      cycles = tracing.wait_for_cycles([a, b])
+      self.assertEqual(len(cycles), 1)
+      self.assertEqual(set(lock for _, lock in cycles[0]), set([a, b]))
+      report = tracer.report()
+      self.assertEqual(len(report['cycles']), 1)
+      names = [x['name'] for x in report['locks']]
+      self.assertIn(a.name, names)
+      self.assertIn(b.name, names)
+      self.assertIn('tracing.py:', a.name)
+    finally:
+      for thread in threads:
+        thread.join()
+    self.assertEqual(tracing.wait_for_cycles([a, b]), [])
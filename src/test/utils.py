@@ -1,8 +1,22 @@
 
+from nodepy.utils import fetch
 from nodepy.utils.path import UrlPath
+import hashlib
 import json
+import nodepy
+import shutil
 import socket
+import tempfile
+import threading
+import time
 import unittest
+from six.moves.socketserver import ThreadingMixIn
+
+try:
+  from BaseHTTPServer import HTTPServer
+  from SimpleHTTPServer import SimpleHTTPRequestHandler
+except ImportError:
+  from http.server import HTTPServer, SimpleHTTPRequestHandler
 
 REMOTE_SERVER = "www.google.com"
 
@@ -26,3 +40,199 @@ class TestUrlPath(unittest.TestCase):
     with path.open() as fp:
       data = json.load(fp)
     self.assertEquals(data['args'], {'abc': 'def'})
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+
+class _ModuleHandler(SimpleHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+  files = {}
+  delays = {}
+  requests = []
+  connections = []
+
+  def setup(self):
+    SimpleHTTPRequestHandler.setup(self)
+    self.connections.append(self.client_address)
+
+  def do_GET(self, head=False):
+    method = 'HEAD' if head else 'GET'
+    self.requests.append((self.path, self.headers.get('If-None-Match'), method))
+    time.sleep(self.delays.get(self.path, 0))
+    content = self.files.get(self.path)
+    if content is None:
+      self.send_response(404)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    etag = '"{}"'.format(hashlib.sha1(content).hexdigest())
+    if self.headers.get('If-None-Match') == etag:
+      self.send_response(304)
+      self.end_headers()
+      return
+    self.send_response(200)
+    self.send_header('ETag', etag)
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    if not head:
+      self.wfile.write(content)
+
+  def do_HEAD(self):
+    self.do_GET(head=True)
+
+  def log_message(self, *args):
+    pass
+
+
+class HttpServerTestCase(unittest.TestCase):
+  """
+  Serves the #_ModuleHandler.files from a local HTTP server.
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    cls.httpd = _ThreadingHTTPServer(('127.0.0.1', 0), _ModuleHandler)
+    cls.thread = threading.Thread(target=cls.httpd.serve_forever)
+    cls.thread.daemon = True
+    cls.thread.start()
+    cls.base_url = 'http://127.0.0.1:{}'.format(cls.httpd.server_address[1])
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.httpd.shutdown()
+    cls.httpd.server_close()
+
+  def setUp(self):
+    _ModuleHandler.files.clear()
+    _ModuleHandler.delays.clear()
+    del _ModuleHandler.requests[:]
+    del _ModuleHandler.connections[:]
+    self.tempdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+
+class TestHttpCache(HttpServerTestCase):
+
+  def setUp(self):
+    super(TestHttpCache, self).setUp()
+    _ModuleHandler.files['/lib/main.py'] = b"value = require('./other').value\n"
+    _ModuleHandler.files['/lib/other.py'] = b"value = 42\n"
+    self.fetcher = fetch.UrlFetcher(fetch.HttpCache(self.tempdir))
+
+  def tearDown(self):
+    self.fetcher.close()
+    super(TestHttpCache, self).tearDown()
+
+  def test_revalidate(self):
+    url = self.base_url + '/lib/other.py'
+    self.assertEqual(self.fetcher.fetch(url), b'value = 42\n')
+    self.assertEqual(self.fetcher.fetch(url), b'value = 42\n')
+    self.assertEqual(len(_ModuleHandler.requests), 2)
+    self.assertIsNone(_ModuleHandler.requests[0][1])
+    self.assertIsNotNone(_ModuleHandler.requests[1][1])
+
+  def test_offline(self):
+    url = self.base_url + '/lib/other.py'
+    self.fetcher.fetch(url)
+    self.fetcher.offline = True
+    self.assertEqual(self.fetcher.fetch(url), b'value = 42\n')
+    self.assertEqual(len(_ModuleHandler.requests), 1)
+    with self.assertRaises(fetch.OfflineError):
+      self.fetcher.fetch(self.base_url + '/lib/main.py')
+
+  def test_integrity(self):
+    url = self.base_url + '/lib/other.py'
+    digest = hashlib.sha256(b'value = 42\n').hexdigest()
+    self.assertEqual(self.fetcher.fetch(url + '#sha256=' + digest), b'value = 42\n')
+    with self.assertRaises(fetch.IntegrityError):
+      self.fetcher.fetch(url + '#sha256=' + '0' * 64)
+
+  def test_require(self):
+    ctx = nodepy.context.Context()
+    ctx.fetcher = self.fetcher
+    path = UrlPath(self.base_url + '/lib/main.py', fetcher=self.fetcher)
+    module = ctx.resolve(path)
+    ctx.load_module(module)
+    self.assertEqual(module.namespace.value, 42)
+
+
+class TestUrlFetcherTransport(HttpServerTestCase):
+
+  def setUp(self):
+    super(TestUrlFetcherTransport, self).setUp()
+    _ModuleHandler.files['/lib/main.py'] = (b"a = require('./a').value\n"
+      b"import b from './b'\nvalue = a + b.value\n")
+    _ModuleHandler.files['/lib/a.py'] = b"value = require('./c').value\n"
+    _ModuleHandler.files['/lib/b.py'] = b"value = 2\n"
+    _ModuleHandler.files['/lib/c.py'] = b"value = 40\n"
+    self.fetcher = fetch.UrlFetcher()
+
+  def tearDown(self):
+    self.fetcher.close()
+    super(TestUrlFetcherTransport, self).tearDown()
+
+  def test_keepalive(self):
+    self.fetcher.prefetch_workers = 0
+    for name in ('a', 'b', 'c'):
+      self.fetcher.fetch(self.base_url + '/lib/{}.py'.format(name))
+    self.assertEqual(len(_ModuleHandler.requests), 3)
+    self.assertEqual(len(_ModuleHandler.connections), 1)
+
+  def test_stale_connection(self):
+    self.fetcher.fetch(self.base_url + '/lib/b.py')
+    for conns in self.fetcher.pool._idle.values():
+      for conn in conns:
+        conn.sock.shutdown(socket.SHUT_RDWR)
+    self.assertEqual(self.fetcher.fetch(self.base_url + '/lib/c.py'), b'value = 40\n')
+
+  def test_exists(self):
+    path = UrlPath(self.base_url + '/lib/b.py', fetcher=self.fetcher)
+    self.assertTrue(path.exists())
+    self.assertTrue(path.is_file())
+    self.assertFalse(path.with_name('d.py').exists())
+    self.assertFalse(path.with_name('d.py').exists())
+    self.assertEqual([x[2] for x in _ModuleHandler.requests], ['HEAD', 'HEAD'])
+
+  def test_prefetch(self):
+    ctx = nodepy.context.Context()
+    ctx.fetcher = self.fetcher
+    path = UrlPath(self.base_url + '/lib/main.py', fetcher=self.fetcher)
+    module = ctx.resolve(path)
+    ctx.load_module(module)
+    self.assertEqual(module.namespace.value, 42)
+    requests = [(x[0], x[2]) for x in _ModuleHandler.requests]
+    self.assertEqual(sorted(requests), [('/lib/a', 'HEAD'), ('/lib/a.py', 'GET'),
+      ('/lib/b', 'HEAD'), ('/lib/b.py', 'GET'), ('/lib/c', 'HEAD'),
+      ('/lib/c.py', 'GET'), ('/lib/main.py', 'GET'), ('/lib/main.py', 'HEAD')])
+
+  def test_prefetch_probes(self):
+    self.fetcher.fetch(self.base_url + '/lib/main.py', prefetch=True)
+    for name in ('a', 'b'):
+      self.fetcher._probes[self.base_url + '/lib/' + name].wait()
+    for name in ('a.py', 'b.py', 'c.py'):
+      self.fetcher._pending[self.base_url + '/lib/' + name].wait()
+    del _ModuleHandler.requests[:]
+    # The requests without a suffix have been probed concurrently.
+    self.assertFalse(self.fetcher.exists(self.base_url + '/lib/a'))
+    self.assertFalse(self.fetcher.exists(self.base_url + '/lib/b'))
+    self.assertTrue(self.fetcher.exists(self.base_url + '/lib/a.py'))
+    self.assertEqual(_ModuleHandler.requests, [])
+
+  def test_require_package_while_prefetching(self):
+    # The `.py` suggestion for `./foo` is still being prefetched (and fails)
+    # when the resolver checks if it exists.
+    _ModuleHandler.files['/lib/main.py'] = b"value = require('./foo').value\n"
+    _ModuleHandler.files['/lib/foo/__init__.py'] = b"value = 42\n"
+    _ModuleHandler.delays['/lib/foo.py'] = 0.5
+    ctx = nodepy.context.Context()
+    ctx.fetcher = self.fetcher
+    path = UrlPath(self.base_url + '/lib/main.py', fetcher=self.fetcher)
+    module = ctx.resolve(path)
+    ctx.load_module(module)
+    self.assertEqual(module.namespace.value, 42)
+    self.assertFalse(self.fetcher.exists(self.base_url + '/lib/foo.py'))
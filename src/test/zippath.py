@@ -1,7 +1,14 @@
 
+from nodepy.utils.path import zippath, ZipPath
+from nodepy.utils.path.zippath import ZipArchiveRegistry
 import io
 import nodepy
 import os
+import pathlib2 as pathlib
+import shutil
+import six
+import tempfile
+import threading
 import unittest
 import zipfile
 
@@ -28,3 +35,169 @@ class TestZipPath(unittest.TestCase):
 
   def testRequireFromZip(self):
     self.ctx.require('ziptest')
+
+
+class TestZipArchiveRegistry(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.registry = ZipArchiveRegistry(max_open=1)
+
+  def tearDown(self):
+    self.registry.close_all()
+    shutil.rmtree(self.tempdir)
+
+  def make_zip(self, name, files):
+    filename = os.path.join(self.tempdir, name)
+    with zipfile.ZipFile(filename, 'w') as zipf:
+      for key, value in files.items():
+        zipf.writestr(key, value)
+    return filename
+
+  def testMake(self):
+    filename = self.make_zip('a.zip', {'index.py': b'a = 1\n'})
+    path = zippath.make(os.path.join(filename, 'index.py'), registry=self.registry)
+    self.assertIsInstance(path, ZipPath)
+    self.assertTrue(path.is_file())
+    with path.open('rb') as fp:
+      self.assertEqual(fp.read(), b'a = 1\n')
+    with self.assertRaises(ValueError):
+      zippath.make(os.path.join(self.tempdir, 'b.py'), registry=self.registry)
+
+  def testHandleLimit(self):
+    a = zippath.make(self.make_zip('a.zip', {'a.py': b'a'}) + '/a.py', registry=self.registry)
+    b = zippath.make(self.make_zip('b.zip', {'b.py': b'b'}) + '/b.py', registry=self.registry)
+    self.assertEqual(len(self.registry._handles), 1)
+    self.assertIsNone(a._zipf._zipf)
+    with a.open('rb') as fp:
+      self.assertEqual(fp.read(), b'a')
+    self.assertIsNone(b._zipf._zipf)
+    with b.open('rb') as fp:
+      self.assertEqual(fp.read(), b'b')
+
+  def testStaleArchive(self):
+    filename = self.make_zip('a.zip', {'a.py': b'a'})
+    path = zippath.make(filename + '/a.py', registry=self.registry)
+    old = path._zipf
+    self.registry.close_all()
+    new = self.registry.get(filename)
+    self.assertIsNot(old, new)
+    # Reading through the stale archive must not leak the handle of the new one.
+    with path.open('rb') as fp:
+      self.assertEqual(fp.read(), b'a')
+    self.assertEqual([x for x in (old, new) if x._zipf is not None], [old])
+    self.registry.close_all()
+    self.assertIsNone(old._zipf)
+
+  def testNegativeCache(self):
+    with self.assertRaises(ValueError):
+      zippath.make(os.path.join(self.tempdir, 'a.py'), registry=self.registry)
+    self.assertIs(self.registry._not_zip[self.tempdir], ZipArchiveRegistry._directory)
+
+  def testReplacedArchive(self):
+    filename = self.make_zip('a.zip', {'a.py': b'old'})
+    old = self.registry.get(filename)
+    os.remove(filename)
+    self.make_zip('a.zip', {'a.py': b'new', 'b.py': b''})
+    st = os.stat(filename)
+    os.utime(filename, (st.st_atime, st.st_mtime + 10))
+    new = self.registry.get(filename)
+    self.assertIsNot(old, new)
+    self.assertEqual(sorted(new.namelist()), ['a.py', 'b.py'])
+
+  def testReplacedWhileClosed(self):
+    # The archive is re-read when its handle is opened again, the member
+    # must not be read with the offsets from the old index.
+    filename = self.make_zip('a.zip', {'a.py': b'old'})
+    path = zippath.make(filename + '/a.py', registry=self.registry)
+    self.assertTrue(path.is_file())
+    self.registry.close_all()
+    os.remove(filename)
+    with zipfile.ZipFile(filename, 'w') as zipf:
+      zipf.writestr('b.py', b'b' * 100)
+      zipf.writestr('a.py', b'new')
+    st = os.stat(filename)
+    os.utime(filename, (st.st_atime, st.st_mtime + 10))
+    self.assertEqual(bytes(path.read_buffer()), b'new')
+    with path.open('rb') as fp:
+      self.assertEqual(fp.read(), b'new')
+
+  def testNegativeCacheLimit(self):
+    self.registry.max_not_zip = 2
+    for name in ('a.py', 'b.py', 'c.py'):
+      with open(os.path.join(self.tempdir, name), 'w'):
+        pass
+      self.assertIsNone(self.registry.get(os.path.join(self.tempdir, name)))
+    self.assertEqual(list(self.registry._not_zip),
+      [os.path.join(self.tempdir, x) for x in ('b.py', 'c.py')])
+
+  def testReadBuffer(self):
+    filename = os.path.join(self.tempdir, 'a.zip')
+    with zipfile.ZipFile(filename, 'w') as zipf:
+      zipf.writestr('stored.py', b'x = 1\n' * 100, zipfile.ZIP_STORED)
+      zipf.writestr('deflated.py', b'y = 2\n' * 100, zipfile.ZIP_DEFLATED)
+    stored = zippath.make(filename + '/stored.py', registry=self.registry)
+    deflated = zippath.make(filename + '/deflated.py', registry=self.registry)
+    self.assertEqual(bytes(stored.read_buffer()), b'x = 1\n' * 100)
+    self.assertEqual(bytes(deflated.read_buffer()), b'y = 2\n' * 100)
+    if not six.PY2:
+      self.assertIsInstance(stored.read_buffer(), memoryview)
+
+  def testReadBufferWhileEvicting(self):
+    # Another thread evicts the archive while its member header is parsed.
+    # The mapping must stay valid until the member has been sliced.
+    path = zippath.make(self.make_zip('a.zip', {'m.py': b'x' * 1000}) + '/m.py',
+      registry=self.registry)
+    struct = zippath.struct
+    class EvictingStruct(object):
+      def __getattr__(self, name):
+        return getattr(struct, name)
+      def unpack(self, fmt, data):
+        thread = threading.Thread(target=path._zipf.registry.close_all)
+        thread.start()
+        thread.join(0.2)
+        return struct.unpack(fmt, data)
+    zippath.struct = EvictingStruct()
+    try:
+      self.assertEqual(bytes(path.read_buffer()), b'x' * 1000)
+    finally:
+      zippath.struct = struct
+
+
+class TestZippedPackage(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    modules = os.path.join(self.tempdir, '.nodepy', 'modules')
+    os.makedirs(modules)
+    with zipfile.ZipFile(os.path.join(modules, 'foo.zip'), 'w') as zipf:
+      zipf.writestr('nodepy.json', b'{"name": "foo", "resolve_root": "lib"}')
+      zipf.writestr('lib/index.py', b"value = require('./other').value\n")
+      zipf.writestr('lib/other.py', b"value = 42\n")
+    self.ctx = nodepy.context.Context(pathlib.Path(self.tempdir))
+
+  def tearDown(self):
+    self.ctx.close()
+    shutil.rmtree(self.tempdir)
+
+  def testRequireFromZippedPackage(self):
+    self.assertEqual(self.ctx.require('foo').value, 42)
+    module = self.ctx.require('foo/other', exports=False)
+    self.assertIsInstance(module.filename, ZipPath)
+    self.assertEqual(module.name, 'foo/other')
+
+  def testRequireSubdirectoryPackage(self):
+    # Like the archives written by `nppm install --zip`, there are no
+    # entries for the directories.
+    filename = os.path.join(self.tempdir, '.nodepy', 'modules', 'bar.zip')
+    with zipfile.ZipFile(filename, 'w') as zipf:
+      zipf.writestr('nodepy.json', b'{"name": "bar"}')
+      zipf.writestr('index.py', b"value = 1\n")
+      zipf.writestr('sub/nodepy.json', b'{"name": "sub", "main": "main.py"}')
+      zipf.writestr('sub/main.py', b"value = 43\n")
+    self.assertEqual(self.ctx.require('bar/sub').value, 43)
+    path = zippath.make(filename)
+    self.assertTrue(path.joinpath('sub').is_dir())
+    self.assertFalse(path.joinpath('sub', 'main.py').is_dir())
+    self.assertFalse(path.joinpath('su').exists())
+    self.assertEqual(sorted(x.name for x in path.iterdir()), ['index.py', 'nodepy.json', 'sub'])